@@ -0,0 +1,1006 @@
+"""
+benchmark.py - Đo hiệu năng các thuật toán xử lý ảnh của PhotoLab
+So sánh cách cài đặt hiện tại với cách cài đặt cũ (nhiều lượt, dùng float) trên ảnh tổng hợp
+
+Chạy:
+    python benchmark.py                       # tất cả benchmark so sánh, ảnh 12 MP
+    python benchmark.py point_ops --mp 12 24 48
+    python benchmark.py suite --save-baseline baseline.json      # bộ chuẩn 1/12/24/48 MP
+    python benchmark.py suite --baseline baseline.json --threshold 0.2
+"""
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from processing import (ImageProcessor, Pipeline, BLUR_EXACT_MAX_KERNEL, BOKEH_MASKS,
+                        DEFAULT_RECIPE, SKIN_SMOOTHING_METHODS)
+from cache import StageCache
+from metrics import LatencyTracker
+from tiling import TiledExecutor, default_workers
+
+
+def synthetic_image(megapixels, seed=0):
+    """
+    Tạo ảnh RGB tổng hợp tỷ lệ 3:2 có gradient, vùng mịn và nhiễu (giống ảnh chụp thật)
+
+    Tham số:
+        megapixels: số megapixel của ảnh
+        seed: hạt giống sinh số ngẫu nhiên (cùng seed → cùng ảnh)
+
+    Trả về:
+        numpy array uint8 shape (h, w, 3)
+    """
+    w = int(round((megapixels * 1e6 * 1.5) ** 0.5))
+    h = int(round(megapixels * 1e6 / w))
+    rng = np.random.default_rng(seed)
+    # Nhiễu thô được phóng to → các mảng màu mịn, cộng thêm gradient và nhiễu hạt
+    coarse = rng.integers(0, 256, (max(2, h // 64), max(2, w // 64), 3), dtype=np.uint8)
+    image = cv2.resize(coarse, (w, h), interpolation=cv2.INTER_CUBIC)
+    gradient = np.linspace(-40, 40, w, dtype=np.float32)[None, :, None]
+    noise = rng.normal(0, 6, (h, w, 1)).astype(np.float32)
+    return np.clip(image + gradient + noise, 0, 255).astype(np.uint8)
+
+
+def time_call(func, repeat=3):
+    """
+    Đo thời gian chạy của func (lấy lần nhanh nhất sau một lần chạy khởi động)
+
+    Trả về:
+        (thời gian tốt nhất tính bằng giây, kết quả của lần chạy cuối)
+    """
+    result = func()
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def measure_alloc(func):
+    """
+    Đo đỉnh bộ nhớ cấp phát thêm khi gọi func (qua tracemalloc, gồm cả mảng numpy/OpenCV)
+
+    Trả về:
+        số byte cấp phát thêm ở thời điểm cao nhất trong lúc gọi
+    """
+    tracemalloc.start()
+    try:
+        base, _ = tracemalloc.get_traced_memory()
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak - base
+
+
+def max_abs_diff(a, b):
+    """Sai khác tuyệt đối lớn nhất giữa hai ảnh uint8"""
+    return int(np.abs(a.astype(np.int16) - b.astype(np.int16)).max())
+
+
+def psnr(reference, image):
+    """Peak Signal-to-Noise Ratio (dB) của image so với reference (uint8), inf nếu trùng khớp"""
+    mse = np.mean((reference.astype(np.float64) - image.astype(np.float64)) ** 2)
+    return float('inf') if mse == 0 else 10 * math.log10(255.0 ** 2 / mse)
+
+
+def ssim(reference, image):
+    """
+    Structural Similarity (Wang et al.) trên kênh sáng, cửa sổ Gaussian 11x11 sigma 1.5
+    Trả về giá trị trung bình trong [-1, 1] (1 = giống hệt)
+    """
+    if reference.ndim == 3:
+        reference = cv2.cvtColor(reference, cv2.COLOR_RGB2GRAY)
+        image = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+    x = reference.astype(np.float64)
+    y = image.astype(np.float64)
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+
+    def blur(a):
+        return cv2.GaussianBlur(a, (11, 11), 1.5)
+    mu_x, mu_y = blur(x), blur(y)
+    var_x = blur(x * x) - mu_x ** 2
+    var_y = blur(y * y) - mu_y ** 2
+    cov = blur(x * y) - mu_x * mu_y
+    ssim_map = ((2 * mu_x * mu_y + c1) * (2 * cov + c2) /
+                ((mu_x ** 2 + mu_y ** 2 + c1) * (var_x + var_y + c2)))
+    return float(ssim_map.mean())
+
+
+def print_table(title, header, rows):
+    """In bảng kết quả dạng cột căn lề"""
+    print(f"\n== {title} ==")
+    widths = [max(len(str(x)) for x in col) for col in zip(header, *rows)]
+    for row in [header] + rows:
+        print("  ".join(str(x).rjust(w) for x, w in zip(row, widths)))
+
+
+# === CÀI ĐẶT CŨ (để so sánh) ===
+
+def _legacy_brightness_contrast(image, brightness, contrast):
+    """apply_brightness_contrast trước khi dùng LUT: tính float32 trên toàn ảnh"""
+    img_float = image.astype(np.float32, copy=True)
+    if contrast != 0:
+        if contrast > 0:
+            alpha = 1.0 + (contrast / 100.0) * 2.0
+        else:
+            alpha = 1.0 + (contrast / 100.0) * 0.5
+        img_float -= 128.0
+        img_float *= alpha
+        img_float += 128.0
+    if brightness != 0:
+        img_float += brightness
+    np.clip(img_float, 0, 255, out=img_float)
+    return img_float.astype(np.uint8)
+
+
+def _legacy_skin_tone_correction(image, warmth):
+    """apply_skin_tone_correction trước khi dùng LUT: tách kênh float32 rồi dstack"""
+    img_float = image.astype(np.float32)
+    r, g, b = img_float[:, :, 0], img_float[:, :, 1], img_float[:, :, 2]
+    warm_factor = warmth / 50.0 * 0.1
+    r = r * (1.0 + warm_factor)
+    g = g * (1.0 + warm_factor * 0.5)
+    b = b * (1.0 - warm_factor)
+    return np.clip(np.dstack([r, g, b]), 0, 255).astype(np.uint8)
+
+
+def _legacy_vibrance_saturation(image, vibrance, saturation):
+    """apply_vibrance_saturation trước khi dùng LUT: HSV float32, mask fancy-index, clip hai lần"""
+    img_hsv = cv2.cvtColor(image, cv2.COLOR_RGB2HSV).astype(np.float32)
+    s = img_hsv[:, :, 1]
+    if saturation != 0:
+        s = s * (1.0 + (saturation / 100.0))
+    if vibrance != 0:
+        mask = s < 128
+        s[mask] = s[mask] * (1.0 + (vibrance / 100.0))
+    img_hsv[:, :, 1] = np.clip(s, 0, 255)
+    img_hsv = np.clip(img_hsv, 0, 255).astype(np.uint8)
+    return cv2.cvtColor(img_hsv, cv2.COLOR_HSV2RGB)
+
+
+def _legacy_bokeh_effect(image, blur_strength):
+    """apply_bokeh_effect trước khi cache mask: dựng lại mask mỗi lần, blend float32 3 kênh"""
+    h, w = image.shape[:2]
+    kernel_size = int(5 + (blur_strength / 100.0) * 96)
+    if kernel_size % 2 == 0:
+        kernel_size += 1
+    blurred = cv2.GaussianBlur(image, (kernel_size, kernel_size), 0)
+    center_x, center_y = w // 2, h // 2
+    radius_x, radius_y = int(w * 0.35), int(h * 0.4)
+    Y, X = np.ogrid[:h, :w]
+    dist = np.sqrt(((X - center_x) / radius_x) ** 2 + ((Y - center_y) / radius_y) ** 2)
+    mask = np.clip(1.5 - dist, 0, 1)
+    mask = cv2.GaussianBlur(mask.astype(np.float32), (51, 51), 0)
+    mask_3d = np.dstack([mask] * 3)
+    result = (image.astype(np.float32) * mask_3d +
+              blurred.astype(np.float32) * (1 - mask_3d))
+    return np.clip(result, 0, 255).astype(np.uint8)
+
+
+# Bộ thông số đại diện cho một lần chỉnh ảnh chân dung đầy đủ (mọi bước đều bật)
+FULL_CHAIN_PARAMS = {
+    'brightness': 10, 'contrast': 15, 'vibrance': 30, 'saturation': 10, 'warmth': 10,
+    'skin_smooth': 50, 'smooth_method': 'bilateral', 'sharpen': 5, 'blur': 3,
+    'bokeh': 50, 'grayscale': False,
+}
+
+
+def run_chain(image, params=FULL_CHAIN_PARAMS):
+    """Chạy toàn bộ chuỗi filter tuần tự trên một luồng (tương đương PhotoLabApp._render)"""
+    return Pipeline.from_recipe(params).compile().run(image)
+
+
+# === CÁC BENCHMARK ===
+
+def bench_point_ops(megapixels_list, repeat=3):
+    """Độ sáng/tương phản + độ ấm: nhiều lượt float32 (cũ) so với một lượt LUT gộp"""
+    P = ImageProcessor
+    brightness, contrast, warmth = 15, 30, 20
+    rows = []
+    for mp in megapixels_list:
+        image = synthetic_image(mp)
+        t_old, old = time_call(lambda: _legacy_skin_tone_correction(
+            _legacy_brightness_contrast(image, brightness, contrast), warmth), repeat)
+
+        def fused():
+            lut = P.compose_luts(P.brightness_contrast_lut(brightness, contrast),
+                                 P.skin_tone_lut(warmth))
+            return P.apply_point_lut(image, lut)
+        t_new, new = time_call(fused, repeat)
+        rows.append([f"{mp:g} MP", f"{t_old * 1000:.1f}", f"{t_new * 1000:.1f}",
+                     f"{t_old / t_new:.1f}x", max_abs_diff(old, new)])
+    print_table("Point ops: brightness/contrast + warmth",
+                ["size", "multi-pass ms", "fused LUT ms", "speedup", "max diff"], rows)
+
+
+def bench_vibrance(megapixels_list, repeat=3):
+    """Vibrance/saturation: HSV float32 (cũ) so với LUT kênh S tại chỗ trong bộ đệm HSV dùng lại"""
+    vibrance, saturation = 60, 30
+    rows = []
+    for mp in megapixels_list:
+        image = synthetic_image(mp)
+        t_old, old = time_call(
+            lambda: _legacy_vibrance_saturation(image, vibrance, saturation), repeat)
+        t_new, new = time_call(
+            lambda: ImageProcessor.apply_vibrance_saturation(image, vibrance, saturation), repeat)
+        rows.append([f"{mp:g} MP", f"{mp / t_old:.1f}", f"{mp / t_new:.1f}",
+                     f"{t_old / t_new:.1f}x", max_abs_diff(old, new)])
+    print_table("Vibrance/saturation throughput",
+                ["size", "float HSV MP/s", "S-LUT MP/s", "speedup", "max diff"], rows)
+
+
+def bench_bokeh(megapixels_list, repeat=3):
+    """Xóa phông: dựng mask + blend float32 (cũ) so với mask cache + blendLinear một lượt"""
+    blur_strength = 50
+    rows = []
+    for mp in megapixels_list:
+        image = synthetic_image(mp)
+        old_alloc = measure_alloc(lambda: _legacy_bokeh_effect(image, blur_strength))
+        t_old, old = time_call(lambda: _legacy_bokeh_effect(image, blur_strength), repeat)
+
+        BOKEH_MASKS.clear()
+        start = time.perf_counter()
+        ImageProcessor.apply_bokeh_effect(image, blur_strength)
+        t_cold = time.perf_counter() - start
+        new_alloc = measure_alloc(
+            lambda: ImageProcessor.apply_bokeh_effect(image, blur_strength))
+        t_new, new = time_call(lambda: ImageProcessor.apply_bokeh_effect(image, blur_strength), repeat)
+        rows.append([f"{mp:g} MP", f"{t_old * 1000:.0f}", f"{t_cold * 1000:.0f}",
+                     f"{t_new * 1000:.0f}", f"{old_alloc / 2**20:.0f}", f"{new_alloc / 2**20:.0f}",
+                     max_abs_diff(old, new)])
+    print_table("Bokeh: per-call time and allocations (blur_strength=50)",
+                ["size", "old ms", "new cold ms", "new warm ms", "old peak MB",
+                 "new peak MB", "max diff"], rows)
+
+
+def bench_blur(megapixels_list, repeat=3):
+    """Engine làm mờ: thời gian Gaussian chính xác và xấp xỉ kim tự tháp theo kernel size"""
+    rows = []
+    for mp in megapixels_list:
+        image = synthetic_image(mp)
+        for kernel_size in (11, 21, 31, 41, 61, 81, 101):
+            t_exact, exact = time_call(
+                lambda: ImageProcessor.gaussian_blur(image, kernel_size, exact=True), repeat)
+            if kernel_size <= BLUR_EXACT_MAX_KERNEL:
+                rows.append([f"{mp:g} MP", kernel_size, f"{t_exact * 1000:.0f}", "-", "-", "-", "-"])
+                continue
+            t_approx, approx = time_call(
+                lambda: ImageProcessor.gaussian_blur(image, kernel_size), repeat)
+            diff = np.abs(exact.astype(np.int16) - approx.astype(np.int16))
+            rows.append([f"{mp:g} MP", kernel_size, f"{t_exact * 1000:.0f}",
+                         f"{t_approx * 1000:.0f}", f"{t_exact / t_approx:.1f}x",
+                         int(diff.max()), f"{diff.mean():.2f}"])
+    print_table(f"Gaussian blur engine (pyramid above kernel {BLUR_EXACT_MAX_KERNEL})",
+                ["size", "kernel", "exact ms", "pyramid ms", "speedup", "max err", "mean err"], rows)
+
+
+def bench_smoothing(megapixels_list, repeat=3):
+    """Làm mịn da: thời gian và chất lượng (PSNR/SSIM so với bilateral chính xác) từng chế độ"""
+    rows = []
+    for mp in megapixels_list:
+        image = synthetic_image(mp)
+        for strength in (20, 50, 100):
+            reference = None
+            t_reference = None
+            for method in SKIN_SMOOTHING_METHODS:
+                t, result = time_call(lambda: ImageProcessor.apply_skin_smoothing(
+                    image, strength, method=method), repeat)
+                if method == 'bilateral':
+                    reference, t_reference = result, t
+                rows.append([f"{mp:g} MP", strength, method, f"{t * 1000:.0f}",
+                             f"{t_reference / t:.1f}x", f"{psnr(reference, result):.1f}",
+                             f"{ssim(reference, result):.4f}"])
+    print_table("Skin smoothing backends (quality vs exact bilateral)",
+                ["size", "strength", "method", "ms", "speedup", "PSNR dB", "SSIM"], rows)
+
+
+def bench_orientation(megapixels_list, repeat=3):
+    """
+    Bật lật ngang khi đã có kết quả làm mịn da nặng trong cache:
+    lật ảnh nguồn rồi render lại cả chuỗi (cũ) so với lật một lần ở cuối chuỗi (cache vẫn trúng)
+    và chỉ lật khung hình hiển thị (view); PSNR so kết quả lật cuối với lật trước
+    """
+    recipe = dict(FULL_CHAIN_PARAMS, skin_smooth=100)
+    rows = []
+    for mp in megapixels_list:
+        image = synthetic_image(mp)
+        flipped = Pipeline.from_recipe(dict(recipe, flip_horizontal=True)).compile()
+        executor = TiledExecutor()
+        t_old, old = time_call(lambda: Pipeline.from_recipe(recipe).compile().run(
+            ImageProcessor.flip_horizontal(image), executor=executor), repeat)
+        cache = StageCache(max_bytes=4 * image.nbytes)
+        Pipeline.from_recipe(recipe).compile().run(image, cache=cache, source_key='bench',
+                                                   executor=executor)
+        # Lần lật đầu tiên (kết quả lật chưa có trong cache) = độ trễ thật khi bấm nút
+        start = time.perf_counter()
+        new = flipped.run(image, cache=cache, source_key='bench', executor=executor)
+        t_new = time.perf_counter() - start
+        recomputed = [name for name, t in flipped.last_timings if t is not None]
+        preview = cv2.resize(new, (1600, 1600 * image.shape[0] // image.shape[1]),
+                             interpolation=cv2.INTER_AREA)
+        t_view, _ = time_call(lambda: ImageProcessor.orient(preview, flip_h=True), repeat)
+        executor.close()
+        rows.append([f"{mp:g} MP", f"{t_old * 1000:.0f}", f"{t_new * 1000:.1f}",
+                     " + ".join(recomputed), f"{t_view * 1e6:.1f}", f"{t_old / t_new:.0f}x",
+                     f"{psnr(old, new):.1f}"])
+    print_table("Flip toggle with heavy smoothing cached",
+                ["size", "re-render ms", "flip-last ms", "recomputed", "display view us",
+                 "speedup", "PSNR dB"], rows)
+
+
+def bench_viewport(megapixels_list, repeat=3, view_size=(1600, 1000), pan_step=48, pan_frames=40):
+    """
+    Phóng to 100% và kéo ảnh: khung hình đầu (chưa có ô nào) và các khung khi kéo ngang
+    so với mục tiêu PAN_FRAME_TARGET_MS, ở hai chế độ:
+    - chờ ô: khung hình chờ render đủ các ô mới lộ ra
+    - dần dần: ô chưa có lấy tạm từ ảnh xem trước phóng to, render nền rồi hiển thị lại
+    Kiểm tra trùng khớp từng bit với render cả ảnh rồi cắt
+    """
+    from viewport import TileRenderer, Viewport, render_viewport, PAN_FRAME_TARGET_MS
+    rows = []
+    for mp in megapixels_list:
+        image = synthetic_image(mp)
+        size = (image.shape[1], image.shape[0])
+        compiled = Pipeline.from_recipe(FULL_CHAIN_PARAMS).compile()
+        executor = TiledExecutor()
+        t_full, full = time_call(lambda: compiled.run(image, executor=executor), repeat)
+        executor.close()
+        # Ảnh xem trước toàn cảnh như trên giao diện (proxy vừa khung)
+        proxy_scale = min(view_size[0] / size[0], view_size[1] / size[1])
+        proxy = cv2.resize(image, None, fx=proxy_scale, fy=proxy_scale, interpolation=cv2.INTER_AREA)
+        preview = Pipeline.from_recipe(FULL_CHAIN_PARAMS).compile(proxy_scale).run(proxy)
+
+        for mode in ('wait', 'progressive'):
+            renderer = TileRenderer()
+            viewport = Viewport()
+            viewport.zoom_at(1.0, None, size, view_size)
+            viewport.center = (0.25, 0.5)
+            viewport.clamp(size, view_size)
+            fallback = preview if mode == 'progressive' else None
+
+            def frame():
+                rect = viewport.rect(size, view_size)
+                return rect, render_viewport(renderer, image, 'bench', 1.0,
+                                             lambda scale: Pipeline.from_recipe(
+                                                 FULL_CHAIN_PARAMS).compile(scale),
+                                             viewport.zoom, rect, fallback=fallback)
+
+            def settle():
+                # Chờ các ô render nền xong (chế độ dần dần)
+                while renderer.pending():
+                    time.sleep(0.001)
+            start = time.perf_counter()
+            frame()
+            settle()
+            rect, first = frame()
+            t_first = time.perf_counter() - start
+            x0, y0 = int(rect[0]), int(rect[1])
+            identical = np.array_equal(first, full[y0:y0 + first.shape[0], x0:x0 + first.shape[1]])
+
+            pans = LatencyTracker(pan_frames)
+            missed = 0   # Số khung hình có ô chưa render (chờ ô hoặc hiện ảnh tạm)
+            for _ in range(pan_frames):
+                viewport.pan(-pan_step, 0, size, view_size)
+                start = time.perf_counter()
+                frame()
+                pans.record(time.perf_counter() - start)
+                missed += renderer.tiles_rendered > 0
+            start = time.perf_counter()
+            settle()
+            t_settle = time.perf_counter() - start
+            renderer.close()
+            s = pans.summary()
+            rows.append([f"{mp:g} MP", mode, f"{t_full * 1000:.0f}", f"{t_first * 1000:.0f}",
+                         f"{s['p50'] * 1000:.1f}", f"{s['p95'] * 1000:.1f}",
+                         f"{s['max'] * 1000:.1f}", missed, f"{t_settle * 1000:.0f}",
+                         "yes" if s['p95'] * 1000 <= PAN_FRAME_TARGET_MS else "NO",
+                         "yes" if identical else "NO"])
+    print_table(f"Viewport 100% pan {view_size[0]}x{view_size[1]}, {pan_step} px/frame "
+                f"(target p95 <= {PAN_FRAME_TARGET_MS} ms)",
+                ["size", "mode", "full render ms", "first frame ms", "pan p50 ms", "pan p95 ms",
+                 "pan max ms", "frames missing tiles", "settle ms", "on target", "identical"],
+                rows)
+
+
+def bench_display(megapixels_list, repeat=1, drag_events=60):
+    """
+    Kéo cửa sổ từ 1600x1000 xuống 1000x640 qua drag_events sự kiện <Configure>:
+    - cũ: mỗi sự kiện tạo lại proxy từ ảnh gốc, render lại bản xem trước rồi resize bilinear
+      ảnh hiển thị (như _on_window_resize trước đây)
+    - mới: mỗi sự kiện chỉ thu nhỏ ảnh hiển thị từ pyramid (INTER_AREA), tạo proxy (dùng
+      pyramid của ảnh gốc) + render một lần khi ngừng kéo (cột settle)
+    Số khung/giây = số khung vẽ được / thời gian xử lý (không tính PhotoImage vì cần màn hình)
+    """
+    from PIL import Image
+    from utils import DisplayPyramid, create_preview_proxy, resize_image_to_fit
+    sizes = [(1600 - 600 * i // (drag_events - 1), 1000 - 360 * i // (drag_events - 1))
+             for i in range(drag_events)]
+    rows = []
+    for mp in megapixels_list:
+        base = synthetic_image(mp)
+
+        def render_proxy_at(w, h, pyramid=None):
+            proxy, scale = create_preview_proxy(base, w, h, pyramid=pyramid)
+            return Pipeline.from_recipe(FULL_CHAIN_PARAMS).compile(scale).run(proxy)
+        # Ảnh đang hiển thị: bản xem trước hoặc ảnh đầy đủ (vd. sau khi swap ảnh giải mã đủ)
+        for label, display in (("preview", render_proxy_at(*sizes[0])), ("full-res", base)):
+            def old_drag():
+                for w, h in sizes:
+                    render_proxy_at(w, h)
+                    Image.fromarray(resize_image_to_fit(display, w, h))
+
+            base_pyramid = DisplayPyramid()
+            base_pyramid.set_image(base)
+
+            def new_drag():
+                pyramid = DisplayPyramid()
+                pyramid.set_image(display)
+                for w, h in sizes:
+                    Image.fromarray(pyramid.fit(w, h))
+
+            t_old, _ = time_call(old_drag, repeat)
+            t_new, _ = time_call(new_drag, repeat)
+            t_settle, _ = time_call(lambda: render_proxy_at(*sizes[-1], pyramid=base_pyramid),
+                                    repeat)
+            rows.append([f"{mp:g} MP", label, f"{drag_events / t_old:.1f}",
+                         f"{drag_events / t_new:.0f}", f"{t_old * 1000 / drag_events:.1f}",
+                         f"{t_new * 1000 / drag_events:.2f}", f"{t_settle * 1000:.0f}",
+                         f"{t_old / t_new:.0f}x"])
+    print_table(f"Window resize drag ({drag_events} Configure events, PhotoImage excluded)",
+                ["size", "displayed", "old fps", "new fps", "old ms/event", "new ms/event",
+                 "settle render ms", "speedup"], rows)
+
+
+def bench_history(megapixels_list, repeat=1, view_size=(1600, 1000)):
+    """
+    Phiên chỉnh sửa trên ảnh xem trước (proxy vừa khung) rồi hoàn tác hết từng bước:
+    - không lịch sử: chỉ có cache từng bước (bị chiếm bởi các render khác → nhỏ)
+    - lịch sử đủ bộ nhớ: bước tốn kém có checkpoint → hiện ngay
+    - lịch sử giới hạn chặt: checkpoint xa bị loại, render lại từ checkpoint gần nhất
+    Kiểm tra kết quả hoàn tác trùng khớp với render lại từ đầu
+    """
+    from history import EditHistory
+    zero = dict(FULL_CHAIN_PARAMS, brightness=0, contrast=0, vibrance=0, saturation=0,
+                warmth=0, skin_smooth=0, sharpen=0, blur=0, bokeh=0)
+    # Thứ tự chỉnh như trên giao diện, sau đó tinh chỉnh lại vài slider
+    edits = [(name, FULL_CHAIN_PARAMS[name]) for name in
+             ('brightness', 'contrast', 'vibrance', 'saturation', 'warmth', 'skin_smooth',
+              'sharpen', 'blur', 'bokeh')]
+    edits += [('sharpen', 8), ('bokeh', 60), ('warmth', 15), ('skin_smooth', 70), ('blur', 5)]
+    rows = []
+    for mp in megapixels_list:
+        image = synthetic_image(mp)
+        scale = min(view_size[0] / image.shape[1], view_size[1] / image.shape[0])
+        proxy = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        states = [dict(zero)]
+        for name, value in edits:
+            states.append(dict(states[-1], **{name: value}))
+        references = [Pipeline.from_recipe(state).compile(scale).run(proxy) for state in states]
+        modes = [('stage cache only', None), ('history 256 MB', 256 * 2 ** 20),
+                 ('history 8 frames', 8 * proxy.nbytes)]
+        for label, budget in modes:
+            cache = StageCache(max_bytes=4 * proxy.nbytes)
+            history = EditHistory(max_bytes=budget or 0,
+                                  min_cost=float('inf') if budget is None else 0.03)
+            history.reset(states[0])
+            for state in states[1:]:
+                compiled = Pipeline.from_recipe(state).compile(scale)
+                compiled.run(proxy, cache=cache, source_key='bench')
+                keys = compiled.stage_keys('bench')
+                history.record_costs(keys, compiled.last_timings)
+                history.push(state)
+                history.checkpoint(keys, cache.peek)
+            undo = LatencyTracker()
+            identical = True
+            for position in range(len(states) - 2, -1, -1):
+                start = time.perf_counter()
+                state = history.undo()
+                compiled = Pipeline.from_recipe(state).compile(scale)
+                keys = compiled.stage_keys('bench')
+                index, array = history.restore(keys)
+                if keys and index == len(keys) - 1:
+                    result = array
+                else:
+                    if index >= 0:
+                        cache.put(keys[index], array)
+                    result = compiled.run(proxy, cache=cache, source_key='bench')
+                undo.record(time.perf_counter() - start)
+                identical &= np.array_equal(result, references[position])
+            stats = history.stats()
+            s = undo.summary()
+            restores = stats['restores']
+            rows.append([f"{mp:g} MP", label, len(edits), f"{s['p50'] * 1000:.1f}",
+                         f"{s['p95'] * 1000:.1f}", f"{s['max'] * 1000:.1f}",
+                         f"{restores['hit']}/{restores['partial']}/{restores['miss']}",
+                         f"{stats['bytes'] / 2 ** 20:.1f}", stats['evictions'],
+                         "yes" if identical else "NO"])
+    print_table(f"Undo after {len(edits)} edits on a {view_size[0]}x{view_size[1]} preview",
+                ["size", "mode", "steps", "undo p50 ms", "undo p95 ms", "undo max ms",
+                 "hit/partial/miss", "history MB", "evictions", "identical"], rows)
+
+
+def bench_grayscale(megapixels_list, repeat=3):
+    """
+    Chuỗi filter đầy đủ khi bật trắng đen: trắng đen ở cuối trên ảnh 3 kênh (cũ) so với
+    đoạn trắng đen 1 kênh của Pipeline.compile; sai lệch so với cách cũ theo từng chế độ làm mịn
+    """
+    rows = []
+    for mp in megapixels_list:
+        image = synthetic_image(mp)
+        for method in SKIN_SMOOTHING_METHODS:
+            params = dict(FULL_CHAIN_PARAMS, smooth_method=method)
+            color = Pipeline.from_recipe(params).compile()
+            gray = Pipeline.from_recipe(dict(params, grayscale=True)).compile()
+            t_old, old = time_call(lambda: ImageProcessor.to_grayscale(color.run(image)), repeat)
+            t_new, new = time_call(lambda: gray.run(image), repeat)
+            diff = np.abs(old.astype(np.int16) - new.astype(np.int16))
+            rows.append([f"{mp:g} MP", method, f"{t_old * 1000:.0f}", f"{t_new * 1000:.0f}",
+                         f"{t_old / t_new:.1f}x", int(diff.max()), f"{diff.mean():.3f}",
+                         f"{psnr(old, new):.1f}"])
+    print_table("Grayscale chain: 3-channel then gray vs single-channel segment",
+                ["size", "smoothing", "old ms", "new ms", "speedup", "max diff",
+                 "mean diff", "PSNR dB"], rows)
+
+
+def bench_stream(megapixels_list, repeat=1, frames=48):
+    """
+    Xử lý một đoạn video tổng hợp (khung đọc từ generator, kết quả bỏ đi):
+    từng khung một với công thức biên dịch lại mỗi khung (như lệnh batch với ảnh tĩnh)
+    so với FrameStream (biên dịch một lần, pool luồng, hàng đợi giới hạn) theo số luồng
+    """
+    from streaming import FrameStream
+    recipe = dict(FULL_CHAIN_PARAMS, skin_smooth=30)
+    rows = []
+    for mp in megapixels_list:
+        base = synthetic_image(mp)
+        clip = [np.roll(base, 8 * i, axis=1) for i in range(4)]
+
+        def source():
+            for i in range(frames):
+                yield clip[i % len(clip)]
+
+        # Chi phí chuẩn bị (biên dịch + mask bokeh): mỗi khung nếu không dùng lại, hay một lần
+        start = time.perf_counter()
+        BOKEH_MASKS.clear()
+        compiled = Pipeline.from_recipe(recipe).compile()
+        ImageProcessor.bokeh_mask(base.shape[0], base.shape[1])
+        t_setup = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for frame in source():
+            ImageProcessor.apply_recipe(frame, recipe)
+        t_naive = time.perf_counter() - start
+        rows.append([f"{mp:g} MP", "per-frame apply_recipe", 1, f"{t_setup * 1000:.1f}",
+                     f"{frames / t_naive:.1f}", f"{t_naive * 1000 / frames:.0f}", "-", "-", "-"])
+        for workers in sorted({1, 2, 4, default_workers()}):
+            stream = FrameStream(compiled.run, workers)
+            stats = stream.run(source(), lambda frame: None)
+            rows.append([f"{mp:g} MP", "FrameStream", workers, "once", f"{stats['fps']:.1f}",
+                         f"{stats['frame_latency']['p50'] * 1000:.0f}",
+                         f"{stats['mean_depth']:.1f}/{stats['queue_depth']}",
+                         stats['max_depth'], f"{stats['read_stall']:.2f}"])
+    print_table(f"Streaming {frames} frames ({default_workers()} CPU cores, output discarded)",
+                ["size", "mode", "workers", "setup ms", "fps", "frame p50 ms", "mean depth",
+                 "max depth",
+                 "read stall s"], rows)
+
+
+def bench_hotfolder(megapixels_list, repeat=1, files=8):
+    """
+    Thư mục nóng: lượt đầu xử lý mọi ảnh (như lệnh batch mỗi lần chạy), các lượt sau chỉ
+    xử lý ảnh mới / đã sửa: không đổi (so stat), chỉ touch (phải hash nội dung), một ảnh đổi
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    from hotfolder import HotFolder
+    recipe = dict(DEFAULT_RECIPE, brightness=10, contrast=10)
+    rows = []
+    for mp in megapixels_list:
+        with tempfile.TemporaryDirectory(prefix="photolab-bench-") as workdir, \
+                ProcessPoolExecutor(max_workers=default_workers()) as pool:
+            input_dir = os.path.join(workdir, 'in')
+            os.makedirs(input_dir)
+            image = synthetic_image(mp)
+            paths = [os.path.join(input_dir, f"img{i:03d}.jpg") for i in range(files)]
+            for i, path in enumerate(paths):
+                ImageProcessor.save_image(path, np.roll(image, 16 * i, axis=1))
+            folder = HotFolder(input_dir, os.path.join(workdir, 'out'), recipe, settle=0,
+                               log=lambda message: None)
+
+            def touch_all():
+                for path in paths:
+                    os.utime(path)
+
+            def change_one():
+                ImageProcessor.save_image(paths[0], np.roll(image, -16, axis=1))
+
+            for name, prepare in (("first run", None), ("unchanged", None),
+                                  ("all touched", touch_all), ("1 changed", change_one)):
+                if prepare:
+                    prepare()
+                before = dict(folder.totals)
+                start = time.perf_counter()
+                folder.run_once(pool)
+                elapsed = time.perf_counter() - start
+                rows.append([f"{mp:g} MP", name,
+                             folder.totals['processed'] - before['processed'],
+                             folder.totals['skipped'] - before['skipped'],
+                             f"{elapsed * 1000:.0f}"])
+    print_table(f"Hot folder ({files} files, {default_workers()} processes)",
+                ["size", "pass", "processed", "skipped", "ms"], rows)
+
+
+def bench_server(megapixels_list, repeat=1, requests=400, clients=16):
+    """
+    Hàng đợi render của server.py (không qua HTTP): request đầu tiên trên pool tiến trình mới
+    (khởi động + biên dịch + mask bokeh) so với pool đã khởi động sẵn, và thông lượng / độ trễ
+    khi clients luồng gửi đồng thời, có và không gộp lô
+    """
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+    from server import MAX_BATCH, RenderService, render_batch
+    recipe = dict(DEFAULT_RECIPE, brightness=10, sharpen=10, bokeh=30)
+    recipe_json = json.dumps(recipe, sort_keys=True)
+    rows = []
+    for mp in megapixels_list:
+        data = ImageProcessor.encode_image(synthetic_image(mp), 'jpg', quality=90)
+        with ProcessPoolExecutor(max_workers=default_workers()) as pool:
+            start = time.perf_counter()
+            pool.submit(render_batch, [(data, recipe_json, 'jpg', {})]).result()
+            t_cold = time.perf_counter() - start
+        rows.append([f"{mp:g} MP", "cold pool, first request", "-", "-", f"{t_cold * 1000:.0f}",
+                     "-", "-", "-"])
+        for max_batch in (1, MAX_BATCH):
+            service = RenderService(max_batch=max_batch)
+            start = time.perf_counter()
+            service.render(data, recipe)
+            t_first = time.perf_counter() - start
+            service.latency.reset()
+            service.throughput.reset()
+            with ThreadPoolExecutor(clients) as senders:
+                start = time.perf_counter()
+                results = list(senders.map(lambda _: service.render(data, recipe)[1],
+                                           range(requests)))
+                elapsed = time.perf_counter() - start
+            stats = service.stats()
+            service.close()
+            latency = stats['latency_ms']
+            rows.append([f"{mp:g} MP", f"warm pool, max batch {max_batch}",
+                         stats['mean_batch'], sum(1 for error in results if error),
+                         f"{t_first * 1000:.0f}", f"{requests / elapsed:.0f}",
+                         f"{latency['p50']:.1f}", f"{latency['p99']:.1f}"])
+    print_table(f"Render service ({default_workers()} processes, {clients} concurrent senders)",
+                ["size", "mode", "mean batch", "errors", "first ms", "req/s", "p50 ms",
+                 "p99 ms"], rows)
+
+
+def bench_histogram(megapixels_list, repeat=5):
+    """
+    Histogram mỗi khung hình: np.histogram toàn ảnh (cách làm thẳng) và cv2.calcHist toàn ảnh
+    so với HistogramMeter trên mẫu thu nhỏ trong ngân sách; sai khác = tổng |chênh lệch| của
+    histogram độ sáng đã chuẩn hóa và chênh lệch tỷ lệ điểm bị cắt sáng
+    """
+    from histogram import HistogramMeter
+    rows = []
+    for mp in megapixels_list:
+        image = ImageProcessor.apply_brightness_contrast(synthetic_image(mp), 40, 40)
+        luma = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+        reference = np.bincount(luma.ravel(), minlength=256) / luma.size
+        reference_clip = max(float(np.mean(image[..., c] == 255)) for c in range(3))
+
+        def numpy_full():
+            return [np.histogram(image[..., c], 256, (0, 256))[0] for c in range(3)] + \
+                   [np.histogram(cv2.cvtColor(image, cv2.COLOR_RGB2GRAY), 256, (0, 256))[0]]
+
+        def calchist_full():
+            return [cv2.calcHist([image], [c], None, [256], [0, 256]) for c in range(3)] + \
+                   [cv2.calcHist([cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)], [0], None, [256],
+                                 [0, 256])]
+
+        for name, func in (("np.histogram full", numpy_full), ("calcHist full", calchist_full)):
+            t, _ = time_call(func, repeat)
+            rows.append([f"{mp:g} MP", name, f"{image.shape[0] * image.shape[1] / 1000:.0f}k",
+                         f"{t * 1000:.1f}", "0", "0"])
+        meter = HistogramMeter()
+        for _ in range(10):   # Để bộ điều chỉnh ổn định số điểm mẫu
+            result = meter.compute(image)
+        t, result = time_call(lambda: meter.compute(image), repeat)
+        error = float(np.abs(result['bins']['luma'] / result['pixels'] - reference).sum())
+        clip = max(result['highlights'][c] for c in ('r', 'g', 'b'))
+        rows.append([f"{mp:g} MP", f"HistogramMeter ({meter.budget * 1000:g} ms budget)",
+                     f"{result['pixels'] / 1000:.0f}k", f"{t * 1000:.2f}", f"{error:.4f}",
+                     f"{abs(clip - reference_clip) * 100:.2f}%"])
+    print_table("Histogram per frame (RGB + luma)",
+                ["size", "method", "pixels", "ms", "luma L1 error", "clip error"], rows)
+
+
+def bench_tiling(megapixels_list, repeat=3):
+    """Toàn bộ chuỗi filter chia dải song song: thời gian theo số luồng, so khớp với chạy tuần tự"""
+    thread_counts = sorted({1, 2, 4, default_workers()})
+    rows = []
+    for mp in megapixels_list:
+        image = synthetic_image(mp)
+        compiled = Pipeline.from_recipe(FULL_CHAIN_PARAMS).compile()
+        t_serial, reference = time_call(lambda: run_chain(image), repeat)
+        for workers in thread_counts:
+            executor = TiledExecutor(workers)
+            t, result = time_call(lambda: compiled.run(image, executor=executor), repeat)
+            executor.close()
+            rows.append([f"{mp:g} MP", workers, f"{t * 1000:.0f}", f"{t_serial / t:.2f}x",
+                         "yes" if np.array_equal(reference, result) else "NO"])
+    print_table(f"Tiled full chain ({default_workers()} CPU cores)",
+                ["size", "threads", "ms", "vs serial", "identical"], rows)
+
+
+# Các bộ tùy chọn encoder được so sánh trong bench_encode: (tên, phần mở rộng, tùy chọn)
+ENCODE_CASES = [
+    ('jpg q95', '.jpg', {}),
+    ('jpg q95 progressive+optimize', '.jpg', {'progressive': True, 'optimize': True}),
+    ('png level 1', '.png', {'png_compression': 1}),
+    ('png level 3', '.png', {}),
+    ('png level 9', '.png', {'png_compression': 9}),
+    ('webp q95', '.webp', {}),
+    ('tiff lzw', '.tif', {}),
+    ('tiff deflate', '.tif', {'tiff_compression': 'deflate'}),
+    ('bmp', '.bmp', {}),
+]
+
+
+def bench_encode(megapixels_list, repeat=1):
+    """Lưu ảnh: thời gian mã hóa, tốc độ (MB/s ảnh chưa nén) và kích thước file theo tùy chọn"""
+    rows = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for mp in megapixels_list:
+            image = run_chain(synthetic_image(mp))
+            for name, ext, options in ENCODE_CASES:
+                path = os.path.join(workdir, 'out' + ext)
+                t, _ = time_call(lambda: ImageProcessor.save_image(path, image, **options), repeat)
+                rows.append([f"{mp:g} MP", name, f"{t * 1000:.0f}",
+                             f"{image.nbytes / t / 2**20:.0f}",
+                             f"{os.path.getsize(path) / 2**20:.1f}"])
+    print_table("Encode (save_image)", ["size", "format/options", "ms", "MB/s", "file MB"], rows)
+
+
+def peak_rss():
+    """
+    Đỉnh RSS của tiến trình hiện tại (byte), đọc VmHWM trong /proc (Linux)
+    VmHWM được đặt lại khi exec nên tiến trình con không thừa hưởng đỉnh của tiến trình cha
+    như ru_maxrss
+    """
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) * 1024
+    raise OSError("không đọc được VmHWM")
+
+
+def _peak_rss_worker(path, reuse_buffers, queue):
+    """Chạy trong tiến trình riêng: đọc ảnh, chạy toàn bộ chuỗi, báo đỉnh RSS tăng thêm (byte)"""
+    image = np.load(path)
+    base = peak_rss()
+    start = time.perf_counter()
+    Pipeline.from_recipe(FULL_CHAIN_PARAMS).compile().run(image, reuse_buffers=reuse_buffers)
+    elapsed = time.perf_counter() - start
+    queue.put((peak_rss() - base, elapsed))
+
+
+def bench_memory(megapixels_list, repeat=1):
+    """
+    Đỉnh RSS của một lần render toàn bộ chuỗi (mỗi lần đo trong một tiến trình mới):
+    các bước ghi luân phiên vào hai mảng (ping-pong) so với cấp phát mảng mới cho mỗi bước
+    """
+    context = multiprocessing.get_context('spawn')
+    rows = []
+    with tempfile.TemporaryDirectory(prefix="photolab-bench-") as workdir:
+        for mp in megapixels_list:
+            path = os.path.join(workdir, 'image.npy')
+            image = synthetic_image(mp)
+            np.save(path, image)
+            row = [f"{mp:g} MP", f"{image.nbytes / 2**20:.0f}"]
+            for reuse_buffers in (False, True):
+                queue = context.Queue()
+                process = context.Process(target=_peak_rss_worker, args=(path, reuse_buffers, queue))
+                process.start()
+                peak, elapsed = queue.get()
+                process.join()
+                row += [f"{peak / 2**20:.0f}", f"{elapsed * 1000:.0f}"]
+            rows.append(row)
+    print_table("Full chain peak RSS (above the loaded image)",
+                ["size", "image MB", "new arrays MB", "ms", "ping-pong MB", "ms"], rows)
+
+
+# === BỘ BENCHMARK CHUẨN (so sánh với baseline) ===
+
+# Kích thước ảnh mặc định của bộ chuẩn (megapixel)
+SUITE_MEGAPIXELS = [1, 12, 24, 48]
+# Mặc định: chậm hơn / tốn bộ nhớ hơn baseline quá 25% → tính là hồi quy
+DEFAULT_THRESHOLD = 0.25
+# Chênh lệch tuyệt đối nhỏ hơn mức này (giây) coi là nhiễu đo, không tính hồi quy thời gian
+MIN_REGRESSION_SECONDS = 0.005
+
+
+def suite_cases(workdir):
+    """
+    Các phép đo của bộ chuẩn: mọi phương thức public của ImageProcessor với tham số đại diện
+    và toàn bộ chuỗi filter
+
+    Tham số:
+        workdir: thư mục tạm cho các phép đọc/ghi file (chứa sẵn 'source.jpg' của ảnh thử)
+
+    Trả về:
+        list (tên, func(image))
+    """
+    P = ImageProcessor
+    source = os.path.join(workdir, 'source.jpg')
+    cases = [
+        ('load_image', lambda img: P.load_image(source)),
+        ('save_image_jpg', lambda img: P.save_image(os.path.join(workdir, 'out.jpg'), img)),
+        ('save_image_png', lambda img: P.save_image(os.path.join(workdir, 'out.png'), img)),
+        ('brightness_contrast', lambda img: P.apply_brightness_contrast(img, 20, 30)),
+        ('skin_tone_correction', lambda img: P.apply_skin_tone_correction(img, 15)),
+        ('vibrance_saturation', lambda img: P.apply_vibrance_saturation(img, 40, 20)),
+        ('landscape_enhance', lambda img: P.apply_landscape_enhance(img)),
+        ('to_grayscale', P.to_grayscale),
+        ('flip_horizontal', P.flip_horizontal),
+        ('flip_vertical', P.flip_vertical),
+        ('sharpen', lambda img: P.apply_sharpen(img, 5)),
+        ('blur_k7', lambda img: P.apply_blur(img, 7)),
+        ('blur_k61', lambda img: P.apply_blur(img, 61)),
+        ('bokeh_50', lambda img: P.apply_bokeh_effect(img, 50)),
+        ('bokeh_100', lambda img: P.apply_bokeh_effect(img, 100)),
+    ]
+    for method in SKIN_SMOOTHING_METHODS:
+        cases.append((f'skin_smoothing_{method}',
+                      lambda img, method=method: P.apply_skin_smoothing(img, 50, method=method)))
+    cases.append(('full_chain', run_chain))
+    return cases
+
+
+def environment_info():
+    """Thông tin máy đo (lưu cùng baseline để biết kết quả có so sánh được không)"""
+    return {
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'opencv': cv2.__version__,
+        'cv2_threads': cv2.getNumThreads(),
+    }
+
+
+def run_suite(megapixels_list, repeat=3, names=None):
+    """
+    Chạy bộ chuẩn trên ảnh tổng hợp ở từng kích thước
+
+    Tham số:
+        names: chỉ chạy các phép đo có tên trong danh sách (None = tất cả)
+
+    Trả về:
+        dict "tên@kích thước" -> {'seconds': thời gian tốt nhất, 'peak_bytes': đỉnh cấp phát}
+    """
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="photolab-bench-") as workdir:
+        for mp in megapixels_list:
+            image = synthetic_image(mp)
+            ImageProcessor.save_image(os.path.join(workdir, 'source.jpg'), image)
+            for name, func in suite_cases(workdir):
+                if names and name not in names:
+                    continue
+                t, _ = time_call(lambda: func(image), repeat)
+                peak = measure_alloc(lambda: func(image))
+                key = f"{name}@{mp:g}MP"
+                results[key] = {'seconds': t, 'peak_bytes': peak}
+                print(f"  {key:<40} {t * 1000:10.1f} ms  {peak / 2**20:8.1f} MB", flush=True)
+    return results
+
+
+def compare_with_baseline(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """
+    So sánh kết quả với baseline, in bảng và đánh dấu các phép đo bị hồi quy
+
+    Trả về:
+        list tên các phép đo chậm hơn hoặc tốn bộ nhớ hơn baseline quá threshold
+    """
+    if baseline.get('environment') != environment_info():
+        print("\nCảnh báo: baseline được đo trên môi trường khác, so sánh chỉ mang tính tham khảo")
+    base_results = baseline['results']
+    rows, regressions = [], []
+    for key, result in results.items():
+        base = base_results.get(key)
+        if base is None:
+            rows.append([key, f"{result['seconds'] * 1000:.1f}", "-", "-", "-", "new"])
+            continue
+        time_ratio = result['seconds'] / base['seconds']
+        mem_ratio = result['peak_bytes'] / base['peak_bytes'] if base['peak_bytes'] else 1.0
+        slower = (time_ratio > 1 + threshold and
+                  result['seconds'] - base['seconds'] > MIN_REGRESSION_SECONDS)
+        regressed = slower or mem_ratio > 1 + threshold
+        if regressed:
+            regressions.append(key)
+        rows.append([key, f"{result['seconds'] * 1000:.1f}", f"{base['seconds'] * 1000:.1f}",
+                     f"{time_ratio:.2f}x", f"{mem_ratio:.2f}x", "REGRESSION" if regressed else "ok"])
+    print_table(f"Suite vs baseline (threshold +{threshold:.0%})",
+                ["case", "ms", "baseline ms", "time", "memory", "status"], rows)
+    return regressions
+
+
+def main_suite(args):
+    """Lệnh 'suite': chạy bộ chuẩn, lưu baseline và/hoặc so sánh với baseline"""
+    print(f"Benchmark suite ({', '.join(f'{mp:g}' for mp in args.mp)} MP, best of {args.repeat})")
+    results = run_suite(args.mp, args.repeat, args.cases)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            json.dump({'environment': environment_info(), 'results': results}, f, indent=2)
+        print(f"\nĐã lưu baseline vào {args.save_baseline}")
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} phép đo bị hồi quy: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+BENCHMARKS = {
+    'point_ops': bench_point_ops,
+    'vibrance': bench_vibrance,
+    'bokeh': bench_bokeh,
+    'blur': bench_blur,
+    'smoothing': bench_smoothing,
+    'tiling': bench_tiling,
+    'orientation': bench_orientation,
+    'viewport': bench_viewport,
+    'display': bench_display,
+    'history': bench_history,
+    'grayscale': bench_grayscale,
+    'stream': bench_stream,
+    'hotfolder': bench_hotfolder,
+    'server': bench_server,
+    'histogram': bench_histogram,
+    'memory': bench_memory,
+    'encode': bench_encode,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark các thuật toán xử lý ảnh PhotoLab")
+    parser.add_argument('names', nargs='*',
+                        help=f"'suite' hoặc các benchmark so sánh: {', '.join(BENCHMARKS)} "
+                             "(mặc định: tất cả benchmark so sánh)")
+    parser.add_argument('--mp', nargs='+', type=float, default=None,
+                        help="kích thước ảnh thử (megapixel; mặc định 12, suite: 1 12 24 48)")
+    parser.add_argument('--repeat', type=int, default=3, help="số lần đo mỗi phép")
+    parser.add_argument('--cases', nargs='+', help="suite: chỉ chạy các phép đo này")
+    parser.add_argument('--baseline', help="suite: file baseline JSON để so sánh")
+    parser.add_argument('--save-baseline', help="suite: lưu kết quả thành file baseline JSON")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help="suite: tỷ lệ chậm hơn/tốn bộ nhớ hơn cho phép (mặc định 0.25)")
+    args = parser.parse_args(argv)
+
+    if args.names == ['suite']:
+        args.mp = args.mp or SUITE_MEGAPIXELS
+        return main_suite(args)
+    unknown = [name for name in args.names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"benchmark không tồn tại: {', '.join(unknown)}")
+
+    args.mp = args.mp or [12]
+    for name in args.names or list(BENCHMARKS):
+        BENCHMARKS[name](args.mp, repeat=args.repeat)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
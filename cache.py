@@ -0,0 +1,104 @@
+"""
+cache.py - Bộ nhớ đệm kết quả từng bước filter cho PhotoLab
+Mỗi bước được lưu theo khóa (khóa đầu vào + tên bước + tham số) với giới hạn bộ nhớ,
+loại bỏ theo LRU khi vượt quá giới hạn
+"""
+import threading
+from collections import OrderedDict
+
+
+# Giới hạn bộ nhớ mặc định cho cache (mỗi bước là một mảng RGB đầy đủ)
+DEFAULT_CACHE_BYTES = 512 * 1024 * 1024
+
+
+class StageCache:
+    """
+    Cache LRU cho kết quả từng bước của chuỗi filter, giới hạn theo tổng số byte
+    An toàn khi dùng từ nhiều luồng (luồng render nền và luồng Tk khi lưu ảnh)
+    """
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES):
+        """
+        Tham số:
+            max_bytes: tổng dung lượng tối đa (byte) của các mảng được giữ lại
+        """
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # khóa -> numpy array, cũ nhất ở đầu
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """
+        Lấy kết quả đã lưu theo khóa (đánh dấu là mới dùng gần nhất)
+
+        Trả về:
+            numpy array (chỉ đọc) hoặc None nếu không có
+        """
+        with self._lock:
+            array = self._entries.get(key)
+            if array is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return array
+
+    def peek(self, key):
+        """Lấy kết quả đã lưu theo khóa mà không tính hit/miss và không đổi thứ tự LRU"""
+        with self._lock:
+            return self._entries.get(key)
+
+    def put(self, key, array):
+        """
+        Lưu kết quả của một bước; mảng được đánh dấu chỉ đọc để các bước sau không ghi đè
+        Mảng lớn hơn toàn bộ giới hạn sẽ không được lưu
+        """
+        if array.nbytes > self.max_bytes:
+            return
+        array.flags.writeable = False
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old.nbytes
+            self._entries[key] = array
+            self.current_bytes += array.nbytes
+            self._evict()
+
+    def set_max_bytes(self, max_bytes):
+        """Đổi giới hạn bộ nhớ, loại bỏ ngay các mục cũ nếu vượt quá"""
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def clear(self):
+        """Xóa toàn bộ cache (giữ nguyên các bộ đếm)"""
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        """
+        Thống kê để tinh chỉnh giới hạn cache
+
+        Trả về:
+            dict gồm hits, misses, evictions, entries, bytes, max_bytes
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+            }
+
+    def _evict(self):
+        """Loại bỏ các mục ít dùng nhất cho đến khi nằm trong giới hạn (gọi khi đang giữ lock)"""
+        while self.current_bytes > self.max_bytes and self._entries:
+            _, array = self._entries.popitem(last=False)
+            self.current_bytes -= array.nbytes
+            self.evictions += 1
@@ -0,0 +1,4 @@
+"""
+conftest.py - Cấu hình pytest: thư mục gốc chứa file này được thêm vào sys.path để
+các test trong tests/ import trực tiếp các module của PhotoLab (processing, tiling, ...)
+"""
@@ -0,0 +1,122 @@
+"""
+histogram.py - Histogram RGB / độ sáng và chỉ báo vùng bị cắt (clipping) cho PhotoLab
+Tính bằng cv2.calcHist trên mẫu thu nhỏ (nearest) của khung hình thay vì toàn bộ ảnh; số điểm
+mẫu được điều chỉnh theo thời gian đo được để mỗi lần cập nhật nằm trong một ngân sách cố định
+"""
+import time
+
+import cv2
+import numpy as np
+
+from metrics import LatencyTracker
+
+
+# Ngân sách thời gian tính histogram cho mỗi khung hình (giây)
+HISTOGRAM_BUDGET_SECONDS = 0.002
+# Giới hạn số điểm mẫu: dưới mức này histogram bị nhiễu, trên mức này không thêm thông tin
+MIN_SAMPLE_PIXELS = 16_384
+MAX_SAMPLE_PIXELS = 1_000_000
+# Số điểm mẫu của lần tính đầu tiên (chưa đo được tốc độ)
+DEFAULT_SAMPLE_PIXELS = 100_000
+# Tỷ lệ điểm ảnh bị cắt (giá trị 0 hoặc 255) từ mức này thì cảnh báo
+CLIP_WARN_FRACTION = 0.005
+
+# Tên các kênh trong kết quả (theo thứ tự kênh của ảnh RGB) + độ sáng
+HISTOGRAM_CHANNELS = ('r', 'g', 'b')
+
+
+class HistogramMeter:
+    """
+    Tính histogram của khung hình trong ngân sách thời gian
+    Sau mỗi lần tính, số điểm mẫu của lần sau = ngân sách / thời gian mỗi điểm đo được
+    (trung bình trượt), chừa 20% cho dao động
+    Chỉ gọi compute từ một luồng (luồng histogram nền)
+    """
+
+    def __init__(self, budget=HISTOGRAM_BUDGET_SECONDS, min_pixels=MIN_SAMPLE_PIXELS,
+                 max_pixels=MAX_SAMPLE_PIXELS):
+        """
+        Tham số:
+            budget: ngân sách thời gian mỗi lần tính (giây)
+            min_pixels, max_pixels: giới hạn số điểm mẫu
+        """
+        self.budget = budget
+        self.min_pixels = min_pixels
+        self.max_pixels = max_pixels
+        self.sample_pixels = min(max(DEFAULT_SAMPLE_PIXELS, min_pixels), max_pixels)
+        self.latency = LatencyTracker()
+        self.over_budget = 0           # Số lần tính vượt ngân sách
+        self._seconds_per_pixel = None
+
+    @staticmethod
+    def sample(image, max_pixels):
+        """
+        Mẫu thu nhỏ đều (nearest, không nội suy → giữ nguyên giá trị điểm ảnh, kể cả 0/255)
+        không quá max_pixels điểm; ảnh đủ nhỏ được dùng nguyên
+
+        Trả về:
+            numpy array liền bộ nhớ (calcHist trên view có stride chậm hơn nhiều lần)
+        """
+        h, w = image.shape[:2]
+        if h * w <= max_pixels:
+            return np.ascontiguousarray(image)
+        factor = (h * w / max_pixels) ** 0.5
+        size = (max(1, int(w / factor)), max(1, int(h / factor)))
+        return cv2.resize(image, size, interpolation=cv2.INTER_NEAREST)
+
+    def compute(self, image):
+        """
+        Histogram 256 mức của từng kênh R, G, B và độ sáng + tỷ lệ điểm bị cắt
+
+        Tham số:
+            image: numpy array RGB hoặc grayscale uint8
+
+        Trả về:
+            dict gồm:
+                bins: dict 'r'/'g'/'b'/'luma' -> numpy float32 (256,) số điểm mẫu mỗi mức
+                shadows, highlights: dict kênh -> tỷ lệ điểm bằng 0 / bằng 255
+                pixels: số điểm mẫu, total: số điểm của ảnh, seconds: thời gian tính
+        """
+        start = time.perf_counter()
+        sample = self.sample(image, self.sample_pixels)
+        if sample.ndim == 2:
+            # Ảnh xám: ba kênh và độ sáng như nhau
+            values = cv2.calcHist([sample], [0], None, [256], [0, 256]).ravel()
+            bins = dict.fromkeys(HISTOGRAM_CHANNELS + ('luma',), values)
+        else:
+            bins = {name: cv2.calcHist([sample], [channel], None, [256], [0, 256]).ravel()
+                    for channel, name in enumerate(HISTOGRAM_CHANNELS)}
+            luma = cv2.cvtColor(sample, cv2.COLOR_RGB2GRAY)
+            bins['luma'] = cv2.calcHist([luma], [0], None, [256], [0, 256]).ravel()
+        pixels = sample.shape[0] * sample.shape[1]
+        elapsed = time.perf_counter() - start
+        self._adapt(elapsed, pixels)
+        return {
+            'bins': bins,
+            'shadows': {name: float(values[0]) / pixels for name, values in bins.items()},
+            'highlights': {name: float(values[255]) / pixels for name, values in bins.items()},
+            'pixels': pixels,
+            'total': image.shape[0] * image.shape[1],
+            'seconds': elapsed,
+        }
+
+    def _adapt(self, elapsed, pixels):
+        """Ghi thời gian và chọn số điểm mẫu cho lần sau theo ngân sách"""
+        self.latency.record(elapsed)
+        if elapsed > self.budget:
+            self.over_budget += 1
+        rate = elapsed / pixels
+        if self._seconds_per_pixel is None:
+            self._seconds_per_pixel = rate
+        else:
+            self._seconds_per_pixel = 0.7 * self._seconds_per_pixel + 0.3 * rate
+        target = int(self.budget * 0.8 / self._seconds_per_pixel)
+        self.sample_pixels = min(max(target, self.min_pixels), self.max_pixels)
+
+    def format_ms(self):
+        """Chuỗi tóm tắt chi phí so với ngân sách, dùng cho nhãn dưới histogram"""
+        s = self.latency.summary()
+        if s is None:
+            return "Histogram: --"
+        return (f"Histogram: {s['last'] * 1000:.1f} ms (p95 {s['p95'] * 1000:.1f}) / "
+                f"ngân sách {self.budget * 1000:.0f} ms · {self.sample_pixels / 1000:.0f}k điểm mẫu")
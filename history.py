@@ -0,0 +1,239 @@
+"""
+history.py - Lịch sử chỉnh sửa (hoàn tác / làm lại) cho PhotoLab
+Mỗi bước chỉ lưu các thông số thay đổi (rẻ); kết quả render của các trạng thái tốn kém được
+giữ làm checkpoint trong giới hạn bộ nhớ, checkpoint xa vị trí hiện tại nhất bị loại trước
+"""
+
+
+# Giới hạn bộ nhớ mặc định cho các checkpoint (ảnh xem trước cỡ khung hiển thị)
+DEFAULT_HISTORY_BYTES = 256 * 1024 * 1024
+
+# Số bước tối đa được giữ (bước cũ nhất gộp vào trạng thái đầu)
+MAX_HISTORY_STEPS = 200
+
+# Chuỗi filter render lại nhanh hơn mức này thì không cần checkpoint; trong checkpoint, cứ mỗi
+# chừng này thời gian tính dọc chuỗi thì giữ một kết quả trung gian để trạng thái lân cận
+# (chung phần đầu chuỗi) render lại từ đó (giây)
+CHECKPOINT_MIN_SECONDS = 0.03
+
+
+class EditHistory:
+    """
+    Lịch sử chỉnh sửa tuyến tính: trạng thái đầu + các bước {khóa: (giá trị cũ, giá trị mới)}
+    Checkpoint của một trạng thái là kết quả một số bước trong chuỗi filter của nó, theo khóa
+    cache của bước (CompiledPipeline.stage_keys): kết quả cuối và kết quả các bước tốn kém.
+    Trạng thái chưa có checkpoint được render lại từ kết quả sâu nhất trong chuỗi của nó đã có
+    trong một checkpoint bất kỳ (các trạng thái lân cận thường chung phần đầu chuỗi)
+    Chỉ dùng trên luồng Tk
+    """
+
+    def __init__(self, max_bytes=DEFAULT_HISTORY_BYTES, max_steps=MAX_HISTORY_STEPS,
+                 min_cost=CHECKPOINT_MIN_SECONDS):
+        """
+        Tham số:
+            max_bytes: tổng dung lượng tối đa (byte) của các checkpoint
+            max_steps: số bước tối đa được giữ
+            min_cost: thời gian render (giây) tối thiểu để giữ checkpoint (xem CHECKPOINT_MIN_SECONDS)
+        """
+        self.max_bytes = max_bytes
+        self.max_steps = max_steps
+        self.min_cost = min_cost
+        self.evictions = 0
+        self.restores = {'hit': 0, 'partial': 0, 'miss': 0}
+        self.reset({})
+
+    def reset(self, state):
+        """Bắt đầu lịch sử mới (vd: mở ảnh khác) với trạng thái đầu state"""
+        self._base = dict(state)       # Trạng thái trước bước đầu tiên còn giữ
+        self._steps = []               # list dict {khóa: (giá trị cũ, giá trị mới)}
+        self._cursor = 0               # Số bước đang được áp dụng (0 = trạng thái đầu)
+        self._first = 0                # Số thứ tự tuyệt đối của _base (tăng khi bỏ bước cũ)
+        self._state = dict(state)      # Trạng thái hiện tại (= _base + _steps[:_cursor])
+        self._costs = {}               # khóa bước -> thời gian tính bước đó lần gần nhất (giây)
+        self.drop_checkpoints()
+
+    def current(self):
+        """Bản sao trạng thái hiện tại"""
+        return dict(self._state)
+
+    def can_undo(self):
+        return self._cursor > 0
+
+    def can_redo(self):
+        return self._cursor < len(self._steps)
+
+    def push(self, state):
+        """
+        Ghi trạng thái mới sau trạng thái hiện tại (bỏ các bước làm lại phía sau)
+
+        Trả về:
+            True nếu đã ghi, False nếu state không khác trạng thái hiện tại
+        """
+        delta = {key: (self._state.get(key), value)
+                 for key, value in state.items() if self._state.get(key) != value}
+        if not delta:
+            return False
+        position = self._first + self._cursor
+        for stale in [p for p in self._checkpoints if p > position]:
+            self._drop(stale)
+        del self._steps[self._cursor:]
+        self._steps.append(delta)
+        self._cursor += 1
+        self._state.update(state)
+        if len(self._steps) > self.max_steps:
+            # Gộp bước cũ nhất vào trạng thái đầu
+            for key, (_, value) in self._steps.pop(0).items():
+                self._base[key] = value
+            if self._first in self._checkpoints:
+                self._drop(self._first)
+            self._first += 1
+            self._cursor -= 1
+        return True
+
+    def undo(self):
+        """
+        Lùi một bước
+
+        Trả về:
+            bản sao trạng thái mới, hoặc None nếu không còn bước để hoàn tác
+        """
+        if not self.can_undo():
+            return None
+        self._cursor -= 1
+        for key, (old, _) in self._steps[self._cursor].items():
+            self._state[key] = old
+        return dict(self._state)
+
+    def redo(self):
+        """
+        Tiến lại một bước đã hoàn tác
+
+        Trả về:
+            bản sao trạng thái mới, hoặc None nếu không có bước để làm lại
+        """
+        if not self.can_redo():
+            return None
+        for key, (_, new) in self._steps[self._cursor].items():
+            self._state[key] = new
+        self._cursor += 1
+        return dict(self._state)
+
+    def record_costs(self, keys, timings):
+        """
+        Ghi thời gian tính từng bước của một lần render (để chọn bước đáng giữ checkpoint)
+
+        Tham số:
+            keys: khóa từng bước (CompiledPipeline.stage_keys)
+            timings: CompiledPipeline.last_timings tương ứng (None = lấy từ cache, bỏ qua)
+        """
+        for key, (_, elapsed) in zip(keys, timings):
+            if elapsed is not None:
+                self._costs[key] = elapsed
+
+    def checkpoint(self, keys, lookup):
+        """
+        Giữ checkpoint cho trạng thái hiện tại nếu chuỗi filter của nó đủ tốn kém
+
+        Tham số:
+            keys: khóa từng bước chuỗi filter của trạng thái hiện tại
+            lookup: hàm khóa -> numpy array hoặc None (vd: StageCache.peek)
+
+        Trả về:
+            True nếu trạng thái hiện tại có checkpoint
+        """
+        position = self._first + self._cursor
+        if position in self._checkpoints:
+            return True
+        costs = [self._costs.get(key, 0.0) for key in keys]
+        if sum(costs) < self.min_cost:
+            return False  # Render lại đủ nhanh
+        # Giữ kết quả trung gian mỗi khi đã tích đủ min_cost thời gian tính kể từ điểm giữ trước
+        chosen, pending = [], 0.0
+        for key, cost in zip(keys[:-1], costs):
+            pending += cost
+            if pending >= self.min_cost:
+                chosen.append(key)
+                pending = 0.0
+        held = []
+        for key in chosen + keys[-1:]:
+            if key not in self._arrays:
+                array = lookup(key)
+                if array is None:
+                    continue  # Đã bị loại khỏi cache
+                self._arrays[key] = array
+                self.current_bytes += array.nbytes
+            self._refs[key] = self._refs.get(key, 0) + 1
+            held.append(key)
+        if not held:
+            return False
+        self._checkpoints[position] = held
+        self._evict()
+        return position in self._checkpoints
+
+    def restore(self, keys):
+        """
+        Tìm kết quả sâu nhất trong chuỗi filter keys có trong một checkpoint bất kỳ
+
+        Trả về:
+            (i, array): kết quả của bước i (i = len(keys) - 1 nghĩa là có sẵn kết quả cuối),
+            hoặc (-1, None) nếu phải render lại từ đầu
+        """
+        for i in range(len(keys) - 1, -1, -1):
+            array = self._arrays.get(keys[i])
+            if array is not None:
+                self.restores['hit' if i == len(keys) - 1 else 'partial'] += 1
+                return i, array
+        self.restores['miss'] += 1
+        return -1, None
+
+    def drop_checkpoints(self):
+        """Bỏ toàn bộ checkpoint (vd: ảnh nguồn xem trước thay đổi → khóa cũ không còn dùng được)"""
+        self._checkpoints = {}         # vị trí tuyệt đối -> list khóa bước được giữ
+        self._arrays = {}              # khóa bước -> numpy array (dùng chung giữa các checkpoint)
+        self._refs = {}                # khóa bước -> số checkpoint đang giữ
+        self.current_bytes = 0
+
+    def stats(self):
+        """
+        Thống kê bộ nhớ và hiệu quả của lịch sử
+
+        Trả về:
+            dict gồm steps, position, checkpoints, bytes, max_bytes, evictions, restores
+        """
+        return {
+            'steps': len(self._steps),
+            'position': self._cursor,
+            'checkpoints': len(self._checkpoints),
+            'bytes': self.current_bytes,
+            'max_bytes': self.max_bytes,
+            'evictions': self.evictions,
+            'restores': dict(self.restores),
+        }
+
+    def _drop(self, position):
+        """Bỏ checkpoint tại vị trí tuyệt đối position, giải phóng mảng không còn ai giữ"""
+        for key in self._checkpoints.pop(position):
+            self._release(key)
+
+    def _release(self, key):
+        """Bớt một checkpoint giữ mảng của khóa key, giải phóng khi không còn ai giữ"""
+        self._refs[key] -= 1
+        if self._refs[key] == 0:
+            del self._refs[key]
+            self.current_bytes -= self._arrays.pop(key).nbytes
+
+    def _evict(self):
+        """
+        Loại dần checkpoint xa vị trí hiện tại nhất cho đến khi nằm trong giới hạn:
+        bỏ kết quả cuối trước (trạng thái đó vẫn render lại được từ bước trung gian tốn kém,
+        thường dùng chung với các trạng thái lân cận), rồi mới bỏ cả checkpoint
+        """
+        position = self._first + self._cursor
+        while self.current_bytes > self.max_bytes and self._checkpoints:
+            farthest = max(self._checkpoints, key=lambda p: (abs(p - position), -p))
+            held = self._checkpoints[farthest]
+            if len(held) > 1:
+                self._release(held.pop())
+            else:
+                self._drop(farthest)
+            self.evictions += 1
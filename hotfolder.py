@@ -0,0 +1,343 @@
+"""
+hotfolder.py - Thư mục nóng: tự động xử lý ảnh mới thả vào thư mục bằng một công thức
+Manifest (JSON trong thư mục đầu ra) ghi hash nội dung từng ảnh vào + hash công thức của lần
+xử lý thành công gần nhất: ảnh không đổi và công thức không đổi thì bỏ qua, ảnh mới/đã sửa được
+xử lý trên ProcessPoolExecutor. Ảnh ra được ghi vào file tạm rồi đổi tên, manifest ghi bằng
+file tạm + os.replace sau mỗi ảnh xong → dừng đột ngột ở đâu thì lần chạy sau làm tiếp từ đó
+"""
+import ctypes
+import hashlib
+import json
+import os
+import select
+import sys
+import time
+
+from photolab import INPUT_EXTENSIONS, process_file
+
+
+# Tên file manifest trong thư mục đầu ra
+MANIFEST_NAME = ".photolab-manifest.json"
+MANIFEST_VERSION = 1
+# Phần đánh dấu file ảnh ra đang ghi dở (bị xóa khi khởi động lại)
+PARTIAL_TAG = ".partial"
+# Khoảng thời gian giữa hai lần quét (giây) khi không có inotify
+DEFAULT_POLL_SECONDS = 2.0
+# File vừa sửa trong khoảng này (giây) coi như đang được chép vào, để lần quét sau
+SETTLE_SECONDS = 2.0
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """SHA-256 nội dung file (đọc từng khối, không nạp cả file vào bộ nhớ)"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def recipe_hash(recipe, output_format, encode_options):
+    """Hash của mọi thứ quyết định ảnh ra ngoài ảnh vào: công thức, định dạng, tùy chọn encoder"""
+    text = json.dumps({'recipe': recipe, 'format': output_format, 'encode': encode_options},
+                      sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class Manifest:
+    """
+    Bảng đường dẫn tương đối ảnh vào -> {hash, recipe, size, mtime_ns, output} của lần xử lý
+    thành công gần nhất, lưu thành JSON
+    """
+
+    def __init__(self, path):
+        """Đọc manifest nếu có (file hỏng hoặc khác phiên bản → bắt đầu lại từ đầu)"""
+        self.path = path
+        self.entries = {}
+        try:
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == MANIFEST_VERSION:
+                self.entries = data['entries']
+        except (OSError, ValueError, KeyError, AttributeError):
+            pass
+
+    def save(self):
+        """Ghi nguyên tử: file tạm + fsync + os.replace (không bao giờ còn manifest ghi dở)"""
+        tmp = f"{self.path}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'version': MANIFEST_VERSION, 'entries': self.entries}, f,
+                      ensure_ascii=False, indent=1, sort_keys=True)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+
+class _Inotify:
+    """
+    Chờ thay đổi trong các thư mục bằng inotify của Linux (qua ctypes, không cần gói ngoài)
+    Không có inotify (không phải Linux) thì create() trả về None và HotFolder quay về quét định kỳ
+    """
+
+    # Sự kiện đáng quan tâm: ghi xong, chuyển/đổi tên vào, tạo thư mục con
+    MASK = 0x00000008 | 0x00000080 | 0x00000100   # IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+    def __init__(self, libc, fd):
+        self._libc = libc
+        self.fd = fd
+
+    @classmethod
+    def create(cls):
+        if not sys.platform.startswith('linux'):
+            return None
+        try:
+            libc = ctypes.CDLL(None, use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        except (OSError, AttributeError):
+            return None
+        return cls(libc, fd) if fd >= 0 else None
+
+    def watch(self, directory):
+        """Theo dõi directory (gọi lại cho thư mục đã theo dõi không tốn gì)"""
+        self._libc.inotify_add_watch(self.fd, os.fsencode(directory), self.MASK)
+
+    def wait(self, timeout):
+        """
+        Chờ tối đa timeout giây
+
+        Trả về:
+            True nếu có sự kiện (đã đọc bỏ hết), False nếu hết giờ
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return False
+        try:
+            while os.read(self.fd, 65536):
+                pass
+        except BlockingIOError:
+            pass
+        return True
+
+    def close(self):
+        os.close(self.fd)
+
+
+class HotFolder:
+    """
+    Xử lý tăng dần một thư mục ảnh (kể cả thư mục con) sang thư mục đầu ra cùng cấu trúc
+    Một ảnh được xử lý khi chưa có trong manifest, nội dung đổi, công thức đổi hoặc ảnh ra bị xóa
+    """
+
+    def __init__(self, input_dir, output_dir, recipe, output_format='jpg', encode_options=None,
+                 suffix='', settle=SETTLE_SECONDS, log=print):
+        """
+        Tham số:
+            input_dir, output_dir: thư mục nguồn và đích (đích có thể nằm trong nguồn)
+            recipe: dict công thức (xem DEFAULT_RECIPE)
+            output_format: định dạng ảnh ra ('jpg', 'png', ...)
+            encode_options: tùy chọn encoder (xem DEFAULT_ENCODE_OPTIONS)
+            suffix: hậu tố thêm vào tên file ra
+            settle: xem SETTLE_SECONDS
+            log: hàm in nhật ký
+        """
+        self.input_dir = os.path.abspath(input_dir)
+        self.output_dir = os.path.abspath(output_dir)
+        self.recipe = recipe
+        self.output_format = output_format
+        self.encode_options = encode_options or {}
+        self.suffix = suffix
+        self.settle = settle
+        self.log = log
+        self.recipe_hash = recipe_hash(recipe, output_format, self.encode_options)
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.manifest = Manifest(os.path.join(self.output_dir, MANIFEST_NAME))
+        self.totals = {'processed': 0, 'skipped': 0, 'failed': 0, 'megapixels': 0.0,
+                       'seconds': 0.0}
+        self._failed = {}   # rel -> (size, mtime_ns) của lần xử lý lỗi
+        self._remove_partials()
+
+    def _remove_partials(self):
+        """Xóa ảnh ra ghi dở của lần chạy bị ngắt (ảnh đó chưa vào manifest nên sẽ làm lại)"""
+        for root, _, names in os.walk(self.output_dir):
+            for name in names:
+                if self._is_partial(name):
+                    os.remove(os.path.join(root, name))
+
+    def _is_partial(self, name):
+        """Tên file tạm đúng dạng process() tạo ra: {tên ảnh ra}{PARTIAL_TAG}.{định dạng}"""
+        return name.endswith(f"{self.suffix}{PARTIAL_TAG}.{self.output_format}")
+
+    def _is_output(self, path, known_outputs):
+        """
+        Ảnh ra của chính thư mục nóng (khi thư mục đầu ra trùng thư mục nguồn): đã ghi trong
+        manifest, file tạm, hoặc tên theo mẫu {tên}{suffix}.{định dạng} trong thư mục đầu ra
+        """
+        if path in known_outputs:
+            return True
+        if os.path.commonpath([path, self.output_dir]) != self.output_dir:
+            return False
+        name = os.path.basename(path)
+        return self._is_partial(name) or (
+            bool(self.suffix) and name.endswith(f"{self.suffix}.{self.output_format}"))
+
+    def _output_path(self, rel):
+        stem = os.path.splitext(rel)[0]
+        return os.path.join(self.output_dir, f"{stem}{self.suffix}.{self.output_format}")
+
+    def directories(self):
+        """Các thư mục nguồn cần theo dõi (bỏ qua thư mục đầu ra nếu nằm trong nguồn)"""
+        for root, dirs, _ in os.walk(self.input_dir):
+            dirs[:] = [d for d in dirs if os.path.join(root, d) != self.output_dir]
+            yield root
+
+    def scan(self):
+        """
+        So thư mục nguồn với manifest
+
+        Trả về:
+            (jobs, skipped, unsettled): jobs là list (rel, input_path, output_path, hash, stat)
+            cần xử lý, skipped số ảnh đã cập nhật, unsettled số ảnh đang được chép vào
+        """
+        jobs, skipped, unsettled = [], 0, 0
+        now = time.time()
+        entries = self.manifest.entries
+        known_outputs = {os.path.join(self.output_dir, entry['output'])
+                         for entry in entries.values() if 'output' in entry}
+        changed = False
+        for root in self.directories():
+            for name in sorted(os.listdir(root)):
+                if not name.lower().endswith(INPUT_EXTENSIONS):
+                    continue
+                path = os.path.join(root, name)
+                if self._is_output(path, known_outputs):
+                    continue  # Không xử lý lại ảnh ra (ảnh_edited → ảnh_edited_edited → ...)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue  # Vừa bị xóa / đổi tên
+                rel = os.path.relpath(path, self.input_dir)
+                output_path = self._output_path(rel)
+                if os.path.abspath(output_path) == path:
+                    continue  # Ảnh ra trùng ảnh vào
+                entry = entries.get(rel)
+                up_to_date = (entry is not None and entry['recipe'] == self.recipe_hash
+                              and os.path.exists(output_path))
+                # Đường tắt: kích thước + thời điểm sửa không đổi → không cần đọc file để hash
+                if up_to_date and entry['size'] == st.st_size and entry['mtime_ns'] == st.st_mtime_ns:
+                    skipped += 1
+                    continue
+                if self._failed.get(rel) == (st.st_size, st.st_mtime_ns):
+                    continue  # Đã lỗi với đúng nội dung này
+                if now - st.st_mtime < self.settle:
+                    unsettled += 1
+                    continue
+                try:
+                    digest = file_hash(path)
+                except FileNotFoundError:
+                    continue  # Bị xóa / đổi tên sau khi stat
+                if up_to_date and entry['hash'] == digest:
+                    # Chỉ đổi thời điểm sửa (chép lại, touch): nội dung như cũ
+                    entry.update(size=st.st_size, mtime_ns=st.st_mtime_ns)
+                    changed = True
+                    skipped += 1
+                    continue
+                jobs.append((rel, path, output_path, digest, st))
+        if changed:
+            self.manifest.save()
+        return jobs, skipped, unsettled
+
+    def process(self, jobs, pool):
+        """
+        Xử lý các ảnh trên pool (ProcessPoolExecutor khởi tạo như lệnh batch); mỗi ảnh xong
+        được đổi tên từ file tạm sang tên thật rồi ghi ngay vào manifest
+
+        Trả về:
+            (số ảnh xong, số ảnh lỗi, số megapixel)
+        """
+        futures = []
+        for rel, path, output_path, digest, st in jobs:
+            stem, ext = os.path.splitext(output_path)
+            partial = f"{stem}{PARTIAL_TAG}{ext}"   # Giữ phần mở rộng để encoder chọn đúng định dạng
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            futures.append((rel, partial, output_path, digest, st,
+                            pool.submit(process_file, path, partial, self.recipe,
+                                        self.encode_options)))
+        done = failed = 0
+        megapixels = 0.0
+        for rel, partial, output_path, digest, st, future in futures:
+            try:
+                _, error, _, mp, _ = future.result()
+            except Exception as e:  # Một ảnh lỗi không được làm dừng dịch vụ
+                error, mp = str(e) or type(e).__name__, 0.0
+            if error:
+                failed += 1
+                # Không thử lại mỗi lượt quét cho đến khi file được sửa
+                self._failed[rel] = (st.st_size, st.st_mtime_ns)
+                self.log(f"LỖI {rel}: {error}")
+                if os.path.exists(partial):
+                    os.remove(partial)
+                continue
+            os.replace(partial, output_path)
+            self._failed.pop(rel, None)
+            self.manifest.entries[rel] = {
+                'hash': digest, 'recipe': self.recipe_hash, 'size': st.st_size,
+                'mtime_ns': st.st_mtime_ns, 'output': os.path.relpath(output_path, self.output_dir),
+            }
+            self.manifest.save()
+            done += 1
+            megapixels += mp
+        return done, failed, megapixels
+
+    def run_once(self, pool):
+        """
+        Một lượt quét + xử lý, ghi nhật ký lượt đó
+
+        Trả về:
+            số ảnh đang được chép vào (cần quét lại sau)
+        """
+        start = time.perf_counter()
+        jobs, skipped, unsettled = self.scan()
+        scan_time = time.perf_counter() - start
+        self.totals['skipped'] += skipped
+        if not jobs:
+            return unsettled
+        start = time.perf_counter()
+        done, failed, megapixels = self.process(jobs, pool)
+        elapsed = time.perf_counter() - start
+        for key, value in (('processed', done), ('failed', failed), ('megapixels', megapixels),
+                           ('seconds', elapsed)):
+            self.totals[key] += value
+        self.log(f"[{time.strftime('%H:%M:%S')}] xử lý {done} ảnh ({failed} lỗi) trong "
+                 f"{elapsed:.2f} s ({done / elapsed:.2f} ảnh/s, {megapixels / elapsed:.1f} MP/s) "
+                 f"· bỏ qua {skipped} đã cập nhật · {unsettled} đang chép · quét {scan_time * 1000:.0f} ms")
+        return unsettled
+
+    def watch(self, pool, interval=DEFAULT_POLL_SECONDS, use_inotify=True, should_stop=None):
+        """
+        Quét lặp lại cho đến khi should_stop() trả về True (hoặc Ctrl+C)
+        Có inotify thì chờ sự kiện thay vì quét định kỳ (vẫn quét lại sau interval để chắc chắn)
+
+        Tham số:
+            pool: ProcessPoolExecutor
+            interval: thời gian tối đa giữa hai lần quét (giây)
+            use_inotify: False để luôn quét định kỳ
+            should_stop: hàm không tham số, None = chạy mãi
+        """
+        notifier = _Inotify.create() if use_inotify else None
+        self.log(f"Theo dõi {self.input_dir} → {self.output_dir} "
+                 f"({'inotify' if notifier else f'quét mỗi {interval:g} s'}, "
+                 f"{len(self.manifest.entries)} ảnh trong manifest)")
+        try:
+            while should_stop is None or not should_stop():
+                if notifier is not None:
+                    for directory in self.directories():
+                        notifier.watch(directory)
+                unsettled = self.run_once(pool)
+                # Còn file đang chép → quét lại khi chúng đã ổn định
+                timeout = min(interval, self.settle) if unsettled else interval
+                if notifier is not None:
+                    notifier.wait(timeout)
+                else:
+                    time.sleep(timeout)
+        finally:
+            if notifier is not None:
+                notifier.close()
@@ -0,0 +1,195 @@
+"""
+loadtest.py - Đo tải dịch vụ render HTTP của PhotoLab (server.py)
+Nhiều client đồng thời, mỗi client một kết nối giữ mở, gửi liên tục cùng một ảnh; in độ trễ
+phía client (p50/p95/p99), request/giây và thống kê phía server (GET /stats: cỡ lô, thời gian render)
+Chạy:
+    python -m photolab serve &
+    python loadtest.py -c 8 -n 400 --mp 0.3 brightness=20 sharpen=10
+    python loadtest.py --spawn -j 2 -c 8 -n 200        # tự chạy một server tạm trên cổng trống
+"""
+import argparse
+import http.client
+import json
+import queue
+import sys
+import threading
+import time
+from urllib.parse import urlencode, urlsplit
+
+from benchmark import print_table, synthetic_image
+from metrics import LatencyTracker
+from processing import ImageProcessor
+
+
+def parse_params(pairs):
+    """Danh sách 'khóa=giá trị' → dict tham số query string"""
+    params = {}
+    for pair in pairs:
+        key, sep, value = pair.partition('=')
+        if not sep:
+            raise ValueError(f"Tham số phải có dạng khóa=giá_trị: {pair}")
+        params[key] = value
+    return params
+
+
+def get_json(host, port, path):
+    connection = http.client.HTTPConnection(host, port, timeout=30)
+    try:
+        connection.request('GET', path)
+        return json.loads(connection.getresponse().read())
+    finally:
+        connection.close()
+
+
+def run_load(host, port, body, query, concurrency, requests, warmup=0):
+    """
+    Gửi requests request POST /render từ concurrency client đồng thời
+
+    Tham số:
+        body: bytes file ảnh gửi đi
+        query: query string (thông số chỉnh ảnh, format, ...)
+        warmup: số request gửi trước (không tính vào kết quả)
+
+    Trả về:
+        dict gồm completed, errors (dict mã lỗi -> số lần), elapsed, rps, latency
+        (LatencyTracker.summary), bytes_out
+    """
+    path = f"/render?{query}" if query else "/render"
+    latency = LatencyTracker(window=max(1, requests))
+    errors = {}
+    lock = threading.Lock()
+    totals = {'completed': 0, 'bytes_out': 0}
+
+    def client(tokens, record):
+        connection = http.client.HTTPConnection(host, port, timeout=120)
+        try:
+            while True:
+                try:
+                    tokens.get_nowait()
+                except queue.Empty:
+                    return
+                start = time.perf_counter()
+                try:
+                    connection.request('POST', path, body=body,
+                                       headers={'Content-Type': 'application/octet-stream'})
+                    response = connection.getresponse()
+                    payload = response.read()
+                    status = response.status
+                except (OSError, http.client.HTTPException) as e:
+                    connection.close()   # Kết nối hỏng → mở lại ở request sau
+                    status, payload = type(e).__name__, b''
+                elapsed = time.perf_counter() - start
+                if not record:
+                    continue
+                with lock:
+                    if status == 200:
+                        totals['completed'] += 1
+                        totals['bytes_out'] += len(payload)
+                    else:
+                        errors[status] = errors.get(status, 0) + 1
+                if status == 200:
+                    latency.record(elapsed)
+        finally:
+            connection.close()
+
+    def run(count, record):
+        # Hàng đợi chung: mỗi client lấy request tiếp theo cho đến khi hết
+        tokens = queue.Queue()
+        for _ in range(count):
+            tokens.put(None)
+        threads = [threading.Thread(target=client, args=(tokens, record))
+                   for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    if warmup:
+        run(warmup, False)
+    start = time.perf_counter()
+    run(requests, True)
+    elapsed = time.perf_counter() - start
+    return {
+        'completed': totals['completed'],
+        'errors': errors,
+        'elapsed': elapsed,
+        'rps': totals['completed'] / elapsed,
+        'latency': latency.summary(),
+        'bytes_out': totals['bytes_out'],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Đo tải dịch vụ render HTTP của PhotoLab")
+    parser.add_argument('params', nargs='*', metavar='khóa=giá_trị',
+                        help="thông số query của /render (vd: brightness=20 format=png)")
+    parser.add_argument('--url', default='http://127.0.0.1:8765', help="địa chỉ server")
+    parser.add_argument('--image', help="file ảnh gửi đi (mặc định: ảnh tổng hợp --mp)")
+    parser.add_argument('--mp', type=float, default=0.3, help="cỡ ảnh tổng hợp (megapixel)")
+    parser.add_argument('-c', '--concurrency', type=int, default=8, help="số client đồng thời")
+    parser.add_argument('-n', '--requests', type=int, default=200, help="số request được đo")
+    parser.add_argument('--warmup', type=int, help="số request chạy trước (mặc định: = -c)")
+    parser.add_argument('--spawn', action='store_true',
+                        help="tự chạy một server tạm trong tiến trình này (bỏ qua --url)")
+    parser.add_argument('-j', '--workers', type=int, default=0,
+                        help="--spawn: số tiến trình render (mặc định: số nhân CPU)")
+    parser.add_argument('--max-batch', type=int, default=None, help="--spawn: cỡ lô tối đa")
+    args = parser.parse_args(argv)
+
+    try:
+        query = urlencode(parse_params(args.params))
+    except ValueError as e:
+        parser.error(str(e))
+    if args.image:
+        with open(args.image, 'rb') as f:
+            body = f.read()
+    else:
+        body = ImageProcessor.encode_image(synthetic_image(args.mp), 'jpg', quality=90)
+
+    server = service = None
+    if args.spawn:
+        from server import MAX_BATCH, RenderServer, RenderService
+        service = RenderService(args.workers or None,
+                                max_batch=args.max_batch if args.max_batch else MAX_BATCH)
+        server = RenderServer(('127.0.0.1', 0), service)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        host, port = server.server_address[:2]
+    else:
+        url = urlsplit(args.url)
+        host, port = url.hostname, url.port or 80
+
+    try:
+        result = run_load(host, port, body, query, args.concurrency, args.requests,
+                          args.concurrency if args.warmup is None else args.warmup)
+        server_stats = get_json(host, port, '/stats')
+    finally:
+        if server is not None:
+            server.shutdown()
+            service.close()
+
+    latency = result['latency']
+    rows = [["client", result['completed'], sum(result['errors'].values()),
+             f"{result['rps']:.1f}"] +
+            ([f"{latency[key] * 1000:.1f}" for key in ('p50', 'p95', 'p99', 'max')]
+             if latency else ["-"] * 4)]
+    server_latency = server_stats.get('latency_ms')
+    rows.append(["server", server_stats['requests'] - server_stats['errors'], server_stats['errors'],
+                 f"{server_stats['rps_overall']:.1f}"] +
+                ([f"{server_latency[key]:.1f}" for key in ('p50', 'p95', 'p99', 'max')]
+                 if server_latency else ["-"] * 4))
+    print_table(f"Load test: {args.requests} requests, {args.concurrency} clients, "
+                f"{len(body) / 1024:.0f} KB in, {query or 'no params'}",
+                ["side", "ok", "errors", "req/s", "p50 ms", "p95 ms", "p99 ms", "max ms"], rows)
+    render = server_stats.get('render_ms')
+    print(f"Server: {server_stats['workers']} tiến trình, {server_stats['batches']} lô "
+          f"(trung bình {server_stats['mean_batch']}, lớn nhất {server_stats['largest_batch']}), "
+          f"render p50 {render['p50'] if render else '-'} ms, "
+          f"từ chối {server_stats['rejected']}")
+    if result['errors']:
+        print(f"Lỗi: {result['errors']}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,136 @@
+"""
+metrics.py - Đo đạc hiệu năng cho PhotoLab
+Bao gồm: thống kê độ trễ (latency) theo cửa sổ trượt, phân vị p50/p95/p99, thông lượng
+"""
+import threading
+import time
+from collections import deque
+
+
+class LatencyTracker:
+    """
+    Ghi lại các mẫu thời gian (giây) trong một cửa sổ trượt và tính thống kê
+    An toàn khi ghi từ nhiều luồng
+    """
+
+    def __init__(self, window=200):
+        """
+        Tham số:
+            window: số mẫu gần nhất được giữ lại để tính thống kê
+        """
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.count = 0  # Tổng số mẫu đã ghi (kể cả mẫu đã ra khỏi cửa sổ)
+
+    def record(self, seconds):
+        """Ghi một mẫu thời gian (giây)"""
+        with self._lock:
+            self._samples.append(seconds)
+            self.count += 1
+
+    def reset(self):
+        """Xóa toàn bộ mẫu"""
+        with self._lock:
+            self._samples.clear()
+            self.count = 0
+
+    def percentile(self, p):
+        """
+        Tính phân vị p (0-100) của các mẫu trong cửa sổ
+
+        Trả về:
+            giá trị phân vị (giây), hoặc None nếu chưa có mẫu
+        """
+        with self._lock:
+            samples = sorted(self._samples)
+        return _percentile(samples, p)
+
+    def summary(self):
+        """
+        Tóm tắt thống kê của cửa sổ hiện tại
+
+        Trả về:
+            dict gồm count, last, mean, p50, p95, p99, max (giây), hoặc None nếu chưa có mẫu
+        """
+        with self._lock:
+            if not self._samples:
+                return None
+            last = self._samples[-1]
+            samples = sorted(self._samples)
+            count = self.count
+        return {
+            'count': count,
+            'last': last,
+            'mean': sum(samples) / len(samples),
+            'p50': _percentile(samples, 50),
+            'p95': _percentile(samples, 95),
+            'p99': _percentile(samples, 99),
+            'max': samples[-1],
+        }
+
+    def format_ms(self, label):
+        """Chuỗi tóm tắt ngắn gọn theo mili giây, dùng cho thanh trạng thái"""
+        s = self.summary()
+        if s is None:
+            return f"{label}: --"
+        return (f"{label}: {s['last'] * 1000:.0f} ms "
+                f"(p50 {s['p50'] * 1000:.0f} · p95 {s['p95'] * 1000:.0f} ms)")
+
+
+class ThroughputCounter:
+    """
+    Đếm số sự kiện (vd: request xong) và tính tốc độ trong cửa sổ thời gian gần nhất
+    An toàn khi ghi từ nhiều luồng
+    """
+
+    def __init__(self, window_seconds=10.0):
+        """
+        Tham số:
+            window_seconds: độ dài cửa sổ (giây) để tính tốc độ hiện tại
+        """
+        self.window_seconds = window_seconds
+        self._times = deque()
+        self._lock = threading.Lock()
+        self.count = 0                      # Tổng số sự kiện từ lúc tạo / reset
+        self.started = time.perf_counter()
+
+    def tick(self, n=1):
+        """Ghi n sự kiện vừa xảy ra"""
+        now = time.perf_counter()
+        with self._lock:
+            self._times.extend([now] * n)
+            self.count += n
+            self._expire(now)
+
+    def reset(self):
+        with self._lock:
+            self._times.clear()
+            self.count = 0
+            self.started = time.perf_counter()
+
+    def rate(self):
+        """Số sự kiện mỗi giây trong cửa sổ gần nhất (ngắn hơn nếu mới chạy)"""
+        now = time.perf_counter()
+        with self._lock:
+            self._expire(now)
+            span = min(self.window_seconds, now - self.started)
+            return len(self._times) / span if span > 0 else 0.0
+
+    def overall_rate(self):
+        """Số sự kiện mỗi giây tính từ lúc tạo / reset"""
+        elapsed = time.perf_counter() - self.started
+        return self.count / elapsed if elapsed > 0 else 0.0
+
+    def _expire(self, now):
+        while self._times and now - self._times[0] > self.window_seconds:
+            self._times.popleft()
+
+
+def _percentile(sorted_samples, p):
+    """Phân vị theo nội suy tuyến tính trên danh sách đã sắp xếp"""
+    if not sorted_samples:
+        return None
+    k = (len(sorted_samples) - 1) * p / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_samples) - 1)
+    return sorted_samples[lo] + (sorted_samples[hi] - sorted_samples[lo]) * (k - lo)
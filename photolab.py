@@ -0,0 +1,457 @@
+"""
+photolab.py - Dòng lệnh PhotoLab (không cần giao diện)
+Chạy:
+    python -m photolab batch recipe.json ảnh/*.jpg -o out/ --format jpg --quality 90
+    python -m photolab stream recipe.json clip.mp4 -o clip_out.mp4
+    python -m photolab stream recipe.json "timelapse/img_%04d.jpg" -o out/ --format jpg
+    python -m photolab watch recipe.json incoming/ -o processed/
+    python -m photolab serve --port 8765
+    python -m photolab gui
+
+Lệnh batch không import tkinter nên chạy được trên máy chủ không có màn hình
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from processing import (ImageProcessor, DEFAULT_RECIPE, DEFAULT_ENCODE_OPTIONS,
+                        PARAM_RANGES, SKIN_SMOOTHING_METHODS, TIFF_COMPRESSION_CODES)
+from profiling import PROFILER
+
+
+# Phần mở rộng ảnh được nhận khi truyền vào một thư mục
+INPUT_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp', '.tif', '.tiff')
+# Định dạng đầu ra được hỗ trợ
+OUTPUT_FORMATS = ('jpg', 'png', 'webp', 'tiff', 'bmp')
+
+
+def load_recipe(path):
+    """
+    Đọc công thức chỉnh ảnh từ file JSON (các khóa giống DEFAULT_RECIPE)
+
+    Trả về:
+        dict công thức đầy đủ (khóa thiếu lấy giá trị mặc định)
+
+    Ném ra:
+        ValueError nếu có khóa lạ hoặc giá trị không hợp lệ
+    """
+    with open(path, encoding='utf-8') as f:
+        recipe = json.load(f)
+    return validate_recipe(recipe)
+
+
+def validate_recipe(recipe):
+    """
+    Kiểm tra một công thức chỉnh ảnh (vd: đọc từ JSON hoặc tham số HTTP)
+
+    Trả về:
+        dict công thức đầy đủ (khóa thiếu lấy giá trị mặc định)
+
+    Ném ra:
+        ValueError nếu có khóa lạ hoặc giá trị không hợp lệ
+    """
+    if not isinstance(recipe, dict):
+        raise ValueError("Công thức phải là một object JSON")
+    unknown = set(recipe) - set(DEFAULT_RECIPE)
+    if unknown:
+        raise ValueError(f"Khóa không hợp lệ trong công thức: {', '.join(sorted(unknown))}")
+    recipe = dict(DEFAULT_RECIPE, **recipe)
+    for key, value in recipe.items():
+        default = DEFAULT_RECIPE[key]
+        if isinstance(default, bool):
+            if not isinstance(value, bool):
+                raise ValueError(f"{key} phải là true/false")
+        elif key in PARAM_RANGES:
+            low, high = PARAM_RANGES[key]
+            # bool là lớp con của int nhưng không phải giá trị hợp lệ ở đây
+            if not isinstance(value, int) or isinstance(value, bool):
+                raise ValueError(f"{key} phải là số nguyên")
+            if not low <= value <= high:
+                raise ValueError(f"{key} phải nằm trong khoảng {low}..{high} (nhận {value})")
+    if recipe['smooth_method'] not in SKIN_SMOOTHING_METHODS:
+        raise ValueError(f"smooth_method phải là một trong: {', '.join(SKIN_SMOOTHING_METHODS)}")
+    return recipe
+
+
+def collect_inputs(paths):
+    """
+    Mở rộng danh sách đường dẫn (file, thư mục, mẫu glob) thành danh sách file ảnh
+
+    Trả về:
+        list đường dẫn file ảnh (đã sắp xếp, không trùng lặp)
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(os.path.join(path, name) for name in os.listdir(path)
+                         if name.lower().endswith(INPUT_EXTENSIONS))
+        elif any(ch in path for ch in '*?['):
+            files.extend(glob.glob(path))
+        else:
+            files.append(path)
+    return sorted(set(files))
+
+
+def _init_worker(threads_per_worker, trace=False):
+    """
+    Khởi tạo tiến trình con: giới hạn số luồng OpenCV để các tiến trình không tranh CPU
+    và bật profiling nếu cần xuất trace
+    """
+    import cv2
+    cv2.setNumThreads(threads_per_worker)
+    if trace:
+        PROFILER.enable()
+
+
+def encode_options_from_args(args):
+    """
+    Tùy chọn encoder từ tham số dòng lệnh (khóa giống DEFAULT_ENCODE_OPTIONS)
+
+    Trả về:
+        dict truyền cho ImageProcessor.save_image
+    """
+    return dict(DEFAULT_ENCODE_OPTIONS,
+                quality=args.quality,
+                progressive=args.progressive,
+                optimize=args.optimize,
+                png_compression=args.png_compression,
+                webp_lossless=args.webp_lossless,
+                tiff_compression=args.tiff_compression)
+
+
+def process_file(input_path, output_path, recipe, encode_options):
+    """
+    Đọc → áp dụng công thức → ghi một ảnh (chạy trong tiến trình con)
+
+    Tham số:
+        encode_options: dict tùy chọn encoder (xem DEFAULT_ENCODE_OPTIONS)
+
+    Trả về:
+        (input_path, lỗi hoặc None, dict thời gian từng bước, số megapixel,
+         list sự kiện profiling - rỗng nếu profiling tắt)
+    """
+    timings = {}
+    start = time.perf_counter()
+    image = ImageProcessor.load_image(input_path)
+    timings['load'] = time.perf_counter() - start
+    if PROFILER.enabled:
+        PROFILER.record('load', start, start + timings['load'], 'io', {'path': input_path})
+    if image is None:
+        return input_path, "không đọc được ảnh", timings, 0.0, _take_events()
+
+    result = ImageProcessor.apply_recipe(image, recipe, timings)
+
+    start = time.perf_counter()
+    ok = ImageProcessor.save_image(output_path, result, **encode_options)
+    timings['save'] = time.perf_counter() - start
+    if PROFILER.enabled:
+        PROFILER.record('save', start, start + timings['save'], 'io',
+                        {'path': output_path, 'in_bytes': result.nbytes})
+    megapixels = image.shape[0] * image.shape[1] / 1e6
+    return (input_path, None if ok else f"không ghi được {output_path}", timings, megapixels,
+            _take_events())
+
+
+def _take_events():
+    """Lấy và xóa các sự kiện profiling của tiến trình hiện tại"""
+    if not PROFILER.enabled:
+        return []
+    events = PROFILER.events()
+    PROFILER.clear()
+    return events
+
+
+def run_batch(args):
+    """Lệnh batch: áp dụng một công thức cho nhiều ảnh bằng ProcessPoolExecutor"""
+    try:
+        recipe = load_recipe(args.recipe)
+    except (OSError, ValueError) as e:
+        print(f"Lỗi công thức: {e}", file=sys.stderr)
+        return 2
+
+    inputs = collect_inputs(args.inputs)
+    if not inputs:
+        print("Không tìm thấy ảnh đầu vào", file=sys.stderr)
+        return 2
+    os.makedirs(args.output, exist_ok=True)
+
+    jobs = []
+    for input_path in inputs:
+        stem = os.path.splitext(os.path.basename(input_path))[0]
+        output_path = os.path.join(args.output, f"{stem}{args.suffix}.{args.format}")
+        if os.path.abspath(output_path) == os.path.abspath(input_path):
+            print(f"Bỏ qua {input_path}: file đầu ra trùng file đầu vào", file=sys.stderr)
+            continue
+        jobs.append((input_path, output_path))
+
+    workers = args.workers or os.cpu_count() or 1
+    threads_per_worker = max(1, (os.cpu_count() or 1) // workers)
+    encode_options = encode_options_from_args(args)
+    totals = {}
+    failures = 0
+    megapixels = 0.0
+    start = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(threads_per_worker, bool(args.trace))) as pool:
+        futures = [pool.submit(process_file, input_path, output_path, recipe, encode_options)
+                   for input_path, output_path in jobs]
+        for i, (future, (input_path, _)) in enumerate(zip(futures, jobs), 1):
+            try:
+                _, error, timings, mp, events = future.result()
+            except Exception as e:  # Tiến trình con lỗi/bị kill (BrokenProcessPool): chỉ ảnh đó lỗi
+                error, timings, mp, events = str(e) or type(e).__name__, {}, 0.0, []
+            PROFILER.add_events(events)
+            for name, seconds in timings.items():
+                totals[name] = totals.get(name, 0.0) + seconds
+            megapixels += mp
+            if error:
+                failures += 1
+                print(f"[{i}/{len(jobs)}] LỖI {input_path}: {error}", file=sys.stderr)
+            elif not args.quiet:
+                print(f"[{i}/{len(jobs)}] {input_path}")
+
+    elapsed = time.perf_counter() - start
+    done = len(jobs) - failures
+    print(f"\nĐã xử lý {done}/{len(jobs)} ảnh trong {elapsed:.2f} s "
+          f"({done / elapsed:.2f} ảnh/s, {megapixels / elapsed:.1f} MP/s, {workers} tiến trình)")
+    if totals:
+        print("Tổng thời gian từng bước (cộng dồn trên mọi tiến trình):")
+        width = max(len(name) for name in totals)
+        for name, seconds in sorted(totals.items(), key=lambda item: -item[1]):
+            print(f"  {name.ljust(width)}  {seconds:8.2f} s")
+    if totals.get('save'):
+        # Ảnh kết quả là RGB 8 bit: 3 byte mỗi điểm ảnh đưa vào encoder
+        print(f"Tốc độ encode ({args.format}): {megapixels * 3e6 / totals['save'] / 2**20:.1f} MB/s "
+              f"mỗi tiến trình")
+    if args.trace:
+        count = PROFILER.export_chrome_trace(args.trace)
+        print(f"Đã ghi {count} sự kiện profiling vào {args.trace} (mở bằng ui.perfetto.dev)")
+    return 1 if failures else 0
+
+
+def run_stream(args):
+    """Lệnh stream: áp dụng một công thức cho từng khung của video / chuỗi ảnh"""
+    import cv2
+    from streaming import FrameSink, FrameSource, stream_recipe
+
+    try:
+        recipe = load_recipe(args.recipe)
+    except (OSError, ValueError) as e:
+        print(f"Lỗi công thức: {e}", file=sys.stderr)
+        return 2
+    try:
+        source = FrameSource(args.input, start=args.start, max_frames=args.max_frames)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+    sink = FrameSink(args.output, fps=args.fps or source.fps, fourcc=args.fourcc,
+                     image_format=args.format, encode_options=encode_options_from_args(args))
+
+    workers = args.workers or os.cpu_count() or 1
+    # Song song theo khung hình → mỗi luồng chỉ cần ít luồng OpenCV bên trong
+    cv2.setNumThreads(max(1, (os.cpu_count() or 1) // workers))
+    total = source.count or '?'
+
+    def on_frame(done):
+        if not args.quiet and (done % 25 == 0 or done == source.count):
+            print(f"\r[{done}/{total}] khung", end='', flush=True)
+
+    try:
+        stats = stream_recipe(source, sink, recipe, workers, args.queue_depth, on_frame)
+    except (OSError, ValueError) as e:
+        print(f"\nLỗi: {e}", file=sys.stderr)
+        return 1
+    latency = stats['frame_latency']
+    print(f"\nĐã xử lý {stats['frames']} khung trong {stats['elapsed']:.2f} s "
+          f"({stats['fps']:.1f} khung/s, {workers} luồng) → {args.output}")
+    if latency is not None:
+        print(f"Xử lý mỗi khung: p50 {latency['p50'] * 1000:.0f} ms · "
+              f"p95 {latency['p95'] * 1000:.0f} ms")
+    print(f"Hàng đợi: trung bình {stats['mean_depth']:.1f}, tối đa {stats['max_depth']}"
+          f"/{stats['queue_depth']} khung · đọc phải chờ {stats['read_stall']:.2f} s · "
+          f"ghi {stats['write']:.2f} s")
+    return 0
+
+
+def run_watch(args):
+    """Lệnh watch: thư mục nóng - xử lý ảnh mới / đã sửa, bỏ qua ảnh đã cập nhật (xem hotfolder.py)"""
+    from hotfolder import HotFolder
+
+    try:
+        recipe = load_recipe(args.recipe)
+    except (OSError, ValueError) as e:
+        print(f"Lỗi công thức: {e}", file=sys.stderr)
+        return 2
+    if not os.path.isdir(args.input):
+        print(f"Không tìm thấy thư mục {args.input}", file=sys.stderr)
+        return 2
+
+    folder = HotFolder(args.input, args.output, recipe, output_format=args.format,
+                       encode_options=encode_options_from_args(args), suffix=args.suffix,
+                       settle=args.settle)
+    workers = args.workers or os.cpu_count() or 1
+    threads_per_worker = max(1, (os.cpu_count() or 1) // workers)
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(threads_per_worker,)) as pool:
+        try:
+            if args.once:
+                folder.run_once(pool)
+            else:
+                folder.watch(pool, interval=args.interval, use_inotify=not args.poll)
+        except KeyboardInterrupt:
+            pass
+    totals = folder.totals
+    print(f"\nTổng: {totals['processed']} ảnh xử lý ({totals['failed']} lỗi, "
+          f"{totals['megapixels']:.1f} MP, {totals['seconds']:.2f} s xử lý) · "
+          f"{totals['skipped']} lượt bỏ qua ảnh đã cập nhật · "
+          f"chạy {time.perf_counter() - start:.1f} s")
+    return 1 if totals['failed'] else 0
+
+
+def run_serve(args):
+    """Lệnh serve: dịch vụ HTTP render ảnh cục bộ (xem server.py)"""
+    from server import RenderServer, RenderService
+
+    service = RenderService(args.workers or None, max_batch=args.max_batch,
+                            batch_window=args.batch_window / 1000)
+    try:
+        server = RenderServer((args.host, args.port), service, verbose=args.verbose,
+                              render_timeout=args.timeout)
+    except OSError as e:
+        service.close()
+        print(f"Không mở được cổng {args.host}:{args.port}: {e}", file=sys.stderr)
+        return 2
+    print(f"PhotoLab render tại http://{args.host}:{server.server_address[1]} "
+          f"({service.workers} tiến trình, khởi động {service.warmup_seconds * 1000:.0f} ms, "
+          f"lô tối đa {service.max_batch}) · POST /render · GET /stats · Ctrl+C để dừng")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+    stats = service.stats()
+    latency = stats['latency_ms']
+    print(f"\nĐã phục vụ {stats['requests']} request ({stats['errors']} lỗi, "
+          f"{stats['rejected']} bị từ chối, {stats['rps_overall']:.1f} req/s)"
+          + (f" · p50 {latency['p50']:.0f} · p95 {latency['p95']:.0f} · "
+             f"p99 {latency['p99']:.0f} ms" if latency else ""))
+    return 0
+
+
+def run_gui(args):
+    """Lệnh gui: mở giao diện Tk (chỉ import tkinter ở đây)"""
+    from main import main as gui_main
+    gui_main()
+    return 0
+
+
+def _add_encode_arguments(parser):
+    """Thêm các tùy chọn encoder (xem encode_options_from_args) vào parser của một lệnh con"""
+    parser.add_argument('--quality', type=int, default=DEFAULT_ENCODE_OPTIONS['quality'],
+                        help="chất lượng JPEG/WebP (1-100)")
+    parser.add_argument('--progressive', action='store_true', help="JPEG progressive")
+    parser.add_argument('--optimize', action='store_true',
+                        help="JPEG tối ưu bảng Huffman (file nhỏ hơn, chậm hơn)")
+    parser.add_argument('--png-compression', type=int, choices=range(10), metavar='0-9',
+                        default=DEFAULT_ENCODE_OPTIONS['png_compression'],
+                        help="mức nén PNG (0 = nhanh nhất, 9 = file nhỏ nhất)")
+    parser.add_argument('--webp-lossless', action='store_true', help="WebP không mất dữ liệu")
+    parser.add_argument('--tiff-compression', choices=TIFF_COMPRESSION_CODES,
+                        default=DEFAULT_ENCODE_OPTIONS['tiff_compression'], help="kiểu nén TIFF")
+
+
+def build_parser():
+    """Tạo parser dòng lệnh với các lệnh con"""
+    parser = argparse.ArgumentParser(prog="photolab", description="PhotoLab - xử lý ảnh")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    batch = commands.add_parser('batch', help="áp dụng công thức cho nhiều ảnh (không cần giao diện)")
+    batch.add_argument('recipe', help="file công thức JSON (các thông số giống slider)")
+    batch.add_argument('inputs', nargs='+', help="file ảnh, thư mục hoặc mẫu glob")
+    batch.add_argument('-o', '--output', required=True, help="thư mục đầu ra")
+    batch.add_argument('--format', choices=OUTPUT_FORMATS, default='jpg', help="định dạng đầu ra")
+    _add_encode_arguments(batch)
+    batch.add_argument('--suffix', default='', help="hậu tố thêm vào tên file đầu ra")
+    batch.add_argument('-j', '--workers', type=int, default=0,
+                       help="số tiến trình (mặc định: số nhân CPU)")
+    batch.add_argument('-q', '--quiet', action='store_true', help="không in từng file")
+    batch.add_argument('--trace', metavar='FILE',
+                       help="ghi thời gian từng bước ra file Chrome trace / Perfetto JSON")
+    batch.set_defaults(func=run_batch)
+
+    stream = commands.add_parser('stream', help="áp dụng công thức cho video hoặc chuỗi ảnh")
+    stream.add_argument('recipe', help="file công thức JSON (các thông số giống slider)")
+    stream.add_argument('input', help="file video, hoặc thư mục / mẫu glob / mẫu printf "
+                                      "(img_%%04d.png) của chuỗi ảnh")
+    stream.add_argument('-o', '--output', required=True,
+                        help="file video, mẫu printf hoặc thư mục cho chuỗi ảnh")
+    stream.add_argument('--format', choices=OUTPUT_FORMATS, default='png',
+                        help="định dạng ảnh khi ghi chuỗi ảnh vào thư mục")
+    stream.add_argument('--quality', type=int, default=DEFAULT_ENCODE_OPTIONS['quality'],
+                        help="chất lượng JPEG/WebP của chuỗi ảnh (1-100)")
+    stream.add_argument('--fps', type=float, help="số khung/giây của video ra (mặc định: như nguồn)")
+    stream.add_argument('--fourcc', help="codec video 4 ký tự (mặc định theo phần mở rộng)")
+    stream.add_argument('--start', type=int, default=0, help="bỏ qua chừng này khung đầu")
+    stream.add_argument('--max-frames', type=int, help="xử lý tối đa chừng này khung")
+    stream.add_argument('-j', '--workers', type=int, default=0,
+                        help="số luồng xử lý (mặc định: số nhân CPU)")
+    stream.add_argument('--queue-depth', type=int,
+                        help="số khung tối đa đang xử lý/chờ ghi (mặc định: 2 x số luồng)")
+    stream.add_argument('-q', '--quiet', action='store_true', help="không in tiến độ")
+    stream.set_defaults(func=run_stream, progressive=False, optimize=False,
+                        png_compression=DEFAULT_ENCODE_OPTIONS['png_compression'],
+                        webp_lossless=False,
+                        tiff_compression=DEFAULT_ENCODE_OPTIONS['tiff_compression'])
+
+    watch = commands.add_parser('watch', help="thư mục nóng: tự xử lý ảnh mới hoặc đã sửa")
+    watch.add_argument('recipe', help="file công thức JSON (các thông số giống slider)")
+    watch.add_argument('input', help="thư mục theo dõi (kể cả thư mục con)")
+    watch.add_argument('-o', '--output', required=True,
+                       help="thư mục đầu ra (chứa cả manifest .photolab-manifest.json)")
+    watch.add_argument('--format', choices=OUTPUT_FORMATS, default='jpg', help="định dạng đầu ra")
+    _add_encode_arguments(watch)
+    watch.add_argument('--suffix', default='', help="hậu tố thêm vào tên file đầu ra")
+    watch.add_argument('-j', '--workers', type=int, default=0,
+                       help="số tiến trình (mặc định: số nhân CPU)")
+    watch.add_argument('--interval', type=float, default=2.0,
+                       help="thời gian tối đa giữa hai lần quét (giây)")
+    watch.add_argument('--settle', type=float, default=2.0,
+                       help="bỏ qua file vừa sửa trong chừng này giây (đang được chép vào)")
+    watch.add_argument('--poll', action='store_true', help="luôn quét định kỳ, không dùng inotify")
+    watch.add_argument('--once', action='store_true', help="quét và xử lý một lượt rồi thoát")
+    watch.set_defaults(func=run_watch)
+
+    serve = commands.add_parser('serve', help="dịch vụ HTTP render ảnh cục bộ")
+    serve.add_argument('--host', default='127.0.0.1', help="địa chỉ lắng nghe")
+    serve.add_argument('--port', type=int, default=8765, help="cổng (0 = cổng trống bất kỳ)")
+    serve.add_argument('-j', '--workers', type=int, default=0,
+                       help="số tiến trình render (mặc định: số nhân CPU)")
+    serve.add_argument('--max-batch', type=int, default=8,
+                       help="số request nhỏ tối đa gộp vào một lần gửi tiến trình con (1 = không gộp)")
+    serve.add_argument('--batch-window', type=float, default=0.0, metavar='MS',
+                       help="chờ thêm request cho lô khi pool rảnh (ms, mặc định không chờ)")
+    serve.add_argument('--timeout', type=float, default=120.0, metavar='S',
+                       help="thời gian chờ render tối đa mỗi request, quá thì trả 504 (giây)")
+    serve.add_argument('-v', '--verbose', action='store_true', help="in từng request")
+    serve.set_defaults(func=run_serve)
+
+    gui = commands.add_parser('gui', help="mở giao diện PhotoLab")
+    gui.set_defaults(func=run_gui)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,14 +1,239 @@
 """
 processing.py - Các thuật toán xử lý ảnh sử dụng OpenCV
 Bao gồm: điều chỉnh sáng/tương phản, làm nét, làm mờ, lật ảnh
+Không phụ thuộc tkinter - dùng được cho cả giao diện lẫn xử lý hàng loạt (photolab.py)
 """
+import functools
+import json
+import math
+import os
+import threading
+import time
+
 import cv2
 import numpy as np
 
+from cache import StageCache
+from profiling import PROFILER
+
+
+# Kernel Gaussian lớn hơn ngưỡng này được làm mờ xấp xỉ qua kim tự tháp ảnh
+# (thu nhỏ → làm mờ → phóng to), nhanh hơn nhiều so với GaussianBlur chính xác
+BLUR_EXACT_MAX_KERNEL = 31
+# Hệ số thu nhỏ tối đa của kim tự tháp
+BLUR_PYRAMID_MAX_FACTOR = 8
+
+# Các chế độ làm mịn da (apply_skin_smoothing):
+# - bilateral: Bilateral Filter chính xác (chậm nhất, chất lượng gốc)
+# - guided: Guided Filter (cv2.ximgproc nếu có, nếu không dùng box filter), thời gian không phụ thuộc bán kính
+# - fast_bilateral: Bilateral trên ảnh thu nhỏ 2 lần rồi phóng to phần chênh lệch theo ảnh gốc
+SKIN_SMOOTHING_METHODS = ('bilateral', 'guided', 'fast_bilateral')
+
+# Thông số filter mặc định (trung tính) - cùng các khóa với slider trên giao diện
+DEFAULT_PARAMS = {
+    'brightness': 0,
+    'contrast': 0,
+    'vibrance': 0,
+    'saturation': 0,
+    'warmth': 0,
+    'skin_smooth': 0,
+    'smooth_method': 'bilateral',
+    'sharpen': 0,
+    'blur': 0,
+    'bokeh': 0,
+    'grayscale': False,
+}
+
+# Khoảng giá trị (min, max) của các thông số số nguyên - cũng là khoảng của slider trên giao diện
+PARAM_RANGES = {
+    'brightness': (-100, 100),
+    'contrast': (-100, 100),
+    'vibrance': (-100, 100),
+    'saturation': (-100, 100),
+    'warmth': (-50, 50),
+    'skin_smooth': (0, 100),
+    'sharpen': (0, 20),
+    'blur': (0, 30),
+    'bokeh': (0, 100),
+}
+
+# Cờ đọc ảnh thu nhỏ của cv2.imread theo hệ số: với JPEG, libjpeg giải mã thẳng ở 1/2, 1/4, 1/8
+# độ phân giải (bỏ qua phần lớn IDCT) nên nhanh hơn nhiều so với đọc đầy đủ
+REDUCED_DECODE_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+# Tùy chọn encoder mặc định khi lưu ảnh (xem ImageProcessor.imwrite_params)
+DEFAULT_ENCODE_OPTIONS = {
+    'quality': 95,              # Chất lượng JPEG/WebP (1-100)
+    'progressive': False,       # JPEG progressive (hiện dần khi tải qua mạng)
+    'optimize': False,          # JPEG tối ưu bảng Huffman (file nhỏ hơn, mã hóa chậm hơn)
+    'png_compression': 3,       # Mức nén PNG: 0 (nhanh, file lớn) - 9 (chậm, file nhỏ)
+    'webp_lossless': False,     # WebP không mất dữ liệu (bỏ qua quality)
+    'tiff_compression': 'lzw',  # Nén TIFF, xem TIFF_COMPRESSION_CODES
+}
+
+# Mã nén TIFF của libtiff (số cố định, dùng được với mọi phiên bản OpenCV)
+TIFF_COMPRESSION_CODES = {'none': 1, 'lzw': 5, 'deflate': 8, 'packbits': 32773}
+
+# Công thức chỉnh ảnh (recipe) = thông số filter + lật ảnh (lật sau cùng, xem Pipeline.compile)
+DEFAULT_RECIPE = dict(DEFAULT_PARAMS, flip_horizontal=False, flip_vertical=False)
+
+# Tổng dung lượng bộ đệm tạm được giữ lại giữa các lần chạy pipeline (bộ đệm cỡ ảnh xem
+# trước được dùng lại, bộ đệm cỡ ảnh gốc được giải phóng ngay sau khi chạy xong)
+DEFAULT_POOL_BYTES = 64 * 1024 * 1024
+
+
+class BufferPool:
+    """
+    Bộ đệm tạm dùng lại giữa các lần gọi, khóa theo (luồng, số chiều, dtype, slot) nên các
+    thuật toán khác nhau dùng chung một bộ đệm cỡ ảnh (ví dụ float32 của sharpen và guided filter);
+    chỉ cấp phát lại khi shape thay đổi. Mỗi luồng (luồng render nền, luồng lưu ảnh, các luồng
+    chia dải) có bộ đệm riêng. Hàm đang giữ một bộ đệm mà gọi hàm khác cũng lấy bộ đệm cùng
+    số chiều/dtype thì hai bên phải dùng slot khác nhau.
+    Nội dung bộ đệm có thể bị ghi đè ở lần gọi sau nên không được trả ra ngoài
+    """
+
+    def __init__(self, max_bytes=DEFAULT_POOL_BYTES):
+        """
+        Tham số:
+            max_bytes: dung lượng tối đa được giữ lại sau trim()
+        """
+        self.max_bytes = max_bytes
+        self._buffers = {}          # (thread id, số chiều, dtype, slot) -> numpy array
+        self._lock = threading.Lock()
+        self.allocations = 0        # Số lần phải cấp phát mới (để đánh giá hiệu quả dùng lại)
+
+    def get(self, shape, dtype=np.uint8, slot=0):
+        """Lấy bộ đệm shape/dtype cho luồng hiện tại (nội dung không xác định)"""
+        dtype = np.dtype(dtype)
+        key = (threading.get_ident(), len(shape), dtype, slot)
+        buffer = self._buffers.get(key)
+        if buffer is None or buffer.shape != shape:
+            buffer = np.empty(shape, dtype=dtype)
+            with self._lock:
+                self._buffers[key] = buffer
+                self.allocations += 1
+        return buffer
+
+    def nbytes(self):
+        """Tổng dung lượng các bộ đệm đang giữ"""
+        with self._lock:
+            return sum(buffer.nbytes for buffer in self._buffers.values())
+
+    def trim(self):
+        """Bỏ toàn bộ bộ đệm nếu tổng dung lượng vượt max_bytes (gọi sau mỗi lần chạy pipeline)"""
+        if self.nbytes() > self.max_bytes:
+            self.clear()
+
+    def clear(self):
+        """Bỏ toàn bộ bộ đệm (mảng đang được dùng dở vẫn an toàn vì còn được tham chiếu)"""
+        with self._lock:
+            self._buffers.clear()
+
+
+# Bộ đệm tạm dùng chung của các thuật toán trong ImageProcessor
+BUFFER_POOL = BufferPool()
+
+# Mask xóa phông đã dựng, khóa (h, w, scale), giới hạn theo byte (float32 cỡ ảnh: ~192 MB
+# cho ảnh 48 MP) - đủ cho ảnh gốc và các cỡ xem trước, mask lớn hơn giới hạn thì dựng lại mỗi lần
+BOKEH_MASK_CACHE_BYTES = 256 * 1024 * 1024
+BOKEH_MASKS = StageCache(BOKEH_MASK_CACHE_BYTES)
+
+
+def _get_buffer(shape, dtype=np.uint8, slot=0):
+    """Lấy bộ đệm tạm shape/dtype cho luồng hiện tại từ BUFFER_POOL"""
+    return BUFFER_POOL.get(shape, dtype, slot)
+
+
+def _copy_to(image, out=None):
+    """Sao chép image vào out (hoặc ra mảng mới nếu out là None) và trả về mảng đích"""
+    if out is None:
+        return image.copy()
+    if out is not image:
+        np.copyto(out, image)
+    return out
+
+
+def _gaussian_sigma(kernel_size):
+    """Sigma mà OpenCV tự suy ra từ kernel size khi truyền sigma = 0"""
+    return 0.3 * ((kernel_size - 1) * 0.5 - 1) + 0.8
+
+
+def _pyramid_factor(sigma):
+    """Hệ số thu nhỏ (lũy thừa của 2, >= 2) sao cho sigma ở ảnh nhỏ vẫn >= ~2 pixel"""
+    factor = 2
+    while factor * 2 <= BLUR_PYRAMID_MAX_FACTOR and factor * 2 <= sigma / 2.0:
+        factor *= 2
+    return factor
+
+
+def _downsample(image, factor):
+    """
+    Thu nhỏ ảnh đúng factor lần bằng trung bình khối (INTER_AREA)
+    Ảnh được đệm viền dưới/phải (reflect 101) cho tròn bội số của factor
+    """
+    h, w = image.shape[:2]
+    if h % factor or w % factor:
+        image = cv2.copyMakeBorder(image, 0, -h % factor, 0, -w % factor, cv2.BORDER_REFLECT_101)
+    ph, pw = image.shape[:2]
+    return cv2.resize(image, (pw // factor, ph // factor), interpolation=cv2.INTER_AREA)
+
+
+def _upsample(small, factor, h, w):
+    """Phóng to ảnh đã thu nhỏ bởi _downsample về kích thước (h, w) bằng nội suy tuyến tính"""
+    sh, sw = small.shape[:2]
+    result = cv2.resize(small, (sw * factor, sh * factor), interpolation=cv2.INTER_LINEAR)
+    return result[:h, :w]
+
+
+def _pyramid_margin(sigma, factor):
+    """Số pixel đệm mỗi cạnh (bội số của factor) để phủ hết bán kính Gaussian ở ảnh nhỏ"""
+    return int(math.ceil((3 * sigma + 2 * factor) / factor)) * factor
+
+
+def _blur_kernel(kernel_size, scale, sigma=0):
+    """Kernel size và sigma thực tế của apply_blur (đã thu nhỏ theo tỷ lệ ảnh proxy)"""
+    # Với ảnh proxy: thu nhỏ sigma theo tỷ lệ để độ mờ trông giống ảnh gốc
+    if scale < 1.0:
+        sigma = (sigma or _gaussian_sigma(kernel_size)) * scale
+    return ImageProcessor.scale_kernel_size(kernel_size, scale), sigma
+
+
+def _bokeh_kernel(blur_strength, scale):
+    """Kernel size và sigma của ảnh nền mờ trong apply_bokeh_effect"""
+    # Map blur_strength (0-100) sang kernel size (5-101, số lẻ)
+    kernel_size = int(5 + (blur_strength / 100.0) * 96)
+    if kernel_size % 2 == 0:
+        kernel_size += 1
+    # Ảnh proxy: thu nhỏ kernel và sigma theo tỷ lệ để độ mờ giống ảnh gốc
+    return _blur_kernel(kernel_size, scale)
+
+
+def _skin_smoothing_params(strength, scale):
+    """Tham số Bilateral Filter (d, sigma_color, sigma_space) của apply_skin_smoothing"""
+    # Map strength (0-100) sang các tham số Bilateral Filter
+    # d: kích thước vùng lân cận (3-15)
+    d = int(3 + (strength / 100.0) * 12)
+    # sigmaColor: độ mạnh lọc theo màu (10-150)
+    sigma_color = 10 + (strength / 100.0) * 140
+    # sigmaSpace: độ mạnh lọc theo không gian (10-150)
+    sigma_space = 10 + (strength / 100.0) * 140
+    
+    # Ảnh proxy: vùng lân cận và sigmaSpace tính theo pixel nên phải thu nhỏ theo tỷ lệ
+    # (sigmaColor tính theo cường độ màu nên giữ nguyên)
+    if scale < 1.0:
+        d = max(1, int(round(d * scale)))
+        sigma_space = sigma_space * scale
+    return d, sigma_color, sigma_space
+
 
 class ImageProcessor:
     @staticmethod
-    def apply_landscape_enhance(image, vibrance=60, saturation=30, sharpen=8, detail=10):
+    def apply_landscape_enhance(image, vibrance=60, saturation=30, sharpen=8, detail=10, out=None):
         """
         Tăng cường ảnh phong cảnh: màu sắc sống động, sắc nét, tăng chi tiết môi trường
         - Tăng vibrance (ưu tiên màu chưa bão hòa)
@@ -16,28 +241,28 @@ class ImageProcessor:
         - Làm nét (sharpen)
         - Tăng chi tiết (detail enhancement)
         Tham số mặc định phù hợp cho ảnh phong cảnh
+        out: mảng đích cùng shape/dtype (None = cấp phát mới)
         """
-        result = image.copy()
         # 1. Tăng vibrance & saturation
-        result = ImageProcessor.apply_vibrance_saturation(result, vibrance, saturation)
-        # 2. Làm nét (sharpen)
+        result = ImageProcessor.apply_vibrance_saturation(image, vibrance, saturation)
+        # 2. Làm nét (sharpen) - ghi đè tại chỗ lên kết quả trung gian
         if sharpen > 0:
-            result = ImageProcessor.apply_sharpen(result, sharpen)
+            result = ImageProcessor.apply_sharpen(result, sharpen, out=result)
         # 3. Tăng chi tiết môi trường (detail enhancement)
         if detail > 0:
             # Sử dụng kỹ thuật High Pass Filter để tăng chi tiết
             gray = cv2.cvtColor(result, cv2.COLOR_RGB2GRAY)
             # Lấy chi tiết cao tần
-            highpass = cv2.GaussianBlur(gray, 1, 3)
+            highpass = cv2.GaussianBlur(gray, (0, 0), 3)
             highpass = cv2.addWeighted(gray, 1.5, highpass, -0.5, 0)
             # Ghép lại thành 3 kênh
             highpass_color = cv2.cvtColor(highpass, cv2.COLOR_GRAY2RGB)
-            # Blend với ảnh gốc
-            result = cv2.addWeighted(result, 1.0, highpass_color, 0.25, 0)
-        return np.clip(result, 0, 255).astype(np.uint8)
+            # Blend với ảnh gốc (uint8 + uint8 → bão hòa về [0, 255])
+            return cv2.addWeighted(result, 1.0, highpass_color, 0.25, 0, dst=out)
+        return _copy_to(result, out)
 
     @staticmethod
-    def apply_vibrance_saturation(image, vibrance=0, saturation=0):
+    def apply_vibrance_saturation(image, vibrance=0, saturation=0, out=None):
         """
         Tăng cường độ rực rỡ (Vibrance) và độ bão hòa (Saturation) cho ảnh phong cảnh
         - Vibrance chỉ tăng bão hòa cho các màu chưa bão hòa (giữ màu da tự nhiên)
@@ -47,12 +272,38 @@ class ImageProcessor:
             image: numpy array RGB
             vibrance: -100 đến 100 (0 = không đổi)
             saturation: -100 đến 100 (0 = không đổi)
+            out: mảng đích cùng shape/dtype (None = cấp phát mới)
         """
         if vibrance == 0 and saturation == 0:
-            return image.copy()
-        # Chuyển sang HSV để dễ thao tác
-        img_hsv = cv2.cvtColor(image, cv2.COLOR_RGB2HSV).astype(np.float32)
-        h, s, v = img_hsv[:,:,0], img_hsv[:,:,1], img_hsv[:,:,2]
+            return _copy_to(image, out)
+        # Chuyển sang HSV (ghi vào bộ đệm dùng lại) để dễ thao tác
+        img_hsv = _get_buffer(image.shape)
+        cv2.cvtColor(image, cv2.COLOR_RGB2HSV, dst=img_hsv)
+        # Chỉ kênh S thay đổi và mỗi giá trị S chỉ phụ thuộc chính nó → tra bảng LUT tại chỗ
+        # (kênh H, V dùng bảng đồng nhất). Slot 2: slot 0 đang giữ img_hsv cùng số chiều/dtype,
+        # slot 1 là bộ đệm đệm biên của apply_blur trong cùng chuỗi
+        lut = _get_buffer((256, 1, 3), slot=2)
+        lut[:, 0, 0] = lut[:, 0, 2] = np.arange(256, dtype=np.uint8)
+        lut[:, 0, 1] = ImageProcessor.vibrance_saturation_lut(vibrance, saturation)
+        cv2.LUT(img_hsv, lut, dst=img_hsv)
+        # Chuyển về RGB
+        return cv2.cvtColor(img_hsv, cv2.COLOR_HSV2RGB, dst=out)
+
+    @staticmethod
+    def vibrance_saturation_lut(vibrance=0, saturation=0):
+        """
+        Tạo bảng LUT (256 phần tử, uint8) cho kênh S (HSV) theo vibrance và saturation
+        Tính bằng đúng công thức float32 trên 256 giá trị S nên trùng khớp từng bit
+        với cách tính trên toàn ảnh
+        
+        Tham số:
+            vibrance: -100 đến 100 (0 = không đổi)
+            saturation: -100 đến 100 (0 = không đổi)
+            
+        Trả về:
+            numpy array uint8 shape (256,)
+        """
+        s = np.arange(256, dtype=np.float32)
         # 1. Tăng Saturation đều
         if saturation != 0:
             sat_factor = 1.0 + (saturation / 100.0)
@@ -64,36 +315,160 @@ class ImageProcessor:
             vib_factor = 1.0 + (vibrance / 100.0)
             s[mask] = s[mask] * vib_factor
         # Clamp lại S về [0,255]
-        s = np.clip(s, 0, 255)
-        img_hsv[:,:,1] = s
-        # Ghép lại và chuyển về RGB
-        img_hsv = np.clip(img_hsv, 0, 255).astype(np.uint8)
-        result = cv2.cvtColor(img_hsv, cv2.COLOR_HSV2RGB)
-        return result
+        return np.clip(s, 0, 255).astype(np.uint8)
     """
     Class chứa các thuật toán xử lý ảnh
     Tất cả các phương thức đều là static - không cần khởi tạo instance
     """
     
     @staticmethod
-    def load_image(filepath):
+    def load_image(filepath, reduce=1):
         """
         Đọc ảnh từ đường dẫn file
         
         Tham số:
             filepath: đường dẫn tới file ảnh
+            reduce: hệ số thu nhỏ khi đọc (1, 2, 4 hoặc 8), xem REDUCED_DECODE_FLAGS
             
         Trả về:
             numpy array định dạng RGB, hoặc None nếu không đọc được
         """
-        img = cv2.imread(filepath)
+        img = cv2.imread(filepath, REDUCED_DECODE_FLAGS[reduce])
         if img is None:
             return None
         # OpenCV đọc màu theo chuẩn BGR, cần chuyển sang RGB để hiển thị đúng
         return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
 
     @staticmethod
-    def apply_brightness_contrast(image, brightness=0, contrast=0):
+    def reduced_decode_factor(image_size, display_size):
+        """
+        Chọn hệ số đọc thu nhỏ lớn nhất mà ảnh đọc được vẫn không nhỏ hơn ảnh proxy hiển thị
+        
+        Tham số:
+            image_size: (rộng, cao) của ảnh gốc (đọc từ header, chưa giải mã)
+            display_size: (rộng, cao) tối đa của khung hiển thị
+            
+        Trả về:
+            1, 2, 4 hoặc 8
+        """
+        w, h = image_size
+        max_w, max_h = display_size
+        # Ảnh có thể được xoay theo EXIF khi đọc → lấy tỷ lệ proxy lớn hơn trong hai chiều
+        scale = max(min(max_w / w, max_h / h), min(max_w / h, max_h / w))
+        for factor in (8, 4, 2):
+            if factor * scale <= 1.0:
+                return factor
+        return 1
+
+    @staticmethod
+    def imwrite_params(filepath, quality=95, progressive=False, optimize=False,
+                       png_compression=3, webp_lossless=False, tiff_compression='lzw'):
+        """
+        Tham số encoder của cv2.imwrite theo định dạng file (xem DEFAULT_ENCODE_OPTIONS)
+        
+        Tham số:
+            filepath: đường dẫn file (định dạng lấy theo phần mở rộng)
+            quality: chất lượng JPEG/WebP từ 1 đến 100
+            progressive, optimize: JPEG progressive / tối ưu bảng Huffman
+            png_compression: mức nén PNG từ 0 đến 9
+            webp_lossless: True để lưu WebP không mất dữ liệu
+            tiff_compression: một trong TIFF_COMPRESSION_CODES
+            
+        Trả về:
+            list tham số truyền cho cv2.imwrite
+        """
+        ext = os.path.splitext(filepath)[1].lower()
+        if ext in ('.jpg', '.jpeg'):
+            return [cv2.IMWRITE_JPEG_QUALITY, int(quality),
+                    cv2.IMWRITE_JPEG_PROGRESSIVE, int(bool(progressive)),
+                    cv2.IMWRITE_JPEG_OPTIMIZE, int(bool(optimize))]
+        if ext == '.png':
+            return [cv2.IMWRITE_PNG_COMPRESSION, int(png_compression)]
+        if ext == '.webp':
+            # OpenCV: quality > 100 = WebP lossless
+            return [cv2.IMWRITE_WEBP_QUALITY, 101 if webp_lossless else int(quality)]
+        if ext in ('.tif', '.tiff'):
+            return [cv2.IMWRITE_TIFF_COMPRESSION, TIFF_COMPRESSION_CODES[tiff_compression]]
+        return []
+
+    @staticmethod
+    def save_image(filepath, image, quality=95, **options):
+        """
+        Ghi ảnh RGB (hoặc grayscale) ra file
+        
+        Tham số:
+            filepath: đường dẫn file đích (định dạng theo phần mở rộng)
+            image: numpy array RGB hoặc grayscale
+            quality: chất lượng JPEG/WebP từ 1 đến 100
+            options: các tùy chọn encoder khác của imwrite_params
+            
+        Trả về:
+            True nếu ghi thành công
+        """
+        # OpenCV yêu cầu định dạng BGR khi lưu
+        if len(image.shape) == 2:  # Ảnh grayscale
+            save_img = image
+        else:
+            save_img = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+        return bool(cv2.imwrite(filepath, save_img,
+                                ImageProcessor.imwrite_params(filepath, quality, **options)))
+
+    @staticmethod
+    def decode_image(data):
+        """
+        Giải mã ảnh từ bytes của file ảnh (JPEG, PNG, ...) trong bộ nhớ
+        
+        Tham số:
+            data: bytes / bytearray / memoryview nội dung file ảnh
+            
+        Trả về:
+            numpy array định dạng RGB, hoặc None nếu không giải mã được
+        """
+        img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if img is None:
+            return None
+        return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+    @staticmethod
+    def encode_image(image, image_format='jpg', quality=95, **options):
+        """
+        Mã hóa ảnh RGB (hoặc grayscale) thành bytes của file ảnh trong bộ nhớ
+        
+        Tham số:
+            image: numpy array RGB hoặc grayscale
+            image_format: phần mở rộng định dạng ('jpg', 'png', 'webp', 'tiff', 'bmp')
+            quality, options: xem imwrite_params
+            
+        Trả về:
+            bytes, hoặc None nếu mã hóa lỗi
+        """
+        ext = f".{image_format}"
+        if len(image.shape) == 2:
+            encode_img = image
+        else:
+            encode_img = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+        ok, buffer = cv2.imencode(ext, encode_img,
+                                  ImageProcessor.imwrite_params(ext, quality, **options))
+        return buffer.tobytes() if ok else None
+
+    @staticmethod
+    def apply_recipe(image, recipe, timings=None):
+        """
+        Áp dụng một công thức chỉnh ảnh (lật ảnh + toàn bộ chuỗi filter) ở độ phân giải gốc
+        (xem Pipeline.from_recipe)
+        
+        Tham số:
+            image: numpy array ảnh RGB
+            recipe: dict theo định dạng DEFAULT_RECIPE (khóa thiếu lấy giá trị mặc định)
+            timings: dict tên bước -> tổng thời gian (giây), được cộng dồn nếu truyền vào
+            
+        Trả về:
+            numpy array ảnh đã xử lý
+        """
+        return Pipeline.from_recipe(recipe).compile().run(image, timings=timings)
+
+    @staticmethod
+    def apply_brightness_contrast(image, brightness=0, contrast=0, out=None):
         """
         Điều chỉnh độ sáng và tương phản của ảnh
         
@@ -105,6 +480,7 @@ class ImageProcessor:
             image: numpy array ảnh đầu vào
             brightness: độ sáng từ -100 đến 100 (0 = không đổi)
             contrast: tương phản từ -100 đến 100 (0 = không đổi)
+            out: mảng đích cùng shape/dtype (None = cấp phát mới), có thể là chính image
             
         Trả về:
             numpy array ảnh đã xử lý
@@ -114,10 +490,28 @@ class ImageProcessor:
 
         # Nếu không có chỉnh sửa, trả về ảnh gốc
         if brightness == 0 and contrast == 0:
-            return image.copy()
+            return _copy_to(image, out)
+
+        # Phép biến đổi điểm ảnh → tra bảng LUT 256 giá trị, không cần mảng float cỡ ảnh
+        lut = ImageProcessor.brightness_contrast_lut(brightness, contrast)
+        return ImageProcessor.apply_point_lut(image, lut, out)
 
+    @staticmethod
+    def brightness_contrast_lut(brightness=0, contrast=0):
+        """
+        Tạo bảng LUT (256 phần tử, uint8) cho độ sáng và tương phản
+        Tính bằng đúng công thức float32 của apply_brightness_contrast trên 256 giá trị
+        nên kết quả tra bảng trùng khớp từng bit với cách tính trên toàn ảnh
+        
+        Tham số:
+            brightness: độ sáng từ -100 đến 100 (0 = không đổi)
+            contrast: tương phản từ -100 đến 100 (0 = không đổi)
+            
+        Trả về:
+            numpy array uint8 shape (256,)
+        """
         # Chuyển sang float để tính toán
-        img_float = image.astype(np.float32, copy=True)
+        lut = np.arange(256, dtype=np.float32)
         
         # Áp dụng tương phản
         # Contrast: Map từ [-100, 100] sang [0.5, 3.0] (1.0 là gốc)
@@ -128,52 +522,228 @@ class ImageProcessor:
                 alpha = 1.0 + (contrast / 100.0) * 0.5  # 0.5 to 1.0
             
             # Áp dụng tương phản: (pixel - 128) * alpha + 128
-            img_float -= 128.0
-            img_float *= alpha
-            img_float += 128.0
+            lut -= 128.0
+            lut *= alpha
+            lut += 128.0
         
         # Áp dụng độ sáng
         if brightness != 0:
-            img_float += brightness
+            lut += brightness
         
         # Clamp giá trị về [0, 255]
-        np.clip(img_float, 0, 255, out=img_float)
-        return img_float.astype(np.uint8)
+        np.clip(lut, 0, 255, out=lut)
+        return lut.astype(np.uint8)
 
     @staticmethod
-    def to_grayscale(image):
+    def skin_tone_lut(warmth=0):
+        """
+        Tạo bảng LUT theo từng kênh (256 x 3, uint8) cho điều chỉnh độ ấm
+        
+        Tham số:
+            warmth: độ ấm (-50 đến 50), dương = vàng ấm, âm = xanh lạnh
+            
+        Trả về:
+            numpy array uint8 shape (256, 3) - cột 0, 1, 2 tương ứng kênh R, G, B
+        """
+        values = np.arange(256, dtype=np.float32)
+        
+        # Điều chỉnh độ ấm (tăng R và G, giảm B cho ấm; ngược lại cho lạnh)
+        warm_factor = warmth / 50.0 * 0.1  # ±10%
+        r = values * (1.0 + warm_factor)
+        g = values * (1.0 + warm_factor * 0.5)  # G tăng ít hơn
+        b = values * (1.0 - warm_factor)  # B giảm khi ấm
+        
+        # Clamp giá trị về [0, 255]
+        return np.clip(np.stack([r, g, b], axis=1), 0, 255).astype(np.uint8)
+
+    @staticmethod
+    def compose_luts(*luts):
+        """
+        Gộp nhiều bảng LUT liên tiếp thành một bảng duy nhất (áp dụng theo thứ tự truyền vào)
+        Vì mỗi bước đều ánh xạ uint8 → uint8 nên bảng gộp cho kết quả trùng khớp từng bit
+        với việc áp dụng lần lượt từng bước
+        
+        Tham số:
+            luts: các bảng shape (256,) (dùng chung cho mọi kênh) hoặc (256, 3) (theo kênh)
+            
+        Trả về:
+            numpy array uint8 shape (256,) nếu mọi bảng đều dùng chung, ngược lại (256, 3)
+        """
+        if all(lut.ndim == 1 for lut in luts):
+            result = np.arange(256, dtype=np.uint8)
+            for lut in luts:
+                result = lut[result]
+            return result
+        
+        result = np.tile(np.arange(256, dtype=np.uint8)[:, None], (1, 3))
+        for lut in luts:
+            if lut.ndim == 1:
+                result = lut[result]
+            else:
+                for c in range(3):
+                    result[:, c] = lut[result[:, c], c]
+        return result
+
+    @staticmethod
+    def apply_point_lut(image, lut, out=None):
+        """
+        Áp dụng bảng LUT lên ảnh trong một lượt cv2.LUT duy nhất (không có mảng trung gian float)
+        
+        Tham số:
+            image: numpy array uint8 (RGB hoặc grayscale)
+            lut: bảng shape (256,) dùng chung cho mọi kênh, hoặc (256, 3) theo kênh RGB
+            out: mảng đích cùng shape/dtype (None = cấp phát mới), có thể là chính image
+            
+        Trả về:
+            numpy array ảnh đã tra bảng
+        """
+        if lut.ndim == 1:
+            return cv2.LUT(image, lut, dst=out)
+        if image.ndim == 2:
+            raise ValueError("LUT theo kênh màu cần ảnh 3 kênh")
+        return cv2.LUT(image, np.ascontiguousarray(lut.reshape(256, 1, 3)), dst=out)
+
+    @staticmethod
+    def to_grayscale(image, out=None):
         """
         Chuyển ảnh màu sang trắng đen (Grayscale)
         
         Tham số:
             image: numpy array ảnh RGB
+            out: mảng đích cùng shape/dtype (None = cấp phát mới), có thể là chính image
             
         Trả về:
             numpy array grayscale (vẫn giữ 3 kênh màu để hiển thị)
         """
-        gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+        gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY, dst=_get_buffer(image.shape[:2]))
         # Chuyển lại thành 3 kênh để Tkinter có thể hiển thị
-        return cv2.cvtColor(gray, cv2.COLOR_GRAY2RGB)
+        return cv2.cvtColor(gray, cv2.COLOR_GRAY2RGB, dst=out)
 
     @staticmethod
-    def apply_blur(image, kernel_size=5):
+    def to_luma(image, out=None):
+        """
+        Kênh sáng (luminance) của ảnh RGB - cùng công thức với to_grayscale nhưng giữ 1 kênh
+        
+        Tham số:
+            image: numpy array ảnh RGB
+            out: mảng đích shape (h, w) uint8 (None = cấp phát mới)
+            
+        Trả về:
+            numpy array shape (h, w)
+        """
+        return cv2.cvtColor(image, cv2.COLOR_RGB2GRAY, dst=out)
+
+    @staticmethod
+    def gray_to_rgb(image, out=None):
+        """Mở rộng ảnh 1 kênh thành 3 kênh bằng nhau (để hiển thị/lưu), out: mảng đích RGB"""
+        return cv2.cvtColor(image, cv2.COLOR_GRAY2RGB, dst=out)
+
+    @staticmethod
+    def apply_blur(image, kernel_size=5, scale=1.0, sigma=0, out=None, keep_channels=False):
         """
         Làm mờ ảnh bằng bộ lọc Gaussian Blur
         
         Tham số:
             image: numpy array ảnh đầu vào
             kernel_size: kích thước ma trận kernel (phải là số lẻ: 3, 5, 7...)
+            scale: tỷ lệ của ảnh so với ảnh gốc (< 1 khi xử lý ảnh proxy xem trước)
+            sigma: độ lệch chuẩn ở độ phân giải gốc (0 = suy ra từ kernel_size)
+            out: mảng đích RGB (None = cấp phát mới), có thể là chính image
+            keep_channels: True để ảnh 1 kênh trả về 1 kênh (chuỗi trắng đen, xem Pipeline.compile)
             
         Trả về:
             numpy array ảnh đã làm mờ
         """
-        if len(image.shape) == 2:  # Nếu là ảnh grayscale
-            result = cv2.GaussianBlur(image, (kernel_size, kernel_size), 0)
-            return cv2.cvtColor(result, cv2.COLOR_GRAY2RGB)
-        return cv2.GaussianBlur(image, (kernel_size, kernel_size), 0)
+        kernel_size, sigma = _blur_kernel(kernel_size, scale, sigma)
+        if len(image.shape) == 2 and not keep_channels:  # Nếu là ảnh grayscale
+            result = ImageProcessor.gaussian_blur(image, kernel_size, sigma)
+            return cv2.cvtColor(result, cv2.COLOR_GRAY2RGB, dst=out)
+        return ImageProcessor.gaussian_blur(image, kernel_size, sigma, out=out)
 
     @staticmethod
-    def apply_sharpen(image, strength=1):
+    def gaussian_blur(image, kernel_size, sigma=0, exact=False, out=None):
+        """
+        Engine làm mờ Gaussian dùng chung cho apply_blur và apply_bokeh_effect
+        - kernel_size <= BLUR_EXACT_MAX_KERNEL: cv2.GaussianBlur chính xác
+        - kernel lớn hơn: xấp xỉ qua kim tự tháp ảnh: đệm viền (reflect 101) → thu nhỏ
+          factor lần (INTER_AREA) → Gaussian với sigma đã bù → phóng to (INTER_LINEAR)
+        Sai số so với Gaussian chính xác: tối đa ~3 mức xám, trung bình < 0.6
+        (xem `python benchmark.py blur`)
+        
+        Tham số:
+            image: numpy array ảnh đầu vào
+            kernel_size: kích thước kernel (số lẻ)
+            sigma: độ lệch chuẩn (0 = suy ra từ kernel_size như OpenCV)
+            exact: True để luôn dùng Gaussian chính xác
+            out: mảng đích cùng shape/dtype (None = cấp phát mới), có thể là chính image
+            
+        Trả về:
+            numpy array ảnh đã làm mờ
+        """
+        if exact or kernel_size <= BLUR_EXACT_MAX_KERNEL:
+            return cv2.GaussianBlur(image, (kernel_size, kernel_size), sigma, dst=out)
+        
+        if sigma <= 0:
+            sigma = _gaussian_sigma(kernel_size)
+        factor = _pyramid_factor(sigma)
+        margin = _pyramid_margin(sigma, factor)
+        h, w = image.shape[:2]
+        
+        # Đệm viền đủ rộng để Gaussian ở ảnh nhỏ không chạm biên, và làm tròn kích thước
+        # lên bội số của factor để thu nhỏ đúng bằng trung bình khối factor x factor
+        # Ảnh đệm và ảnh phóng to cỡ toàn ảnh lấy từ bộ đệm dùng lại của luồng
+        # (slot 1: apply_bokeh_effect đang giữ bộ đệm slot 0 cùng dtype làm out)
+        ph, pw = h + 2 * margin + (-h % factor), w + 2 * margin + (-w % factor)
+        padded = cv2.copyMakeBorder(image, margin, margin + (-h % factor),
+                                    margin, margin + (-w % factor), cv2.BORDER_REFLECT_101,
+                                    dst=_get_buffer((ph, pw) + image.shape[2:], image.dtype,
+                                                    slot=1))
+        small = cv2.resize(padded, (pw // factor, ph // factor), interpolation=cv2.INTER_AREA)
+        
+        # Trung bình khối và nội suy tuyến tính cũng làm mờ thêm (phương sai ~factor²/4)
+        small_sigma = math.sqrt(max(sigma * sigma - factor * factor / 4.0, 0.25)) / factor
+        small = cv2.GaussianBlur(small, (0, 0), small_sigma, dst=small)
+        
+        result = cv2.resize(small, (pw, ph), interpolation=cv2.INTER_LINEAR, dst=padded)
+        return _copy_to(result[margin:margin + h, margin:margin + w], out)
+
+    @staticmethod
+    def blur_footprint(kernel_size, sigma=0, exact=False):
+        """
+        Vùng ảnh hưởng của gaussian_blur, dùng khi chia ảnh thành dải/ô để xử lý song song
+        
+        Trả về:
+            (halo, align): mỗi pixel kết quả chỉ phụ thuộc các pixel đầu vào cách nó tối đa
+            halo pixel; gốc của vùng cắt phải là bội số của align để kết quả trùng khớp
+        """
+        if exact or kernel_size <= BLUR_EXACT_MAX_KERNEL:
+            return kernel_size // 2, 1
+        if sigma <= 0:
+            sigma = _gaussian_sigma(kernel_size)
+        factor = _pyramid_factor(sigma)
+        return _pyramid_margin(sigma, factor), factor
+
+    @staticmethod
+    def scale_kernel_size(kernel_size, scale):
+        """
+        Thu nhỏ kích thước kernel theo tỷ lệ ảnh proxy
+        
+        Tham số:
+            kernel_size: kích thước kernel ở độ phân giải gốc
+            scale: tỷ lệ ảnh proxy so với ảnh gốc (0 < scale <= 1)
+            
+        Trả về:
+            kích thước kernel mới (luôn là số lẻ >= 1)
+        """
+        if scale >= 1.0:
+            return kernel_size
+        kernel_size = int(round(kernel_size * scale))
+        if kernel_size % 2 == 0:
+            kernel_size += 1
+        return max(1, kernel_size)
+
+    @staticmethod
+    def apply_sharpen(image, strength=1, out=None, keep_channels=False):
         """
         Làm nét ảnh bằng kỹ thuật Unsharp Masking
         Sử dụng ma trận tích chập (Convolution Kernel) 3x3
@@ -181,6 +751,8 @@ class ImageProcessor:
         Tham số:
             image: numpy array ảnh đầu vào
             strength: độ mạnh làm nét từ 0 đến 20
+            out: mảng đích RGB uint8 (None = cấp phát mới), có thể là chính image
+            keep_channels: True để ảnh 1 kênh trả về 1 kênh (chuỗi trắng đen, xem Pipeline.compile)
             
         Trả về:
             numpy array ảnh đã làm nét
@@ -199,58 +771,185 @@ class ImageProcessor:
             [0, -alpha/4, 0]
         ], dtype=np.float32)
         
-        # Áp dụng bộ lọc
-        img_float = image.astype(np.float32)
-        result = cv2.filter2D(src=img_float, ddepth=-1, kernel=kernel)
+        # Áp dụng bộ lọc tại chỗ trên bản float32 nằm trong bộ đệm dùng lại
+        # (lọc thẳng từ uint8 sang CV_32F làm tròn khác ±1 ở một số strength)
+        result = _get_buffer(image.shape, np.float32)
+        np.copyto(result, image)
+        cv2.filter2D(src=result, ddepth=-1, kernel=kernel, dst=result)
         
-        # Giới hạn giá trị pixel trong khoảng [0, 255]
-        result = np.clip(result, 0, 255).astype(np.uint8)
+        # Giới hạn giá trị pixel trong khoảng [0, 255], cắt phần thập phân như astype(uint8)
+        np.clip(result, 0, 255, out=result)
         
-        if len(image.shape) == 2:
-            return cv2.cvtColor(result, cv2.COLOR_GRAY2RGB)
-        return result
+        if len(image.shape) == 2 and not keep_channels:
+            return cv2.cvtColor(result.astype(np.uint8), cv2.COLOR_GRAY2RGB, dst=out)
+        if out is None:
+            return result.astype(np.uint8)
+        np.copyto(out, result, casting='unsafe')
+        return out
 
     @staticmethod
-    def flip_horizontal(image):
-        """Lật ảnh theo chiều ngang (trái ↔ phải)"""
-        return cv2.flip(image, 1)
+    def flip_horizontal(image, out=None):
+        """Lật ảnh theo chiều ngang (trái ↔ phải), out: mảng đích (None = cấp phát mới)"""
+        return cv2.flip(image, 1, dst=out)
 
     @staticmethod
-    def flip_vertical(image):
-        """Lật ảnh theo chiều dọc (trên ↔ dưới)"""
-        return cv2.flip(image, 0)
+    def flip_vertical(image, out=None):
+        """Lật ảnh theo chiều dọc (trên ↔ dưới), out: mảng đích (None = cấp phát mới)"""
+        return cv2.flip(image, 0, dst=out)
+
+    @staticmethod
+    def orient(image, flip_h=False, flip_v=False):
+        """
+        Áp dụng hướng ảnh dưới dạng view NumPy (không sao chép dữ liệu)
+        Dùng ở bước hiển thị: ảnh render giữ hướng gốc, chỉ khung hình hiển thị được lật
+        
+        Tham số:
+            image: numpy array ảnh
+            flip_h, flip_v: lật ngang / lật dọc
+            
+        Trả về:
+            view của image (stride âm theo trục bị lật) - cần np.ascontiguousarray
+            trước khi đưa vào hàm OpenCV
+        """
+        return image[::-1 if flip_v else 1, ::-1 if flip_h else 1]
 
     @staticmethod
-    def apply_skin_smoothing(image, strength=50):
+    def apply_skin_smoothing(image, strength=50, scale=1.0, method='bilateral', out=None):
         """
-        Làm mịn da sử dụng Bilateral Filter
+        Làm mịn da sử dụng Bilateral Filter (hoặc bộ lọc giữ cạnh nhanh hơn, xem method)
         Ưu điểm: làm mờ các chi tiết nhỏ (mụn, nếp nhăn) nhưng giữ lại các cạnh sắc nét
         
         Tham số:
             image: numpy array ảnh đầu vào
             strength: độ mạnh làm mịn từ 0 đến 100
+            scale: tỷ lệ của ảnh so với ảnh gốc (< 1 khi xử lý ảnh proxy xem trước)
+            method: một trong SKIN_SMOOTHING_METHODS ('bilateral', 'guided', 'fast_bilateral')
+            out: mảng đích cùng shape/dtype (None = cấp phát mới), không được là image
             
         Trả về:
             numpy array ảnh đã làm mịn
         """
         if strength <= 0:
-            return image.copy()
+            return _copy_to(image, out)
+        
+        d, sigma_color, sigma_space = _skin_smoothing_params(strength, scale)
         
-        # Map strength (0-100) sang các tham số Bilateral Filter
-        # d: kích thước vùng lân cận (3-15)
-        d = int(3 + (strength / 100.0) * 12)
-        # sigmaColor: độ mạnh lọc theo màu (10-150)
-        sigma_color = 10 + (strength / 100.0) * 140
-        # sigmaSpace: độ mạnh lọc theo không gian (10-150)
-        sigma_space = 10 + (strength / 100.0) * 140
+        if method == 'guided':
+            # Bán kính theo vùng lân cận của bilateral, eps theo sigmaColor
+            # (hệ số 0.25 cho PSNR cao nhất so với bilateral, xem `python benchmark.py smoothing`)
+            return ImageProcessor.guided_filter(image, max(1, d // 2), (0.25 * sigma_color) ** 2,
+                                                out=out)
+        if method == 'fast_bilateral':
+            return ImageProcessor.fast_bilateral_filter(image, d, sigma_color, sigma_space, out=out)
+        if method != 'bilateral':
+            raise ValueError(f"Chế độ làm mịn không hợp lệ: {method}")
         
         # Áp dụng Bilateral Filter
-        result = cv2.bilateralFilter(image, d, sigma_color, sigma_space)
+        result = cv2.bilateralFilter(image, d, sigma_color, sigma_space, dst=out)
         
         return result
 
     @staticmethod
-    def apply_bokeh_effect(image, blur_strength=50):
+    def skin_smoothing_footprint(strength, scale=1.0, method='bilateral'):
+        """
+        Vùng ảnh hưởng (halo, align) của apply_skin_smoothing, xem blur_footprint
+        """
+        if strength <= 0:
+            return 0, 1
+        d, _, _ = _skin_smoothing_params(strength, scale)
+        if method == 'guided':
+            radius, subsample = max(1, d // 2), 2
+            if hasattr(cv2, 'ximgproc') or radius < subsample:
+                return 2 * radius + 1, 1
+            # Hai lượt box filter ở ảnh nhỏ + thu nhỏ/phóng to mỗi bên thêm 1 pixel nhỏ
+            small_radius = max(1, int(round(radius / subsample)))
+            return (2 * small_radius + 2) * subsample, subsample
+        if method == 'fast_bilateral':
+            factor = 2
+            small_d = max(1, int(round(d / factor)))
+            return (small_d // 2 + 2) * factor, factor
+        return d // 2, 1
+
+    @staticmethod
+    def guided_filter(image, radius, eps, subsample=2, out=None):
+        """
+        Guided Filter (He et al.) với chính ảnh làm ảnh dẫn: làm mịn nhưng giữ cạnh
+        Dùng cv2.ximgproc.guidedFilter nếu có (gói opencv-contrib), nếu không thì
+        cài đặt bằng box filter (Fast Guided Filter: tính hệ số trên ảnh thu nhỏ)
+        
+        Tham số:
+            image: numpy array ảnh đầu vào (uint8)
+            radius: bán kính cửa sổ (pixel)
+            eps: hệ số điều chuẩn (theo bình phương cường độ 0-255), lớn → mịn hơn
+            subsample: hệ số thu nhỏ khi tính hệ số a, b (1 = không thu nhỏ)
+            out: mảng đích cùng shape/dtype (None = cấp phát mới), không được là image
+            
+        Trả về:
+            numpy array ảnh đã làm mịn (uint8)
+        """
+        if hasattr(cv2, 'ximgproc'):
+            return cv2.ximgproc.guidedFilter(image, image, radius, eps, dst=out)
+        
+        h, w = image.shape[:2]
+        guide = _get_buffer(image.shape, np.float32)
+        np.copyto(guide, image)
+        if subsample > 1 and radius >= subsample:
+            small = _downsample(guide, subsample)
+            radius = max(1, int(round(radius / subsample)))
+        else:
+            small, subsample = guide, 1
+        
+        ksize = (2 * radius + 1, 2 * radius + 1)
+        mean = cv2.boxFilter(small, -1, ksize)
+        mean_sq = cv2.sqrBoxFilter(small, cv2.CV_32F, ksize)
+        # Trong mỗi cửa sổ: q = a * I + b, a = var / (var + eps), b = mean * (1 - a)
+        # (tính tại chỗ để không tạo thêm mảng float tạm)
+        var = mean_sq
+        var -= mean * mean
+        a = var / (var + eps)
+        b = mean
+        b -= a * mean
+        a = cv2.boxFilter(a, -1, ksize, dst=a)
+        b = cv2.boxFilter(b, -1, ksize, dst=b)
+        if subsample > 1:
+            a = _upsample(a, subsample, h, w)
+            b = _upsample(b, subsample, h, w)
+        
+        result = cv2.multiply(a, guide, dst=guide)
+        result += b
+        result += 0.5
+        np.clip(result, 0, 255, out=result)
+        if out is None:
+            return result.astype(np.uint8)
+        np.copyto(out, result, casting='unsafe')
+        return out
+
+    @staticmethod
+    def fast_bilateral_filter(image, d, sigma_color, sigma_space, factor=2, out=None):
+        """
+        Bilateral Filter xấp xỉ: lọc trên ảnh thu nhỏ factor lần, rồi phóng to phần chênh lệch
+        (ảnh đã lọc - ảnh nhỏ) và cộng vào ảnh gốc. Gần cạnh phần chênh lệch ~0 nên cạnh
+        của ảnh gốc được giữ nguyên độ phân giải (joint upsampling theo ảnh gốc)
+        
+        Tham số:
+            image: numpy array ảnh đầu vào (uint8)
+            d, sigma_color, sigma_space: tham số Bilateral Filter ở độ phân giải gốc
+            factor: hệ số thu nhỏ
+            out: mảng đích cùng shape/dtype (None = cấp phát mới), có thể là chính image
+            
+        Trả về:
+            numpy array ảnh đã làm mịn (uint8)
+        """
+        h, w = image.shape[:2]
+        small = _downsample(image, factor)
+        filtered = cv2.bilateralFilter(small, max(1, int(round(d / factor))),
+                                       sigma_color, sigma_space / factor)
+        delta = cv2.subtract(filtered, small, dtype=cv2.CV_16S)
+        delta = _upsample(delta, factor, h, w)
+        return cv2.add(image, delta, dst=out, dtype=cv2.CV_8U)
+
+    @staticmethod
+    def apply_bokeh_effect(image, blur_strength=50, scale=1.0, region=None, out=None):
         """
         Hiệu ứng xóa phông (Bokeh Effect)
         Làm mờ hậu cảnh trong khi giữ vùng trung tâm rõ nét
@@ -259,49 +958,88 @@ class ImageProcessor:
         Tham số:
             image: numpy array ảnh đầu vào
             blur_strength: độ mạnh làm mờ hậu cảnh từ 0 đến 100
+            scale: tỷ lệ của ảnh so với ảnh gốc (< 1 khi xử lý ảnh proxy xem trước)
+            region: (y0, x0, full_h, full_w) khi image chỉ là một vùng cắt của ảnh đầy đủ
+                    (mask elip luôn tính theo toàn ảnh), None nếu image là toàn ảnh
+            out: mảng đích cùng shape/dtype (None = cấp phát mới), có thể là chính image
             
         Trả về:
             numpy array ảnh với hiệu ứng xóa phông
         """
         if blur_strength <= 0:
-            return image.copy()
+            return _copy_to(image, out)
         
         h, w = image.shape[:2]
         
-        # Tạo ảnh mờ cho hậu cảnh
-        # Map blur_strength (0-100) sang kernel size (5-101, số lẻ)
-        kernel_size = int(5 + (blur_strength / 100.0) * 96)
-        if kernel_size % 2 == 0:
-            kernel_size += 1
-        blurred = cv2.GaussianBlur(image, (kernel_size, kernel_size), 0)
+        # Tạo ảnh mờ cho hậu cảnh (bộ đệm dùng lại, chỉ cần đến hết hàm)
+        kernel_size, sigma = _bokeh_kernel(blur_strength, scale)
+        blurred = ImageProcessor.gaussian_blur(
+            image, kernel_size, sigma, out=_get_buffer(image.shape, image.dtype))
         
+        # Mask chỉ phụ thuộc kích thước ảnh → lấy từ cache, dùng lại khi kéo slider
+        if region is None:
+            mask = ImageProcessor.bokeh_mask(h, w, scale)
+        else:
+            y0, x0, full_h, full_w = region
+            mask = ImageProcessor.bokeh_mask(full_h, full_w, scale)[y0:y0 + h, x0:x0 + w]
+        # 1 - mask tính vào bộ đệm dùng lại thay vì giữ thêm một mảng cỡ ảnh trong cache
+        inv_mask = np.subtract(1.0, mask, out=_get_buffer(mask.shape, np.float32),
+                               dtype=np.float32)
+        
+        # Blend ảnh gốc và ảnh mờ theo mask trong một lượt (mask 1 kênh dùng cho cả 3 kênh màu)
+        return cv2.blendLinear(image, blurred, mask, inv_mask, dst=out)
+
+    @staticmethod
+    def bokeh_mask(h, w, scale=1.0):
+        """
+        Gradient mask hình elip cho hiệu ứng xóa phông (lấy từ BOKEH_MASKS nếu đã dựng)
+        
+        Tham số:
+            h, w: kích thước ảnh
+            scale: tỷ lệ của ảnh so với ảnh gốc (thu nhỏ kernel làm mượt mask)
+            
+        Trả về:
+            mảng float32 shape (h, w) chỉ đọc, 1 ở vùng trung tâm rõ nét, 0 ở viền
+        """
+        key = (h, w, scale)
+        mask = BOKEH_MASKS.get(key)
+        if mask is None:
+            mask = ImageProcessor._build_bokeh_mask(h, w, scale)
+            BOKEH_MASKS.put(key, mask)
+        return mask
+
+    @staticmethod
+    def _build_bokeh_mask(h, w, scale):
+        """Dựng mask của bokeh_mask (không cache)"""
         # Tạo gradient mask hình elip (vùng trung tâm sáng, viền tối)
-        center_x, center_y = w // 2, h // 2
+        # Tâm nằm chính giữa lưới pixel → mask đối xứng khi lật ảnh (lật trước hay sau bokeh
+        # cho cùng kết quả, xem Pipeline.compile)
+        center_x, center_y = (w - 1) / 2, (h - 1) / 2
         # Kích thước vùng rõ nét (30-50% ảnh)
         radius_x = int(w * 0.35)
         radius_y = int(h * 0.4)
         
         # Tạo mask với gradient mượt
         Y, X = np.ogrid[:h, :w]
-        # Tính khoảng cách chuẩn hóa từ tâm (ellipse)
-        dist = np.sqrt(((X - center_x) / radius_x) ** 2 + ((Y - center_y) / radius_y) ** 2)
-        
-        # Tạo gradient mask: 1 ở tâm, 0 ở viền, với độ chuyển tiếp mượt
-        mask = np.clip(1.5 - dist, 0, 1)
+        dx2 = ((X - center_x) / radius_x) ** 2
+        dy2 = ((Y - center_y) / radius_y) ** 2
+        mask = np.empty((h, w), dtype=np.float32)
+        # Tính theo từng khối hàng để mảng float64 trung gian chỉ cỡ một khối, không cỡ cả ảnh
+        for y0 in range(0, h, 256):
+            # Tính khoảng cách chuẩn hóa từ tâm (ellipse)
+            dist = np.sqrt(dy2[y0:y0 + 256] + dx2)
+            # Tạo gradient mask: 1 ở tâm, 0 ở viền, với độ chuyển tiếp mượt
+            np.subtract(1.5, dist, out=dist)
+            mask[y0:y0 + 256] = np.clip(dist, 0, 1, out=dist)
         # Làm mượt thêm mask
-        mask = cv2.GaussianBlur(mask.astype(np.float32), (51, 51), 0)
-        
-        # Mở rộng mask thành 3 kênh
-        mask_3d = np.dstack([mask] * 3)
-        
-        # Blend ảnh gốc và ảnh mờ theo mask
-        result = (image.astype(np.float32) * mask_3d + 
-                  blurred.astype(np.float32) * (1 - mask_3d))
-        
-        return np.clip(result, 0, 255).astype(np.uint8)
+        mask_kernel = ImageProcessor.scale_kernel_size(51, scale)
+        mask_sigma = _gaussian_sigma(51) * scale if scale < 1.0 else 0
+        mask = cv2.GaussianBlur(mask, (mask_kernel, mask_kernel), mask_sigma, dst=mask)
+        mask.flags.writeable = False
+        return mask
 
     @staticmethod
-    def apply_skin_tone_correction(image, warmth=0):
+    def apply_skin_tone_correction(image, warmth=0, out=None):
         """
         Điều chỉnh tone màu da (chỉ điều chỉnh độ ấm)
         Tinh chỉnh các kênh màu đỏ và vàng để da trông ấm hơn hoặc lạnh hơn
@@ -309,27 +1047,466 @@ class ImageProcessor:
         Tham số:
             image: numpy array ảnh đầu vào (RGB)
             warmth: độ ấm (-50 đến 50), dương = vàng ấm, âm = xanh lạnh
+            out: mảng đích cùng shape/dtype (None = cấp phát mới), có thể là chính image
             
         Trả về:
             numpy array ảnh đã điều chỉnh tone màu
         """
         if warmth == 0:
-            return image.copy()
-        
-        # Chuyển sang float để tính toán
-        img_float = image.astype(np.float32)
-        
-        # Tách các kênh RGB
-        r, g, b = img_float[:, :, 0], img_float[:, :, 1], img_float[:, :, 2]
+            return _copy_to(image, out)
         
-        # Điều chỉnh độ ấm (tăng R và G, giảm B cho ấm; ngược lại cho lạnh)
-        warm_factor = warmth / 50.0 * 0.1  # ±10%
-        r = r * (1.0 + warm_factor)
-        g = g * (1.0 + warm_factor * 0.5)  # G tăng ít hơn
-        b = b * (1.0 - warm_factor)  # B giảm khi ấm
-        
-        # Ghép lại các kênh
-        result = np.dstack([r, g, b])
-        
-        # Clamp giá trị về [0, 255]
-        return np.clip(result, 0, 255).astype(np.uint8)
+        # Nhân hệ số theo kênh = phép biến đổi điểm ảnh → tra bảng LUT theo kênh
+        return ImageProcessor.apply_point_lut(image, ImageProcessor.skin_tone_lut(warmth), out)
+
+
+# === PIPELINE KHAI BÁO ===
+# Chuỗi filter được mô tả bằng dữ liệu (list các bước {'op': ..., tham số...}) để giao diện,
+# lệnh batch và benchmark dùng chung; compile() tối ưu chuỗi trước khi chạy
+
+# Các loại bước và tham số mặc định (giá trị mặc định cũng là giá trị trung tính)
+PIPELINE_OPS = {
+    'flip_horizontal': {},
+    'flip_vertical': {},
+    'brightness_contrast': {'brightness': 0, 'contrast': 0},
+    'vibrance_saturation': {'vibrance': 0, 'saturation': 0},
+    'skin_tone': {'warmth': 0},
+    'skin_smoothing': {'strength': 0, 'method': 'bilateral'},
+    'sharpen': {'strength': 0},
+    'blur': {'kernel_size': 1, 'sigma': 0},
+    'bokeh': {'strength': 0},
+    'grayscale': {},
+}
+
+# Các bước biến đổi điểm ảnh theo từng kênh → biểu diễn được bằng bảng LUT và gộp được
+_POINT_LUTS = {
+    'brightness_contrast': lambda step: ImageProcessor.brightness_contrast_lut(
+        step['brightness'], step['contrast']),
+    'skin_tone': lambda step: ImageProcessor.skin_tone_lut(step['warmth']),
+}
+
+
+def _is_identity(step):
+    """True nếu bước không làm thay đổi ảnh với tham số hiện tại"""
+    op = step['op']
+    if op == 'brightness_contrast':
+        return step['brightness'] == 0 and step['contrast'] == 0
+    if op == 'vibrance_saturation':
+        return step['vibrance'] == 0 and step['saturation'] == 0
+    if op == 'skin_tone':
+        return step['warmth'] == 0
+    if op in ('skin_smoothing', 'sharpen', 'bokeh'):
+        return step['strength'] <= 0
+    if op == 'blur':
+        return step['kernel_size'] <= 1 and step['sigma'] <= 0
+    return False
+
+
+def _step_key(step):
+    """Khóa hashable của một bước (dùng trong khóa cache)"""
+    return tuple(sorted(step.items()))
+
+
+# Các bước chỉ đổi hướng ảnh: mọi filter khác cho cùng kết quả dù lật trước hay sau
+# (kernel đối xứng, mask bokeh đối xứng qua tâm) nên được dồn về cuối chuỗi khi biên dịch
+_ORIENT_OPS = ('flip_horizontal', 'flip_vertical')
+
+
+def _orient_stage(flip_h, flip_v, sources):
+    """Bước lật ảnh cuối chuỗi: lật ngang và/hoặc dọc trong một lượt cv2.flip"""
+    code = -1 if flip_h and flip_v else (1 if flip_h else 0)
+    name = 'flip' if flip_h and flip_v else ('flip_horizontal' if flip_h else 'flip_vertical')
+    # Cần toàn ảnh (dải trên cùng của kết quả lấy từ dải dưới cùng của đầu vào) → footprint None
+    return CompiledStage(name, (('flip_h', flip_h), ('flip_v', flip_v)),
+                         lambda img, region=None, out=None: cv2.flip(img, code, dst=out),
+                         None, sources)
+
+
+def _gray_to_rgb_stage():
+    """Bước cuối đoạn trắng đen: mở rộng kênh sáng thành RGB"""
+    return CompiledStage('gray_to_rgb', (),
+                         lambda img, region=None, out=None: ImageProcessor.gray_to_rgb(img, out),
+                         (0, 1),
+                         [{'op': 'grayscale'}])
+
+
+def _merge_blurs(first, second):
+    """Hai Gaussian liên tiếp = một Gaussian với sigma² = sigma1² + sigma2²"""
+    sigma1 = first['sigma'] or _gaussian_sigma(first['kernel_size'])
+    sigma2 = second['sigma'] or _gaussian_sigma(second['kernel_size'])
+    sigma = math.sqrt(sigma1 * sigma1 + sigma2 * sigma2)
+    kernel_size = max(first['kernel_size'], second['kernel_size'], 2 * int(math.ceil(3 * sigma)) + 1)
+    if kernel_size % 2 == 0:
+        kernel_size += 1
+    return {'op': 'blur', 'kernel_size': kernel_size, 'sigma': sigma}
+
+
+# Bộ lọc lân cận tuyến tính, xử lý từng kênh như nhau: trắng đen trước hay sau chỉ lệch do
+# làm tròn → khi có bước trắng đen, compile() dồn nó lên trước các bước này để chúng chạy trên
+# 1 kênh. Làm mịn da (khoảng cách màu tính trên 3 kênh) và sharpen (cắt về [0, 255] từng kênh
+# trước khi trộn thành kênh sáng) lệch hàng chục mức ở biên màu bão hòa nên vẫn chạy trên RGB
+_CHANNEL_WISE_OPS = ('blur', 'bokeh')
+
+
+def _build_stage_func(step, scale):
+    """
+    Tạo hàm xử lý và vùng ảnh hưởng cho một bước (không phải bước LUT)
+    Các bước trong _CHANNEL_WISE_OPS nhận được cả ảnh 1 kênh và trả về cùng số kênh
+
+    Trả về:
+        (func(image, region=None, out=None) -> image, footprint (halo, align) hoặc None nếu
+        bước cần toàn ảnh - ví dụ lật ảnh - và không chia dải được)
+    """
+    P = ImageProcessor
+    op = step['op']
+    if op == 'vibrance_saturation':
+        vibrance, saturation = step['vibrance'], step['saturation']
+        return (lambda img, region=None, out=None: P.apply_vibrance_saturation(
+                    img, vibrance, saturation, out), (0, 1))
+    if op == 'skin_smoothing':
+        strength, method = step['strength'], step['method']
+        return (lambda img, region=None, out=None: P.apply_skin_smoothing(
+                    img, strength, scale, method, out),
+                P.skin_smoothing_footprint(strength, scale, method))
+    if op == 'sharpen':
+        strength = step['strength']
+        # Kernel 3x3 → mỗi pixel phụ thuộc các pixel cách 1
+        return (lambda img, region=None, out=None: P.apply_sharpen(
+                    img, strength, out, keep_channels=True), (1, 1))
+    if op == 'blur':
+        kernel_size, sigma = step['kernel_size'], step['sigma']
+        return (lambda img, region=None, out=None: P.apply_blur(
+                    img, kernel_size, scale, sigma, out, keep_channels=True),
+                P.blur_footprint(*_blur_kernel(kernel_size, scale, sigma)))
+    if op == 'bokeh':
+        strength = step['strength']
+        return (lambda img, region=None, out=None: P.apply_bokeh_effect(
+                    img, strength, scale, region, out),
+                P.blur_footprint(*_bokeh_kernel(strength, scale)))
+    if op == 'grayscale':
+        return lambda img, region=None, out=None: P.to_grayscale(img, out), (0, 1)
+    raise ValueError(f"Bước không hợp lệ: {op}")
+
+
+class CompiledStage:
+    """
+    Một bước đã biên dịch của Pipeline (có thể gộp từ nhiều bước khai báo)
+
+    Thuộc tính:
+        name: tên bước (tên op, hoặc 'point_lut' cho các bước LUT đã gộp)
+        args: tham số hashable (dùng làm khóa cache cùng với name)
+        func: hàm func(image, region=None, out=None) -> image, uint8 vào / uint8 ra
+              (out: mảng đích cùng shape, khác image)
+        footprint: (halo, align) - xem ImageProcessor.blur_footprint; None = cần toàn ảnh
+        sources: list các bước khai báo tạo nên bước này
+        channels: số kênh của ảnh kết quả (1 = đoạn trắng đen chạy trên kênh sáng)
+    """
+
+    def __init__(self, name, args, func, footprint, sources, channels=3):
+        self.name = name
+        self.args = args
+        self.func = func
+        self.footprint = footprint
+        self.sources = sources
+        self.channels = channels
+
+
+class CompiledPipeline:
+    """
+    Kế hoạch thực thi đã tối ưu của một Pipeline ở một tỷ lệ ảnh cụ thể
+    Mọi bước đều nhận và trả ảnh uint8: chuyển đổi dtype (float) chỉ nằm bên trong từng bước.
+    Ảnh vào và kết quả luôn là RGB; riêng đoạn trắng đen ở giữa chuỗi chạy trên 1 kênh
+    """
+
+    def __init__(self, stages, scale=1.0, notes=()):
+        self.stages = stages
+        self.scale = scale
+        self.notes = list(notes)    # Ghi chú của bộ tối ưu (bước bị bỏ, bước được gộp)
+        # [(tên bước, giây hoặc None nếu lấy từ cache)] của lần chạy bắt đầu gần nhất; mỗi lần
+        # chạy ghi vào list riêng của nó nên nhiều luồng chạy cùng kế hoạch (FrameStream) không
+        # trộn thời gian của các khung với nhau
+        self.last_timings = []
+
+    def run(self, image, cache=None, source_key=None, executor=None, cancel_check=None,
+            timings=None, reuse_buffers=True):
+        """
+        Chạy kế hoạch trên ảnh
+
+        Tham số:
+            image: numpy array ảnh RGB uint8
+            cache: StageCache để lưu/lấy kết quả từng bước (None = không dùng cache);
+                   chỉ bước có tham số thay đổi và các bước phía sau được tính lại
+            source_key: khóa định danh ảnh nguồn cho cache (bắt buộc khi dùng cache)
+            executor: TiledExecutor để chia dải song song (None = chạy nguyên ảnh)
+            cancel_check: hàm gọi giữa các bước, ném RenderCancelled nếu kết quả đã cũ
+            timings: dict tên bước -> tổng thời gian (giây), được cộng dồn nếu truyền vào
+            reuse_buffers: khi không dùng cache, các bước ghi luân phiên vào hai mảng kết quả
+                           (ping-pong) thay vì cấp phát một mảng mới cho mỗi bước
+
+        Trả về:
+            numpy array ảnh đã xử lý (chính ảnh đầu vào nếu không có bước nào)
+        """
+        use_cache = cache is not None and source_key is not None
+        # Kết quả trung gian không cần giữ lại → chỉ cần hai mảng cỡ ảnh cho cả chuỗi
+        # (ảnh đầu vào không bao giờ bị ghi đè; kết quả cuối là một trong hai mảng)
+        ping_pong = [None, None] if reuse_buffers and not use_cache and image.ndim == 3 else None
+        keys = self.stage_keys(source_key)
+
+        # Tìm bước cuối cùng đã có trong cache, tính lại từ bước kế tiếp
+        start, result = 0, image
+        if use_cache:
+            for i in range(len(self.stages) - 1, -1, -1):
+                cached = cache.get(keys[i])
+                if cached is not None:
+                    start, result = i + 1, cached
+                    break
+        run_timings = [(stage.name, None) for stage in self.stages[:start]]
+        self.last_timings = run_timings
+
+        for i in range(start, len(self.stages)):
+            if cancel_check is not None:
+                cancel_check()
+            stage = self.stages[i]
+            run = stage.func if executor is None else functools.partial(executor.run_stage, stage=stage)
+            out = None
+            if ping_pong is not None:
+                shape = image.shape if stage.channels == 3 else image.shape[:2]
+                if ping_pong[i % 2] is None or ping_pong[i % 2].shape != shape:
+                    ping_pong[i % 2] = np.empty(shape, image.dtype)
+                out = ping_pong[i % 2]
+            t0 = time.perf_counter()
+            if PROFILER.enabled:
+                result = PROFILER.call(stage.name, run, result, out=out)
+            else:
+                result = run(result, out=out)
+            elapsed = time.perf_counter() - t0
+            run_timings.append((stage.name, elapsed))
+            if timings is not None:
+                timings[stage.name] = timings.get(stage.name, 0.0) + elapsed
+            if use_cache:
+                cache.put(keys[i], result)
+            # Bộ đệm tạm cỡ ảnh gốc không giữ sang bước sau: đỉnh bộ nhớ chỉ bằng bước tốn nhất
+            BUFFER_POOL.trim()
+        return result
+
+    def stage_keys(self, source_key):
+        """
+        Khóa cache của kết quả từng bước khi chạy trên ảnh nguồn source_key
+        Khóa của mỗi bước = khóa đầu vào + tên bước + tham số của bước đó, nên hai kế hoạch
+        có chung phần đầu chuỗi thì chung các khóa đầu
+
+        Trả về:
+            list khóa, cùng thứ tự với self.stages
+        """
+        keys = []
+        key = source_key
+        for stage in self.stages:
+            key = (key, stage.name, stage.args)
+            keys.append(key)
+        return keys
+
+    def explain(self):
+        """
+        Mô tả kế hoạch thực thi: các bước thật sự chạy, bước nào được gộp, thời gian lần chạy cuối
+
+        Trả về:
+            chuỗi nhiều dòng
+        """
+        lines = [f"Pipeline: {len(self.stages)} bước (scale={self.scale:g})"]
+        lines += [f"  * {note}" for note in self.notes]
+        timings = dict(enumerate(t for _, t in self.last_timings))
+        for i, stage in enumerate(self.stages):
+            sources = " + ".join(step['op'] for step in stage.sources)
+            footprint = ("toàn ảnh" if stage.footprint is None
+                         else f"halo {stage.footprint[0]}, align {stage.footprint[1]}")
+            if i not in timings:
+                elapsed = "-"
+            elif timings[i] is None:
+                elapsed = "cache"
+            else:
+                elapsed = f"{timings[i] * 1000:.1f} ms"
+            channels = "1 kênh" if stage.channels == 1 else "uint8→uint8"
+            lines.append(f"  {i + 1}. {stage.name:<20} [{sources}] {channels}, {footprint}: {elapsed}")
+        return "\n".join(lines)
+
+
+class Pipeline:
+    """
+    Chuỗi filter khai báo: list các bước {'op': tên, tham số...} theo thứ tự áp dụng
+    (xem PIPELINE_OPS). Tuần tự hóa được sang dict/JSON và chạy được ngoài giao diện Tk
+    """
+
+    def __init__(self, steps=()):
+        self.steps = [self._normalize(step) for step in steps]
+
+    @staticmethod
+    def _normalize(step):
+        """Kiểm tra một bước và điền tham số mặc định"""
+        op = step.get('op')
+        if op not in PIPELINE_OPS:
+            raise ValueError(f"Bước không hợp lệ: {op}")
+        defaults = PIPELINE_OPS[op]
+        unknown = set(step) - set(defaults) - {'op'}
+        if unknown:
+            raise ValueError(f"Tham số không hợp lệ cho bước {op}: {', '.join(sorted(unknown))}")
+        if op == 'skin_smoothing' and step.get('method', 'bilateral') not in SKIN_SMOOTHING_METHODS:
+            raise ValueError(f"Chế độ làm mịn không hợp lệ: {step['method']}")
+        return dict(defaults, **step)
+
+    @staticmethod
+    def from_recipe(recipe):
+        """
+        Dựng Pipeline chuẩn từ thông số slider / công thức chỉnh ảnh, theo thứ tự:
+        1. Độ sáng & Tương phản
+        1.5. Vibrance & Saturation
+        2. Điều chỉnh tone màu da
+        3. Làm mịn da (Skin Smoothing)
+        4. Làm nét (Sharpen)
+        5. Làm mờ (Blur)
+        6. Xóa phông (Bokeh)
+        7. Trắng đen (Grayscale)
+        8. Lật ảnh
+
+        Tham số:
+            recipe: dict theo định dạng DEFAULT_RECIPE (khóa thiếu lấy giá trị mặc định)
+        """
+        r = dict(DEFAULT_RECIPE, **recipe)
+        steps = [
+            {'op': 'brightness_contrast', 'brightness': r['brightness'], 'contrast': r['contrast']},
+            {'op': 'vibrance_saturation', 'vibrance': r['vibrance'], 'saturation': r['saturation']},
+            {'op': 'skin_tone', 'warmth': r['warmth']},
+            {'op': 'skin_smoothing', 'strength': r['skin_smooth'], 'method': r['smooth_method']},
+            {'op': 'sharpen', 'strength': r['sharpen']},
+            # Slider làm mờ 0-30 → kernel size lẻ 1-61 (1 = không làm mờ)
+            {'op': 'blur', 'kernel_size': r['blur'] * 2 + 1},
+            {'op': 'bokeh', 'strength': r['bokeh']},
+        ]
+        if r['grayscale']:
+            steps.append({'op': 'grayscale'})
+        if r['flip_horizontal']:
+            steps.append({'op': 'flip_horizontal'})
+        if r['flip_vertical']:
+            steps.append({'op': 'flip_vertical'})
+        return Pipeline(steps)
+
+    def to_dict(self):
+        """Tuần tự hóa thành dict (dùng với json.dump)"""
+        return {'version': 1, 'steps': [dict(step) for step in self.steps]}
+
+    @staticmethod
+    def from_dict(data):
+        """Dựng lại Pipeline từ dict của to_dict()"""
+        if data.get('version') != 1:
+            raise ValueError(f"Phiên bản pipeline không hỗ trợ: {data.get('version')}")
+        return Pipeline(data['steps'])
+
+    def to_json(self):
+        """Tuần tự hóa thành chuỗi JSON"""
+        return json.dumps(self.to_dict(), ensure_ascii=False)
+
+    @staticmethod
+    def from_json(text):
+        """Dựng lại Pipeline từ chuỗi JSON của to_json()"""
+        return Pipeline.from_dict(json.loads(text))
+
+    def compile(self, scale=1.0):
+        """
+        Tối ưu chuỗi bước thành kế hoạch thực thi:
+        1. Bỏ các bước trung tính (không làm thay đổi ảnh)
+        2. Gộp các Gaussian blur liên tiếp thành một (sigma² cộng dồn)
+        3. Gộp các phép biến đổi điểm ảnh liền nhau thành một bảng LUT, một lượt cv2.LUT
+        4. Dồn các bước lật ảnh về cuối chuỗi thành một lượt cv2.flip (lật hai lần cùng chiều
+           triệt tiêu): các bước trước không phụ thuộc hướng ảnh nên khóa cache của chúng
+           giữ nguyên khi chỉ đổi hướng - lật ảnh chỉ phải chạy lại đúng một bước rẻ
+        5. Trắng đen: dồn bước trắng đen lên ngay sau các bước phụ thuộc màu, các bộ lọc lân cận
+           phía sau (_CHANNEL_WISE_OPS) chạy trên 1 kênh sáng (~1/3 thời gian và bộ nhớ),
+           mở rộng lại thành RGB ở bước cuối. Kết quả lệch so với trắng đen ở cuối chỉ do
+           làm tròn (xem `python benchmark.py grayscale`)
+
+        Tham số:
+            scale: tỷ lệ ảnh nguồn so với ảnh gốc, dùng để thu nhỏ các kernel
+
+        Trả về:
+            CompiledPipeline
+        """
+        notes = []
+        steps = []
+        flips = [step for step in self.steps if step['op'] in _ORIENT_OPS]
+        for step in self.steps:
+            if _is_identity(step) or step['op'] in _ORIENT_OPS:
+                continue
+            if step['op'] == 'blur' and steps and steps[-1]['op'] == 'blur':
+                steps[-1] = _merge_blurs(steps[-1], step)
+                notes.append(f"gộp 2 Gaussian blur → sigma {steps[-1]['sigma']:.2f}")
+                continue
+            steps.append(step)
+        dropped = [step['op'] for step in self.steps if _is_identity(step)]
+        if dropped:
+            notes.insert(0, f"bỏ bước trung tính: {', '.join(dropped)}")
+
+        # Đoạn trắng đen: các bộ lọc lân cận liền trước và liền sau bước trắng đen cuối cùng
+        # chạy trên 1 kênh giữa hai bước luma (thu về kênh sáng) và gray_to_rgb (mở rộng lại)
+        gray_from = gray_to = None
+        last = max((i for i, step in enumerate(steps) if step['op'] == 'grayscale'), default=None)
+        if last is not None:
+            start = last
+            while start > 0 and steps[start - 1]['op'] in _CHANNEL_WISE_OPS:
+                start -= 1
+            end = last + 1
+            while end < len(steps) and steps[end]['op'] in _CHANNEL_WISE_OPS:
+                end += 1
+            if end - start > 1:
+                single = steps[start:last] + steps[last + 1:end]
+                steps = steps[:start] + single + steps[end:]
+                gray_from, gray_to = start, start + len(single)
+                notes.append(f"trắng đen sớm: {', '.join(step['op'] for step in single)} "
+                             "chạy trên 1 kênh")
+
+        stages = []
+        i = 0
+        while i < len(steps):
+            if i == gray_from:
+                stages.append(CompiledStage(
+                    'luma', (),
+                    lambda img, region=None, out=None: ImageProcessor.to_luma(img, out),
+                    (0, 1), [{'op': 'grayscale'}], 1))
+            if i == gray_to:
+                stages.append(_gray_to_rgb_stage())
+            step = steps[i]
+            if step['op'] in _POINT_LUTS:
+                # Gom các bước LUT liền nhau
+                group = [step]
+                while i + 1 < len(steps) and steps[i + 1]['op'] in _POINT_LUTS:
+                    i += 1
+                    group.append(steps[i])
+                lut = ImageProcessor.compose_luts(*[_POINT_LUTS[s['op']](s) for s in group])
+                if len(group) > 1:
+                    notes.append(f"gộp LUT: {' + '.join(s['op'] for s in group)}")
+                stages.append(CompiledStage(
+                    'point_lut' if len(group) > 1 else step['op'],
+                    tuple(_step_key(s) for s in group),
+                    lambda img, region=None, out=None, lut=lut: ImageProcessor.apply_point_lut(
+                        img, lut, out),
+                    (0, 1), group))
+            else:
+                func, footprint = _build_stage_func(step, scale)
+                stages.append(CompiledStage(step['op'], (_step_key(step), scale),
+                                            func, footprint, [step],
+                                            1 if gray_from is not None and gray_from <= i < gray_to else 3))
+            i += 1
+        if gray_to is not None and gray_to == len(steps):
+            stages.append(_gray_to_rgb_stage())
+
+        if flips:
+            flip_h = sum(step['op'] == 'flip_horizontal' for step in flips) % 2 == 1
+            flip_v = sum(step['op'] == 'flip_vertical' for step in flips) % 2 == 1
+            first = self.steps.index(flips[0])
+            if any(step['op'] not in _ORIENT_OPS and not _is_identity(step)
+                   for step in self.steps[first:]):
+                notes.append("dồn bước lật ảnh về cuối chuỗi")
+            if flip_h or flip_v:
+                if len(flips) > 1:
+                    notes.append(f"gộp {len(flips)} bước lật ảnh thành một lượt cv2.flip")
+                stages.append(_orient_stage(flip_h, flip_v, flips))
+            else:
+                notes.append(f"bỏ {len(flips)} bước lật ảnh triệt tiêu nhau")
+        return CompiledPipeline(stages, scale, notes)
@@ -0,0 +1,179 @@
+"""
+profiling.py - Đo đạc từng bước xử lý ảnh của PhotoLab
+Ghi lại thời gian thực (wall), thời gian CPU, kích thước/kiểu dữ liệu đầu vào và số byte cấp phát
+của mỗi bước; xuất ra file Chrome trace (mở bằng chrome://tracing hoặc ui.perfetto.dev)
+và tóm tắt theo cửa sổ trượt cho lớp phủ trên giao diện
+
+Khi tắt (mặc định), mỗi bước chỉ tốn một lần kiểm tra PROFILER.enabled
+"""
+import json
+import os
+import threading
+import time
+import tracemalloc
+from collections import deque
+
+from metrics import LatencyTracker
+
+
+# Số sự kiện gần nhất được giữ lại để xuất trace
+DEFAULT_MAX_EVENTS = 20000
+
+
+class Profiler:
+    """
+    Bộ ghi sự kiện theo định dạng Chrome trace (sự kiện 'X' có thời lượng)
+    An toàn khi ghi từ nhiều luồng (luồng render nền, các luồng chia dải)
+    """
+
+    def __init__(self, max_events=DEFAULT_MAX_EVENTS, window=50):
+        """
+        Tham số:
+            max_events: số sự kiện tối đa giữ lại (cũ nhất bị loại trước)
+            window: số mẫu gần nhất dùng để tóm tắt thời gian của mỗi bước
+        """
+        self.enabled = False
+        self.trace_memory = False   # Đo đỉnh bộ nhớ cấp phát bằng tracemalloc (chậm hơn)
+        self._events = deque(maxlen=max_events)
+        self._window = window
+        self._stats = {}            # tên bước -> LatencyTracker thời gian thực
+        self._lock = threading.Lock()
+
+    def enable(self, trace_memory=False):
+        """
+        Bật ghi sự kiện
+
+        Tham số:
+            trace_memory: True = đo đỉnh bộ nhớ cấp phát của mỗi bước bằng tracemalloc
+                          (numpy báo cáo cấp phát cho tracemalloc; làm chậm đáng kể)
+        """
+        self.trace_memory = trace_memory
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.enabled = True
+
+    def disable(self):
+        """Tắt ghi sự kiện (giữ lại các sự kiện đã ghi)"""
+        self.enabled = False
+        if self.trace_memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self.trace_memory = False
+
+    def clear(self):
+        """Xóa toàn bộ sự kiện và thống kê"""
+        with self._lock:
+            self._events.clear()
+            self._stats.clear()
+
+    def call(self, name, func, image, *args, category='stage', **kwargs):
+        """
+        Gọi func(image, *args, **kwargs) và ghi lại một sự kiện cho lần gọi đó
+
+        Trả về:
+            kết quả của func
+        """
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            mem_start = tracemalloc.get_traced_memory()[0]
+        cpu_start = time.thread_time()
+        start = time.perf_counter()
+        result = func(image, *args, **kwargs)
+        end = time.perf_counter()
+        info = {'cpu_ms': round((time.thread_time() - cpu_start) * 1000, 3)}
+        if image is not None and hasattr(image, 'shape'):
+            info['shape'] = list(image.shape)
+            info['dtype'] = str(image.dtype)
+        if hasattr(result, 'nbytes'):
+            info['out_bytes'] = result.nbytes
+        if self.trace_memory:
+            info['peak_alloc_bytes'] = tracemalloc.get_traced_memory()[1] - mem_start
+        self.record(name, start, end, category, info)
+        return result
+
+    def record(self, name, start, end, category='stage', info=None):
+        """
+        Ghi một sự kiện đã đo sẵn
+
+        Tham số:
+            start, end: thời điểm bắt đầu/kết thúc theo time.perf_counter()
+            info: dict thông tin thêm (hiển thị trong mục args của trace)
+        """
+        event = {
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            # perf_counter là đồng hồ đơn điệu chung của hệ thống → các tiến trình con khớp timeline
+            'ts': start * 1e6,
+            'dur': (end - start) * 1e6,
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+            'args': info or {},
+        }
+        with self._lock:
+            self._events.append(event)
+            stats = self._stats.get(name)
+            if stats is None:
+                stats = self._stats[name] = LatencyTracker(self._window)
+        stats.record(end - start)
+
+    def events(self):
+        """
+        Bản sao các sự kiện đã ghi (dùng để chuyển từ tiến trình con về tiến trình chính)
+
+        Trả về:
+            list dict sự kiện theo định dạng Chrome trace
+        """
+        with self._lock:
+            return list(self._events)
+
+    def add_events(self, events):
+        """Thêm sự kiện ghi ở nơi khác (ví dụ tiến trình con của lệnh batch)"""
+        with self._lock:
+            self._events.extend(events)
+
+    def summary(self):
+        """
+        Tóm tắt thời gian từng bước trong cửa sổ trượt
+
+        Trả về:
+            list (tên bước, dict thống kê của LatencyTracker.summary), bước chậm nhất trước
+        """
+        with self._lock:
+            items = list(self._stats.items())
+        rows = [(name, stats.summary()) for name, stats in items]
+        rows = [(name, s) for name, s in rows if s is not None]
+        return sorted(rows, key=lambda row: -row[1]['mean'])
+
+    def format_summary(self, limit=10):
+        """Chuỗi nhiều dòng tóm tắt thời gian từng bước (mili giây), dùng cho lớp phủ"""
+        rows = self.summary()[:limit]
+        if not rows:
+            return "Profiling: chưa có dữ liệu"
+        width = max(len(name) for name, _ in rows)
+        lines = [f"{'bước'.ljust(width)}   last   mean    p95"]
+        for name, s in rows:
+            lines.append(f"{name.ljust(width)} {s['last'] * 1000:6.1f} {s['mean'] * 1000:6.1f} "
+                         f"{s['p95'] * 1000:6.1f}")
+        return "\n".join(lines)
+
+    def export_chrome_trace(self, path):
+        """
+        Ghi các sự kiện ra file JSON theo định dạng Chrome trace / Perfetto
+
+        Trả về:
+            số sự kiện đã ghi
+        """
+        events = self.events()
+        # Sự kiện metadata: đặt tên luồng để dễ đọc trên timeline
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        metadata = [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid,
+                     'args': {'name': names[tid]}}
+                    for pid, tid in {(e['pid'], e['tid']) for e in events}
+                    if pid == os.getpid() and tid in names]
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': metadata + events, 'displayTimeUnit': 'ms'}, f)
+        return len(events)
+
+
+# Bộ ghi dùng chung cho toàn bộ ứng dụng (tắt mặc định)
+PROFILER = Profiler()
@@ -0,0 +1,137 @@
+"""
+render.py - Luồng render nền cho PhotoLab
+Slider chỉ gửi thông số mới nhất sang một worker duy nhất; các yêu cầu trung gian
+được gộp lại (bản mới nhất thắng) và kết quả cũ bị bỏ qua
+"""
+import threading
+import time
+import traceback
+
+from metrics import LatencyTracker
+
+
+class RenderCancelled(Exception):
+    """Ném ra giữa các bước xử lý khi đã có yêu cầu render mới hơn"""
+
+
+class RenderScheduler:
+    """
+    Bộ lập lịch render chạy trên một luồng nền duy nhất
+
+    - submit(): ghi đè yêu cầu đang chờ (latest-wins), không bao giờ xếp hàng
+    - Render đang chạy được hủy giữa các bước nếu có yêu cầu mới hơn
+    - Kết quả được trả về luồng Tk qua root.after
+    - Lỗi trong render_func không làm dừng luồng nền: được báo qua on_error (luồng Tk),
+      yêu cầu tiếp theo vẫn được render
+    - latency: độ trễ "input-to-pixels" từ lúc gửi yêu cầu đến lúc ảnh được hiển thị
+    """
+
+    def __init__(self, root, render_func, on_done, on_error=None):
+        """
+        Tham số:
+            root: cửa sổ Tk gốc (dùng root.after để trả kết quả về luồng giao diện)
+            render_func: hàm render(*args, cancel_check=...) chạy trên luồng nền
+            on_done: callback(result) chạy trên luồng Tk khi có kết quả mới nhất
+            on_error: callback(exception) chạy trên luồng Tk khi yêu cầu mới nhất bị lỗi
+                      (None = chỉ in traceback ra stderr)
+        """
+        self.root = root
+        self._render_func = render_func
+        self._on_done = on_done
+        self._on_error = on_error
+        self._cond = threading.Condition()
+        self._pending = None       # (generation, args, thời điểm gửi)
+        self._generation = 0       # Tăng mỗi lần submit/cancel; kết quả khác thế hệ là cũ
+        self._closed = False
+
+        self.latency = LatencyTracker()  # Input-to-pixels
+        self.submitted = 0               # Số yêu cầu đã gửi
+        self.rendered = 0                # Số lần render hoàn tất và được hiển thị
+        self.dropped = 0                 # Số yêu cầu bị gộp/hủy/bỏ qua vì đã cũ
+        self.errors = 0                  # Số lần render_func ném lỗi
+
+        self._thread = threading.Thread(target=self._worker, name="PhotoLabRender", daemon=True)
+        self._thread.start()
+
+    def submit(self, *args):
+        """Gửi yêu cầu render mới, thay thế yêu cầu đang chờ (nếu có)"""
+        with self._cond:
+            self._generation += 1
+            if self._pending is not None:
+                self.dropped += 1
+            self._pending = (self._generation, args, time.perf_counter())
+            self.submitted += 1
+            self._cond.notify()
+
+    def cancel(self):
+        """Hủy yêu cầu đang chờ và loại bỏ kết quả của render đang chạy"""
+        with self._cond:
+            self._generation += 1
+            if self._pending is not None:
+                self.dropped += 1
+            self._pending = None
+
+    def close(self):
+        """Dừng luồng render"""
+        with self._cond:
+            self._closed = True
+            self._pending = None
+            self._cond.notify()
+
+    def is_stale(self, generation):
+        """True nếu đã có yêu cầu mới hơn thế hệ generation"""
+        return generation != self._generation
+
+    def _worker(self):
+        """Vòng lặp của luồng nền: lấy yêu cầu mới nhất và render"""
+        while True:
+            with self._cond:
+                while self._pending is None and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                generation, args, submitted_at = self._pending
+                self._pending = None
+
+            def cancel_check(generation=generation):
+                if self.is_stale(generation):
+                    raise RenderCancelled()
+
+            try:
+                result = self._render_func(*args, cancel_check=cancel_check)
+            except RenderCancelled:
+                self.dropped += 1
+                continue
+            except Exception as e:  # Lỗi một lần render không được làm chết luồng nền
+                self.errors += 1
+                traceback.print_exc()
+                if self._on_error is None or self.is_stale(generation):
+                    continue
+                try:
+                    self.root.after(0, self._deliver_error, generation, e)
+                except RuntimeError:
+                    return  # Cửa sổ Tk đã đóng
+                continue
+
+            if self.is_stale(generation):
+                self.dropped += 1
+                continue
+            try:
+                self.root.after(0, self._deliver, generation, result, submitted_at)
+            except RuntimeError:
+                return  # Cửa sổ Tk đã đóng
+
+    def _deliver(self, generation, result, submitted_at):
+        """Chạy trên luồng Tk: hiển thị kết quả nếu vẫn là yêu cầu mới nhất"""
+        if self.is_stale(generation):
+            self.dropped += 1
+            return
+        self._on_done(result)
+        self.rendered += 1
+        self.latency.record(time.perf_counter() - submitted_at)
+
+    def _deliver_error(self, generation, error):
+        """Chạy trên luồng Tk: báo lỗi nếu vẫn là yêu cầu mới nhất"""
+        if self.is_stale(generation):
+            return
+        self._on_error(error)
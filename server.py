@@ -0,0 +1,456 @@
+"""
+server.py - Dịch vụ HTTP render ảnh cục bộ cho PhotoLab
+Nhận ảnh (nội dung file ảnh trong thân request POST) + thông số chỉnh ảnh (query string), render
+trên pool tiến trình khởi động sẵn (cv2 đã import, chuỗi filter mẫu đã chạy để nạp thư viện,
+dựng LUT/kernel và cấp phát bộ đệm) rồi trả về ảnh đã mã hóa. Các request nhỏ đang chờ được gộp
+thành lô: một lần gửi sang tiến trình con cho nhiều ảnh
+Chạy:
+    python -m photolab serve --port 8765
+    curl --data-binary @anh.jpg "http://127.0.0.1:8765/render?brightness=20&format=png" -o out.png
+    curl http://127.0.0.1:8765/stats
+"""
+import functools
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+from metrics import LatencyTracker, ThroughputCounter
+from photolab import OUTPUT_FORMATS, validate_recipe
+from processing import (ImageProcessor, Pipeline, DEFAULT_ENCODE_OPTIONS, DEFAULT_RECIPE,
+                        TIFF_COMPRESSION_CODES)
+
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+# Thân request lớn nhất được nhận (byte)
+MAX_BODY_BYTES = 64 * 1024 * 1024
+# Request có thân nhỏ hơn mức này được gộp lô với request khác (ảnh lớn đi riêng)
+SMALL_REQUEST_BYTES = 1024 * 1024
+# Số request tối đa trong một lô
+MAX_BATCH = 8
+# Số request đang chờ / đang render tối đa, vượt quá thì trả 503
+MAX_PENDING = 256
+# Thời gian (giây) handler chờ kết quả render, quá thì trả 504
+RENDER_TIMEOUT = 120
+
+CONTENT_TYPES = {
+    'jpg': 'image/jpeg',
+    'png': 'image/png',
+    'webp': 'image/webp',
+    'tiff': 'image/tiff',
+    'bmp': 'image/bmp',
+}
+
+# Công thức chạy khi khởi động tiến trình con: bật mọi bước để nạp thư viện và dựng sẵn mọi thứ
+WARMUP_RECIPE = dict(DEFAULT_RECIPE, brightness=10, contrast=10, vibrance=10, saturation=10,
+                     warmth=10, skin_smooth=30, sharpen=20, blur=10, bokeh=30)
+WARMUP_SIZE = (480, 640)
+
+# Đánh dấu dừng luồng điều phối
+_STOP = object()
+
+
+# === PHÍA TIẾN TRÌNH CON ===
+
+def _init_render_worker(threads_per_worker):
+    """
+    Khởi tạo tiến trình con: giới hạn số luồng OpenCV, chạy chuỗi filter mẫu và mã hóa mọi định
+    dạng một lần để request đầu tiên không phải trả chi phí khởi động
+    """
+    import cv2
+    cv2.setNumThreads(threads_per_worker)
+    image = np.full(WARMUP_SIZE + (3,), 128, dtype=np.uint8)
+    result = _compiled_pipeline(json.dumps(WARMUP_RECIPE, sort_keys=True)).run(image)
+    for image_format in OUTPUT_FORMATS:
+        ImageProcessor.encode_image(result, image_format)
+
+
+def _ping():
+    return os.getpid()
+
+
+@functools.lru_cache(maxsize=32)
+def _compiled_pipeline(recipe_json):
+    """Chuỗi filter đã biên dịch của một công thức (cache trong từng tiến trình con)"""
+    return Pipeline.from_recipe(json.loads(recipe_json)).compile()
+
+
+def render_batch(jobs):
+    """
+    Render một lô request (chạy trong tiến trình con)
+
+    Tham số:
+        jobs: list (bytes ảnh vào, công thức dạng JSON, định dạng ra, tùy chọn encoder)
+
+    Trả về:
+        list (bytes ảnh ra hoặc None, lỗi hoặc None, thời gian render - giây) theo thứ tự jobs
+    """
+    results = []
+    for data, recipe_json, image_format, encode_options in jobs:
+        start = time.perf_counter()
+        try:
+            image = ImageProcessor.decode_image(data)
+            if image is None:
+                results.append((None, "không giải mã được ảnh", 0.0))
+                continue
+            result = _compiled_pipeline(recipe_json).run(image)
+            encoded = ImageProcessor.encode_image(result, image_format, **encode_options)
+            error = None if encoded is not None else f"không mã hóa được ảnh {image_format}"
+        except Exception as e:  # Một ảnh lỗi không được làm hỏng cả lô
+            encoded, error = None, str(e) or type(e).__name__
+        results.append((encoded, error, time.perf_counter() - start))
+    return results
+
+
+# === HÀNG ĐỢI RENDER ===
+
+def parse_render_query(query):
+    """
+    Tách query string của /render (khóa của DEFAULT_RECIPE, DEFAULT_ENCODE_OPTIONS và 'format')
+
+    Trả về:
+        (công thức đầy đủ, định dạng ra, tùy chọn encoder)
+
+    Ném ra:
+        ValueError nếu có tham số lạ hoặc giá trị không hợp lệ
+    """
+    recipe, encode_options, image_format = {}, dict(DEFAULT_ENCODE_OPTIONS), 'jpg'
+    for key, values in parse_qs(query, keep_blank_values=True).items():
+        value = values[-1]
+        if key == 'format':
+            if value not in OUTPUT_FORMATS:
+                raise ValueError(f"format phải là một trong: {', '.join(OUTPUT_FORMATS)}")
+            image_format = value
+        elif key in DEFAULT_RECIPE:
+            recipe[key] = _convert(key, value, DEFAULT_RECIPE[key])
+        elif key in DEFAULT_ENCODE_OPTIONS:
+            encode_options[key] = _convert(key, value, DEFAULT_ENCODE_OPTIONS[key])
+        else:
+            raise ValueError(f"Tham số không hợp lệ: {key}")
+    if encode_options['tiff_compression'] not in TIFF_COMPRESSION_CODES:
+        raise ValueError(f"tiff_compression phải là một trong: {', '.join(TIFF_COMPRESSION_CODES)}")
+    return validate_recipe(recipe), image_format, encode_options
+
+
+def _convert(key, value, default):
+    """Chuyển giá trị chuỗi của query string về kiểu của giá trị mặc định"""
+    if isinstance(default, bool):
+        lowered = value.lower()
+        if lowered in ('', '1', 'true', 'yes', 'on'):
+            return True
+        if lowered in ('0', 'false', 'no', 'off'):
+            return False
+        raise ValueError(f"{key} phải là true/false")
+    if isinstance(default, int):
+        try:
+            return int(value)
+        except ValueError:
+            raise ValueError(f"{key} phải là số nguyên") from None
+    return value
+
+
+class RenderService:
+    """
+    Hàng đợi render trước pool tiến trình con. Một luồng điều phối lấy request ra mỗi khi có
+    tiến trình con rảnh và gộp các request nhỏ đang chờ (tối đa max_batch) thành một lần gửi:
+    pool rảnh thì request đi ngay, pool bận thì request dồn lại và đi thành lô - giảm số lần
+    pickle/gửi qua pipe mỗi ảnh mà không thêm độ trễ khi tải nhẹ
+    An toàn khi gọi submit từ nhiều luồng (mỗi kết nối HTTP một luồng)
+    """
+
+    def __init__(self, workers=None, max_batch=MAX_BATCH, batch_window=0.0,
+                 small_request_bytes=SMALL_REQUEST_BYTES, max_pending=MAX_PENDING):
+        """
+        Tham số:
+            workers: số tiến trình con (None = số nhân CPU)
+            max_batch: số request tối đa mỗi lô (1 = không gộp lô)
+            batch_window: thời gian (giây) chờ thêm request cho lô khi pool rảnh (0 = không chờ)
+            small_request_bytes: xem SMALL_REQUEST_BYTES
+            max_pending: xem MAX_PENDING
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.max_batch = max(1, max_batch)
+        self.batch_window = batch_window
+        self.small_request_bytes = small_request_bytes
+        self.max_pending = max_pending
+        self._threads_per_worker = max(1, (os.cpu_count() or 1) // self.workers)
+        self._pool = None
+        self.restarts = 0
+        start = time.perf_counter()
+        self._start_pool()
+        self.warmup_seconds = time.perf_counter() - start
+
+        self._requests = queue.Queue()
+        self._slots = threading.Semaphore(self.workers)  # Số tiến trình con đang rảnh
+        self._held = None                                 # Request lấy ra khi gom lô nhưng phải đi lượt sau
+        self._lock = threading.Lock()
+        self._pending = 0
+        self.latency = LatencyTracker(window=2000)       # Từ lúc nhận đến lúc có kết quả
+        self.render_time = LatencyTracker(window=2000)   # Giải mã + render + mã hóa trong tiến trình con
+        self.throughput = ThroughputCounter()
+        self.errors = 0
+        self.rejected = 0
+        self.batches = 0
+        self.largest_batch = 0
+        self._dispatcher = threading.Thread(target=self._dispatch, name="render-dispatch",
+                                            daemon=True)
+        self._dispatcher.start()
+
+    def _start_pool(self):
+        """Tạo pool tiến trình con và khởi động đủ tiến trình ngay (thay vì ở các request đầu)"""
+        self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_render_worker,
+                                         initargs=(self._threads_per_worker,))
+        for future in [self._pool.submit(_ping) for _ in range(self.workers)]:
+            future.result()
+
+    def _submit_batch(self, jobs):
+        """
+        Gửi một lô sang pool; pool hỏng (một tiến trình con bị kill/crash) thì tạo pool mới rồi gửi lại
+
+        Ném ra:
+            Exception nếu không gửi được (kể cả sau khi tạo lại pool)
+        """
+        try:
+            return self._pool.submit(render_batch, jobs)
+        except BrokenProcessPool:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self.restarts += 1
+            self._start_pool()
+            return self._pool.submit(render_batch, jobs)
+
+    def submit(self, data, recipe, image_format='jpg', encode_options=None):
+        """
+        Xếp một ảnh vào hàng đợi render
+
+        Tham số:
+            data: bytes nội dung file ảnh
+            recipe: dict công thức đầy đủ (xem photolab.validate_recipe)
+            image_format: định dạng ảnh ra (OUTPUT_FORMATS)
+            encode_options: tùy chọn encoder (None = DEFAULT_ENCODE_OPTIONS)
+
+        Trả về:
+            Future với kết quả (bytes ảnh ra hoặc None, lỗi hoặc None, thời gian render - giây),
+            hoặc None nếu hàng đợi đã đầy
+        """
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.rejected += 1
+                return None
+            self._pending += 1
+        future = Future()
+        job = (data, json.dumps(recipe, sort_keys=True), image_format,
+               encode_options or dict(DEFAULT_ENCODE_OPTIONS))
+        self._requests.put((job, future, time.perf_counter()))
+        return future
+
+    def render(self, data, recipe, image_format='jpg', encode_options=None):
+        """submit rồi chờ kết quả; hàng đợi đầy thì trả về (None, lỗi, 0.0)"""
+        future = self.submit(data, recipe, image_format, encode_options)
+        if future is None:
+            return None, "hàng đợi render đầy", 0.0
+        return future.result()
+
+    def _is_small(self, request):
+        return len(request[0][0]) <= self.small_request_bytes
+
+    def _dispatch(self):
+        """Luồng điều phối: chờ tiến trình con rảnh → lấy request → gom lô → gửi"""
+        while True:
+            self._slots.acquire()
+            request = self._held if self._held is not None else self._requests.get()
+            self._held = None
+            if request is _STOP:
+                return
+            batch = [request]
+            if self._is_small(request):
+                deadline = time.perf_counter() + self.batch_window
+                while len(batch) < self.max_batch:
+                    timeout = deadline - time.perf_counter()
+                    try:
+                        following = (self._requests.get(timeout=timeout) if timeout > 0
+                                     else self._requests.get_nowait())
+                    except queue.Empty:
+                        break
+                    if following is _STOP or not self._is_small(following):
+                        self._held = following
+                        break
+                    batch.append(following)
+            try:
+                future = self._submit_batch([job for job, _, _ in batch])
+            except Exception as e:  # Không tạo lại được pool, lỗi pickle... → báo lỗi cả lô, chạy tiếp
+                self._slots.release()
+                self._complete(batch, [(None, f"lỗi tiến trình render: {e}", 0.0)] * len(batch))
+                continue
+            future.add_done_callback(functools.partial(self._finish, batch))
+
+    def _finish(self, batch, future):
+        """Callback khi một lô xong (luồng quản lý của pool)"""
+        self._slots.release()
+        try:
+            results = future.result()
+        except Exception as e:  # Tiến trình con chết (pool được tạo lại ở lô sau)...
+            results = [(None, f"lỗi tiến trình render: {e}", 0.0)] * len(batch)
+        self._complete(batch, results)
+
+    def _complete(self, batch, results):
+        """Trả kết quả cho từng request của lô, cập nhật thống kê"""
+        now = time.perf_counter()
+        failed = 0
+        for (_, request_future, received), result in zip(batch, results):
+            self.latency.record(now - received)
+            if result[1]:
+                failed += 1
+            else:
+                self.render_time.record(result[2])
+            request_future.set_result(result)
+        self.throughput.tick(len(batch))
+        with self._lock:
+            self._pending -= len(batch)
+            self.errors += failed
+            self.batches += 1
+            self.largest_batch = max(self.largest_batch, len(batch))
+
+    def stats(self):
+        """
+        Thống kê của dịch vụ (trả về qua GET /stats)
+
+        Trả về:
+            dict gồm số request, lỗi, bị từ chối, đang chờ, số lần tạo lại pool, request/giây (10 s gần nhất và từ
+            lúc chạy), độ trễ và thời gian render p50/p95/p99 (ms), số lô và cỡ lô
+        """
+        def ms(tracker):
+            summary = tracker.summary()
+            if summary is None:
+                return None
+            return {key: round(summary[key] * 1000, 2)
+                    for key in ('mean', 'p50', 'p95', 'p99', 'max')}
+
+        with self._lock:
+            counters = {
+                'pending': self._pending,
+                'errors': self.errors,
+                'rejected': self.rejected,
+                'batches': self.batches,
+                'largest_batch': self.largest_batch,
+                'restarts': self.restarts,
+            }
+        completed = self.throughput.count
+        return dict(counters,
+                    workers=self.workers,
+                    max_batch=self.max_batch,
+                    warmup_ms=round(self.warmup_seconds * 1000, 1),
+                    uptime=round(time.perf_counter() - self.throughput.started, 1),
+                    requests=completed,
+                    rps=round(self.throughput.rate(), 2),
+                    rps_overall=round(self.throughput.overall_rate(), 2),
+                    mean_batch=round(completed / counters['batches'], 2) if counters['batches'] else None,
+                    latency_ms=ms(self.latency),
+                    render_ms=ms(self.render_time))
+
+    def close(self):
+        """Dừng nhận việc, chờ các lô đang chạy xong và tắt pool"""
+        self._requests.put(_STOP)
+        self._slots.release()   # Phòng khi luồng điều phối đang chờ tiến trình con rảnh
+        self._dispatcher.join()
+        self._pool.shutdown(wait=True)
+
+
+# === HTTP ===
+
+class RenderHandler(BaseHTTPRequestHandler):
+    """
+    POST /render?<thông số>: thân = file ảnh → ảnh đã render (định dạng theo 'format')
+    GET /stats: thống kê JSON của RenderService · GET /health: 'ok'
+    """
+
+    protocol_version = 'HTTP/1.1'   # Giữ kết nối giữa các request
+    server_version = 'PhotoLab'
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        if path == '/health':
+            self._send(200, b'ok\n', 'text/plain')
+        elif path == '/stats':
+            self._send_json(200, self.server.service.stats())
+        else:
+            self._send_json(404, {'error': f"không có {path}"})
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path != '/render':
+            self._send_json(404, {'error': f"không có {url.path}"})
+            return
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+        except ValueError:
+            length = None
+        if length is None or length < 0:
+            self.close_connection = True   # Không biết thân dài bao nhiêu → không dùng lại kết nối
+            self._send_json(400, {'error': "Content-Length không hợp lệ"})
+            return
+        if length == 0:
+            self._send_json(411, {'error': "thiếu thân request (nội dung file ảnh)"})
+            return
+        if length > MAX_BODY_BYTES:
+            self.close_connection = True   # Không đọc hết thân → không dùng lại kết nối được
+            self._send_json(413, {'error': f"ảnh lớn hơn {MAX_BODY_BYTES // 2**20} MB"})
+            return
+        data = self.rfile.read(length)
+        try:
+            recipe, image_format, encode_options = parse_render_query(url.query)
+        except ValueError as e:
+            self._send_json(400, {'error': str(e)})
+            return
+        future = self.server.service.submit(data, recipe, image_format, encode_options)
+        if future is None:
+            self._send_json(503, {'error': "hàng đợi render đầy, thử lại sau"},
+                            {'Retry-After': '1'})
+            return
+        try:
+            encoded, error, seconds = future.result(timeout=self.server.render_timeout)
+        except FutureTimeoutError:
+            # Request vẫn nằm trong hàng đợi/lô đang chạy; kết quả đến sau bị bỏ
+            self._send_json(504, {'error': f"render quá {self.server.render_timeout:g} s"})
+            return
+        if error:
+            self._send_json(422, {'error': error})
+            return
+        self._send(200, encoded, CONTENT_TYPES[image_format],
+                   {'X-Render-Ms': f"{seconds * 1000:.1f}"})
+
+    def _send(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self._send(status, body, 'application/json; charset=utf-8', headers)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class RenderServer(ThreadingHTTPServer):
+    """ThreadingHTTPServer (mỗi kết nối một luồng) gắn với một RenderService"""
+
+    daemon_threads = True
+
+    def __init__(self, address, service, verbose=False, render_timeout=RENDER_TIMEOUT):
+        super().__init__(address, RenderHandler)
+        self.service = service
+        self.verbose = verbose
+        self.render_timeout = render_timeout
@@ -0,0 +1,320 @@
+"""
+streaming.py - Xử lý video và chuỗi ảnh theo từng khung hình cho PhotoLab
+Khung hình được đọc dần (cv2.VideoCapture hoặc chuỗi ảnh đánh số), chạy chuỗi filter trên một
+pool luồng giới hạn, ghép lại đúng thứ tự rồi ghi ra cv2.VideoWriter hoặc chuỗi ảnh.
+Hàng đợi có giới hạn (backpressure): đọc nhanh hơn xử lý/ghi thì luồng đọc phải chờ, nên bộ
+nhớ chỉ cỡ vài khung hình dù video dài bao nhiêu
+"""
+import glob
+import os
+import queue
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+
+from metrics import LatencyTracker
+from processing import ImageProcessor, Pipeline
+from tiling import default_workers
+
+
+# Phần mở rộng được đọc/ghi bằng cv2.VideoCapture / cv2.VideoWriter
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv', '.m4v')
+# Phần mở rộng ảnh của chuỗi ảnh đánh số
+SEQUENCE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp', '.tif', '.tiff')
+# Mã FourCC mặc định theo phần mở rộng video đầu ra
+VIDEO_FOURCC = {'.mp4': 'mp4v', '.m4v': 'mp4v', '.mov': 'mp4v', '.avi': 'MJPG', '.mkv': 'XVID'}
+# Số khung hình/giây khi nguồn không cho biết (chuỗi ảnh, video thiếu metadata)
+DEFAULT_FPS = 24.0
+# Tên file mặc định khi ghi chuỗi ảnh vào một thư mục
+SEQUENCE_NAME = "frame_%06d"
+
+
+def is_video_path(path):
+    """True nếu đường dẫn là file video (theo phần mở rộng)"""
+    return os.path.splitext(path)[1].lower() in VIDEO_EXTENSIONS
+
+
+def _natural_key(path):
+    """Khóa sắp xếp tự nhiên: frame_2 đứng trước frame_10"""
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', path)]
+
+
+def sequence_files(pattern):
+    """
+    Danh sách file của một chuỗi ảnh đánh số
+
+    Tham số:
+        pattern: thư mục, mẫu glob (frames/*.png) hoặc mẫu printf (frames/img_%04d.png)
+
+    Trả về:
+        list đường dẫn theo thứ tự số khung
+    """
+    if os.path.isdir(pattern):
+        files = [os.path.join(pattern, name) for name in os.listdir(pattern)
+                 if name.lower().endswith(SEQUENCE_EXTENSIONS)]
+    else:
+        files = glob.glob(re.sub(r'%0?\d*d', '*', pattern))
+    return sorted(files, key=_natural_key)
+
+
+class FrameSource:
+    """
+    Nguồn khung hình: file video hoặc chuỗi ảnh đánh số, đọc dần qua frames()
+
+    Thuộc tính:
+        fps: số khung hình/giây của nguồn (DEFAULT_FPS nếu không rõ)
+        count: số khung hình (ước lượng với video, có thể là 0 nếu không rõ)
+    """
+
+    def __init__(self, path, start=0, max_frames=None):
+        """
+        Tham số:
+            path: file video, hoặc thư mục / mẫu glob / mẫu printf của chuỗi ảnh
+            start: bỏ qua chừng này khung đầu tiên
+            max_frames: đọc tối đa chừng này khung (None = đến hết)
+
+        Ném ra:
+            ValueError nếu không mở được nguồn
+        """
+        self.path = path
+        self.start = start
+        self.max_frames = max_frames
+        self._capture = None
+        self._files = None
+        if is_video_path(path):
+            self._capture = cv2.VideoCapture(path)
+            if not self._capture.isOpened():
+                raise ValueError(f"Không mở được video: {path}")
+            self.fps = self._capture.get(cv2.CAP_PROP_FPS) or DEFAULT_FPS
+            count = max(0, int(self._capture.get(cv2.CAP_PROP_FRAME_COUNT)) - start)
+        else:
+            self._files = sequence_files(path)
+            if not self._files:
+                raise ValueError(f"Không tìm thấy khung hình nào: {path}")
+            self.fps = DEFAULT_FPS
+            count = max(0, len(self._files) - start)
+        self.count = count if max_frames is None else min(count, max_frames)
+
+    def frames(self):
+        """
+        Generator các khung hình RGB uint8 theo thứ tự
+
+        Ném ra:
+            ValueError nếu một file trong chuỗi ảnh không đọc được
+        """
+        limit = float('inf') if self.max_frames is None else self.max_frames
+        produced = 0
+        if self._capture is not None:
+            if self.start:
+                self._capture.set(cv2.CAP_PROP_POS_FRAMES, self.start)
+            while produced < limit:
+                ok, frame = self._capture.read()
+                if not ok:
+                    break
+                # Đổi kênh tại chỗ: khung vừa giải mã không dùng ở đâu khác
+                yield cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=frame)
+                produced += 1
+            return
+        for path in self._files[self.start:]:
+            if produced >= limit:
+                break
+            frame = ImageProcessor.load_image(path)
+            if frame is None:
+                raise ValueError(f"Không đọc được khung hình: {path}")
+            yield frame
+            produced += 1
+
+    def close(self):
+        if self._capture is not None:
+            self._capture.release()
+            self._capture = None
+
+
+class FrameSink:
+    """
+    Đích ghi khung hình: file video (cv2.VideoWriter) hoặc chuỗi ảnh đánh số
+    VideoWriter được mở khi có khung đầu tiên (kích thước khung lấy từ khung đó)
+    """
+
+    def __init__(self, path, fps=DEFAULT_FPS, fourcc=None, image_format='png', encode_options=None):
+        """
+        Tham số:
+            path: file video, mẫu printf (out/img_%04d.jpg) hoặc thư mục (ghi SEQUENCE_NAME)
+            fps: số khung hình/giây của video đầu ra
+            fourcc: mã codec 4 ký tự (None = theo phần mở rộng, xem VIDEO_FOURCC)
+            image_format: định dạng ảnh khi path là thư mục
+            encode_options: tùy chọn encoder cho chuỗi ảnh (xem DEFAULT_ENCODE_OPTIONS)
+        """
+        self.path = path
+        self.fps = fps
+        self.encode_options = encode_options or {}
+        self.count = 0
+        self._writer = None
+        self._fourcc = None
+        if is_video_path(path):
+            self._fourcc = fourcc or VIDEO_FOURCC[os.path.splitext(path)[1].lower()]
+            self._pattern = None
+        elif '%' in path:
+            self._pattern = path
+        else:
+            self._pattern = os.path.join(path, f"{SEQUENCE_NAME}.{image_format}")
+        directory = os.path.dirname(self._pattern or path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def write(self, frame):
+        """
+        Ghi một khung hình RGB uint8
+
+        Ném ra:
+            OSError nếu không mở được VideoWriter hoặc không ghi được ảnh
+        """
+        if self._pattern is not None:
+            path = self._pattern % self.count
+            if not ImageProcessor.save_image(path, frame, **self.encode_options):
+                raise OSError(f"Không ghi được {path}")
+        else:
+            if self._writer is None:
+                h, w = frame.shape[:2]
+                self._writer = cv2.VideoWriter(self.path, cv2.VideoWriter_fourcc(*self._fourcc),
+                                               self.fps, (w, h))
+                if not self._writer.isOpened():
+                    raise OSError(f"Không mở được VideoWriter {self.path} ({self._fourcc})")
+            # Khung kết quả không dùng lại sau khi ghi → đổi kênh tại chỗ
+            self._writer.write(cv2.cvtColor(frame, cv2.COLOR_RGB2BGR, dst=frame))
+        self.count += 1
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.release()
+            self._writer = None
+
+
+class FrameStream:
+    """
+    Chạy một hàm xử lý trên chuỗi khung hình bằng pool luồng, giữ nguyên thứ tự khung
+
+    Luồng gọi run() đọc khung và gửi vào pool; một luồng ghi lấy kết quả theo đúng thứ tự gửi
+    rồi ghi ra. Giữa hai bên là hàng đợi tối đa queue_depth khung (đang xử lý hoặc chờ ghi):
+    khi đầy, luồng đọc phải chờ luồng ghi (backpressure)
+    """
+
+    def __init__(self, process, workers=None, queue_depth=None):
+        """
+        Tham số:
+            process: hàm khung RGB -> khung RGB (gọi đồng thời từ nhiều luồng)
+            workers: số luồng xử lý (None = số nhân CPU)
+            queue_depth: số khung tối đa đang xử lý hoặc chờ ghi (None = 2 x workers)
+        """
+        self.process = process
+        self.workers = workers or default_workers()
+        self.queue_depth = queue_depth or 2 * self.workers
+        self.frame_latency = LatencyTracker()   # Thời gian xử lý một khung (trên luồng xử lý)
+
+    def _timed_process(self, frame):
+        start = time.perf_counter()
+        result = self.process(frame)
+        self.frame_latency.record(time.perf_counter() - start)
+        return result
+
+    def run(self, frames, write, on_frame=None):
+        """
+        Xử lý toàn bộ chuỗi khung hình
+
+        Tham số:
+            frames: iterable khung hình RGB (vd: FrameSource.frames())
+            write: hàm ghi một khung kết quả (gọi trên luồng ghi, đúng thứ tự)
+            on_frame: hàm on_frame(số khung đã ghi) gọi sau mỗi khung (trên luồng ghi)
+
+        Trả về:
+            dict thống kê: frames, elapsed, fps, mean_depth, max_depth, queue_depth,
+            read_stall (giây luồng đọc chờ vì hàng đợi đầy), write (giây ghi),
+            frame_latency (LatencyTracker.summary() của thời gian xử lý một khung)
+
+        Ném ra:
+            lỗi đầu tiên của hàm xử lý / hàm ghi / nguồn khung (các khung đã gửi vẫn được chờ xong)
+        """
+        pending = queue.Queue(maxsize=self.queue_depth)
+        stats = {'frames': 0, 'write': 0.0, 'read_stall': 0.0}
+        errors = []
+        depth_total = depth_max = samples = 0
+
+        def writer():
+            while True:
+                future = pending.get()
+                if future is None:
+                    return
+                if errors:
+                    continue  # Đã lỗi: chỉ rút cạn hàng đợi để luồng đọc không bị chặn
+                try:
+                    frame = future.result()
+                    start = time.perf_counter()
+                    write(frame)
+                    stats['write'] += time.perf_counter() - start
+                except Exception as e:
+                    errors.append(e)
+                    continue
+                stats['frames'] += 1
+                if on_frame is not None:
+                    on_frame(stats['frames'])
+
+        start = time.perf_counter()
+        write_thread = threading.Thread(target=writer, name="PhotoLabStreamWrite", daemon=True)
+        write_thread.start()
+        pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="PhotoLabStream")
+        try:
+            for frame in frames:
+                if errors:
+                    break
+                future = pool.submit(self._timed_process, frame)
+                depth = pending.qsize()
+                depth_total += depth
+                depth_max = max(depth_max, depth)
+                samples += 1
+                wait_start = time.perf_counter()
+                pending.put(future)
+                stats['read_stall'] += time.perf_counter() - wait_start
+        except Exception as e:
+            errors.append(e)
+        finally:
+            pending.put(None)
+            write_thread.join()
+            pool.shutdown(wait=True)
+        if errors:
+            raise errors[0]
+        elapsed = time.perf_counter() - start
+        stats.update(elapsed=elapsed,
+                     fps=stats['frames'] / elapsed if elapsed > 0 else 0.0,
+                     mean_depth=depth_total / samples if samples else 0.0,
+                     max_depth=depth_max,
+                     queue_depth=self.queue_depth,
+                     frame_latency=self.frame_latency.summary())
+        return stats
+
+
+def stream_recipe(source, sink, recipe, workers=None, queue_depth=None, on_frame=None):
+    """
+    Áp dụng một công thức chỉnh ảnh cho mọi khung của source, ghi ra sink
+    Chuỗi filter được biên dịch một lần (LUT gộp, kernel); mask bokeh được cache theo kích
+    thước khung nên chỉ tính ở khung đầu tiên - mỗi khung chỉ còn chi phí chạy các bước
+
+    Tham số:
+        source: FrameSource
+        sink: FrameSink
+        recipe: dict theo định dạng DEFAULT_RECIPE
+        workers, queue_depth: xem FrameStream
+        on_frame: xem FrameStream.run
+
+    Trả về:
+        dict thống kê của FrameStream.run
+    """
+    compiled = Pipeline.from_recipe(recipe).compile()
+    stream = FrameStream(compiled.run, workers, queue_depth)
+    try:
+        return stream.run(source.frames(), sink.write, on_frame)
+    finally:
+        source.close()
+        sink.close()
@@ -0,0 +1,36 @@
+"""
+Kiểm tra lệnh batch: một ảnh lỗi trong tiến trình con chỉ làm ảnh đó lỗi, các ảnh còn lại
+vẫn được xử lý và ghi ra
+"""
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import photolab
+from processing import ImageProcessor
+
+
+def test_worker_exception_fails_only_that_file(tmp_path, monkeypatch, capsys):
+    for name in ('a', 'b', 'c'):
+        ImageProcessor.save_image(str(tmp_path / f'{name}.png'), np.full((16, 24, 3), 100, np.uint8))
+    recipe = tmp_path / 'recipe.json'
+    recipe.write_text(json.dumps({'brightness': 10}))
+    out = tmp_path / 'out'
+    real_process_file = photolab.process_file
+
+    def crashing_process_file(input_path, *args):
+        if input_path.endswith('b.png'):
+            raise MemoryError("worker died")
+        return real_process_file(input_path, *args)
+
+    # Pool luồng thay cho pool tiến trình để hàm thay thế có hiệu lực trong worker
+    monkeypatch.setattr(photolab, 'ProcessPoolExecutor', ThreadPoolExecutor)
+    monkeypatch.setattr(photolab, 'process_file', crashing_process_file)
+    args = photolab.build_parser().parse_args(
+        ['batch', str(recipe), str(tmp_path / '*.png'), '-o', str(out), '-j', '2'])
+    assert photolab.run_batch(args) == 1
+    assert sorted(p.name for p in out.iterdir()) == ['a.jpg', 'c.jpg']
+    captured = capsys.readouterr()
+    assert 'b.png: worker died' in captured.err
+    assert 'Đã xử lý 2/3 ảnh' in captured.out
@@ -0,0 +1,41 @@
+"""
+Kiểm tra mask xóa phông: cache giới hạn theo byte, kết quả không đổi khi lấy mask từ cache
+hoặc khi render theo vùng (ô/dải)
+"""
+import numpy as np
+
+from benchmark import synthetic_image
+from processing import BOKEH_MASKS, ImageProcessor
+
+
+def test_mask_cache_is_bounded_by_bytes():
+    old_limit = BOKEH_MASKS.max_bytes
+    BOKEH_MASKS.clear()
+    try:
+        # Giới hạn đủ cho ~2 mask 400x600 float32
+        BOKEH_MASKS.set_max_bytes(2 * 400 * 600 * 4)
+        for w in (600, 590, 580, 570):
+            ImageProcessor.bokeh_mask(400, w)
+            assert BOKEH_MASKS.current_bytes <= BOKEH_MASKS.max_bytes
+        # Mask lớn hơn cả giới hạn vẫn dựng được, chỉ không được giữ lại
+        assert ImageProcessor.bokeh_mask(1000, 1000).shape == (1000, 1000)
+        assert BOKEH_MASKS.current_bytes <= BOKEH_MASKS.max_bytes
+    finally:
+        BOKEH_MASKS.set_max_bytes(old_limit)
+        BOKEH_MASKS.clear()
+
+
+def test_bokeh_cached_and_region_match():
+    image = synthetic_image(0.2)
+    h, w = image.shape[:2]
+    BOKEH_MASKS.clear()
+    cold = ImageProcessor.apply_bokeh_effect(image, 50)
+    warm = ImageProcessor.apply_bokeh_effect(image, 50)
+    assert np.array_equal(cold, warm)
+    # Vùng ở giữa ảnh với đủ lề cho kernel: khớp với ảnh đầy đủ
+    y0, x0, y1, x1 = h // 4, w // 4, 3 * h // 4, 3 * w // 4
+    part = ImageProcessor.apply_bokeh_effect(image[y0:y1, x0:x1].copy(), 50,
+                                             region=(y0, x0, h, w))
+    margin = 40
+    assert np.abs(part[margin:-margin, margin:-margin].astype(np.int16)
+                  - cold[y0 + margin:y1 - margin, x0 + margin:x1 - margin]).max() <= 1
@@ -0,0 +1,25 @@
+"""
+Kiểm tra BUFFER_POOL: gọi lặp lại cùng cỡ ảnh phải dùng lại bộ đệm, không cấp phát thêm
+"""
+from benchmark import FULL_CHAIN_PARAMS, synthetic_image
+from processing import BUFFER_POOL, ImageProcessor, Pipeline
+
+
+def test_vibrance_saturation_reuses_buffers():
+    image = synthetic_image(0.2)
+    out = image.copy()
+    ImageProcessor.apply_vibrance_saturation(image, 30, 10, out)
+    allocations = BUFFER_POOL.allocations
+    for _ in range(5):
+        ImageProcessor.apply_vibrance_saturation(image, 30, 10, out)
+    assert BUFFER_POOL.allocations == allocations
+
+
+def test_full_chain_reuses_buffers():
+    image = synthetic_image(0.2)
+    compiled = Pipeline.from_recipe(FULL_CHAIN_PARAMS).compile()
+    compiled.run(image)
+    allocations = BUFFER_POOL.allocations
+    for _ in range(3):
+        compiled.run(image)
+    assert BUFFER_POOL.allocations == allocations
@@ -0,0 +1,79 @@
+"""
+Kiểm tra việc thay ảnh đọc thu nhỏ bằng ảnh đầy đủ (PhotoLabApp, không mở cửa sổ Tk):
+kết quả đọc muộn của ảnh cũ không làm mất ảnh đầy đủ của ảnh đang mở, và chỉ lưu khi
+base_image là ảnh đầy đủ
+"""
+import numpy as np
+import pytest
+
+ui = pytest.importorskip('ui')
+
+
+class _Root:
+    """Thay cho cửa sổ Tk: after() xếp callback vào hàng đợi, run() chạy lần lượt"""
+
+    def __init__(self):
+        self.queue = []
+
+    def after(self, delay, func, *args):
+        self.queue.append((func, args))
+
+    def run(self):
+        while self.queue:
+            func, args = self.queue.pop(0)
+            func(*args)
+
+
+class _Label:
+    def config(self, **kwargs):
+        self.text = kwargs.get('text')
+
+
+@pytest.fixture
+def app(monkeypatch):
+    app = ui.PhotoLabApp.__new__(ui.PhotoLabApp)
+    app.root = _Root()
+    app.lbl_status = _Label()
+    app.load_token = 2              # Đang mở ảnh thứ hai, ảnh đầy đủ chưa đọc xong
+    app.base_scale = 0.25
+    app.full_load_pending = True
+    app.full_load_failed = None
+    app.full_wait_token = None
+    app.full_decode_latency = ui.LatencyTracker()
+    app.open_latency = ui.LatencyTracker()
+    monkeypatch.setattr(app, '_update_preview_proxy', lambda force=False: None, raising=False)
+    monkeypatch.setattr(app, '_apply_all_filters', lambda full_res=False: None, raising=False)
+    app.stage_cache = type('Cache', (), {'clear': lambda self: None})()
+    app.tile_renderer = app.stage_cache
+    app.errors = []
+    monkeypatch.setattr(ui, 'show_full_image_error', app.errors.append)
+    return app
+
+
+def test_stale_decode_does_not_drop_current_full_image(app):
+    full = np.zeros((40, 60, 3), np.uint8)
+    ready = []
+    app._wait_full_image(lambda: ready.append(app.base_scale))
+    # Ảnh cũ (token 1) đọc xong sau ảnh hiện tại
+    app.root.after(0, app._swap_full_image, 2, 'b.jpg', full, 0.1)
+    app.root.after(0, app._swap_full_image, 1, 'a.jpg', np.ones((4, 6, 3), np.uint8), 0.2)
+    app.root.run()
+    assert app.base_image is full and app.base_scale == 1.0
+    assert ready == [1.0] and app.errors == []
+
+
+def test_wait_refuses_reduced_image(app):
+    ready, aborted = [], []
+    app._wait_full_image(lambda: ready.append(True), lambda: aborted.append(True))
+    app.root.after(0, app._swap_full_image, 2, 'b.jpg', None, 0.1)
+    app.root.run()
+    assert ready == [] and aborted == [True]
+    assert app.errors == ['b.jpg'] and app.base_scale == 0.25
+
+
+def test_wait_aborts_when_another_image_is_opened(app):
+    ready, aborted = [], []
+    app._wait_full_image(lambda: ready.append(True), lambda: aborted.append(True))
+    app.load_token = 3
+    app.root.run()
+    assert ready == [] and aborted == [True]
@@ -0,0 +1,84 @@
+"""
+Kiểm tra chế độ trắng đen sớm (Pipeline.compile bước 5): các bộ lọc lân cận chạy trên
+1 kênh sáng phải cho kết quả như chuỗi RGB đầy đủ rồi trắng đen ở cuối
+"""
+import numpy as np
+import pytest
+
+from benchmark import synthetic_image
+from processing import ImageProcessor, Pipeline
+from tiling import TiledExecutor
+from viewport import TileRenderer, render_viewport
+
+# Sharpen chạy trên RGB, blur trong đoạn 1 kênh → có cả hai bước luma và gray_to_rgb
+GRAY_SHARPEN = {'brightness': 10, 'sharpen': 20, 'blur': 9, 'grayscale': True}
+# Sai lệch tối đa (mức xám) cho phép giữa đoạn 1 kênh và trắng đen ở cuối chuỗi RGB
+MAX_GRAY_DIFF = 2
+
+
+def _max_diff(a, b):
+    return int(np.abs(a.astype(np.int16) - b.astype(np.int16)).max())
+
+
+def test_gray_segment_runs_single_channel():
+    compiled = Pipeline.from_recipe(GRAY_SHARPEN).compile()
+    names = [stage.name for stage in compiled.stages]
+    assert names[-1] == 'gray_to_rgb'
+    assert names.index('sharpen') < names.index('luma') < names.index('blur')
+
+
+def test_tiled_executor_gray_sharpen():
+    # Đủ lớn để TiledExecutor chia dải (>= MIN_TILED_PIXELS)
+    image = synthetic_image(1.2)
+    compiled = Pipeline.from_recipe(GRAY_SHARPEN).compile()
+    expected = compiled.run(image)
+    executor = TiledExecutor(workers=4)
+    try:
+        result = compiled.run(image, executor=executor)
+    finally:
+        executor.close()
+    assert result.shape == image.shape
+    assert _max_diff(result, expected) == 0
+
+
+def test_render_viewport_gray_sharpen():
+    image = synthetic_image(0.5)
+    h, w = image.shape[:2]
+    expected = Pipeline.from_recipe(GRAY_SHARPEN).compile().run(image)
+    renderer = TileRenderer(tile_size=128, workers=2)
+    try:
+        frame = render_viewport(renderer, image, 'img', 1.0,
+                                lambda scale: Pipeline.from_recipe(GRAY_SHARPEN).compile(scale),
+                                1.0, (100, 50, w - 30, h - 20))
+    finally:
+        renderer.close()
+    assert frame.shape == (h - 70, w - 130, 3)
+    assert _max_diff(frame, expected[50:h - 20, 100:w - 30]) == 0
+
+
+def _color_edges(h=600, w=900):
+    """Ảnh tổng hợp có thêm các dải đỏ/xanh bão hòa cạnh nhau (biên màu gần cùng độ sáng)"""
+    image = synthetic_image(h * w / 1e6)[:h, :w].copy()
+    for x in range(0, w // 2, 60):
+        image[:h // 3, x:x + 30] = (255, 0, 0)
+        image[:h // 3, x + 30:x + 60] = (0, 0, 255)
+    image[h // 3:h // 2, w // 2:] = (0, 255, 0)
+    return image
+
+
+@pytest.mark.parametrize('params', [
+    {'skin_smooth': 60, 'smooth_method': 'bilateral'},
+    {'skin_smooth': 60, 'smooth_method': 'guided'},
+    {'skin_smooth': 60, 'smooth_method': 'fast_bilateral'},
+    {'sharpen': 20},
+    {'blur': 30},
+    {'bokeh': 60},
+    {'brightness': 15, 'vibrance': 30, 'warmth': 20, 'skin_smooth': 40, 'sharpen': 10,
+     'blur': 7, 'bokeh': 40},
+], ids=['bilateral', 'guided', 'fast_bilateral', 'sharpen', 'blur', 'bokeh', 'full_chain'])
+def test_gray_segment_matches_rgb_chain(params):
+    image = _color_edges()
+    reference = ImageProcessor.to_grayscale(Pipeline.from_recipe(params).compile().run(image))
+    result = Pipeline.from_recipe(dict(params, grayscale=True)).compile().run(image)
+    assert result.shape == reference.shape
+    assert _max_diff(result, reference) <= MAX_GRAY_DIFF
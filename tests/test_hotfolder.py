@@ -0,0 +1,68 @@
+"""
+Kiểm tra HotFolder: ảnh ra nằm cùng thư mục nguồn không bị xử lý lại, file tạm chỉ bị xóa
+khi đúng mẫu tên của process(), file biến mất giữa lúc quét không làm dừng vòng lặp
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+import hotfolder
+from hotfolder import HotFolder, PARTIAL_TAG
+from processing import DEFAULT_RECIPE, ImageProcessor
+
+RECIPE = dict(DEFAULT_RECIPE, brightness=10)
+
+
+def _write_image(path, value=128):
+    ImageProcessor.save_image(str(path), np.full((32, 48, 3), value, np.uint8))
+
+
+@pytest.fixture
+def pool():
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        yield pool
+
+
+def test_output_in_input_dir_is_not_reprocessed(tmp_path, pool):
+    _write_image(tmp_path / 'a.jpg')
+    folder = HotFolder(tmp_path, tmp_path, RECIPE, suffix='_edited', settle=0, log=lambda *a: None)
+    folder.run_once(pool)
+    for _ in range(3):
+        jobs, skipped, _ = folder.scan()
+        assert jobs == [] and skipped == 1
+    assert sorted(os.listdir(tmp_path)) == ['.photolab-manifest.json', 'a.jpg', 'a_edited.jpg']
+    # Nhận diện cả khi manifest mới (lần chạy đầu tiên sau khi xóa manifest)
+    fresh = HotFolder(tmp_path, tmp_path, RECIPE, suffix='_edited', settle=0, log=lambda *a: None)
+    fresh.manifest.entries.clear()
+    assert [job[0] for job in fresh.scan()[0]] == ['a.jpg']
+
+
+def test_only_writer_partials_are_removed(tmp_path):
+    out = tmp_path / 'out'
+    out.mkdir()
+    _write_image(tmp_path / 'in.jpg')
+    leftover = out / f"in_edited{PARTIAL_TAG}.jpg"
+    user_files = [out / 'my.partial.notes.jpg', out / 'in.partial.png', out / 'x.partially.jpg']
+    for path in [leftover] + user_files:
+        path.write_bytes(b'x')
+    HotFolder(tmp_path / 'in', out, RECIPE, suffix='_edited', log=lambda *a: None)
+    assert not leftover.exists()
+    assert all(path.exists() for path in user_files)
+
+
+def test_file_removed_before_hashing_is_skipped(tmp_path, monkeypatch):
+    _write_image(tmp_path / 'a.jpg')
+    _write_image(tmp_path / 'b.jpg', 64)
+    folder = HotFolder(tmp_path, tmp_path / 'out', RECIPE, settle=0, log=lambda *a: None)
+    real_hash = hotfolder.file_hash
+
+    def vanishing_hash(path, *args):
+        if path.endswith('a.jpg'):
+            os.remove(path)
+        return real_hash(path, *args)
+
+    monkeypatch.setattr(hotfolder, 'file_hash', vanishing_hash)
+    jobs, _, _ = folder.scan()
+    assert [job[0] for job in jobs] == ['b.jpg']
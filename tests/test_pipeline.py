@@ -0,0 +1,49 @@
+"""
+Kiểm tra CompiledPipeline chạy đồng thời từ nhiều luồng (như FrameStream): kết quả và
+last_timings của mỗi lần chạy không bị trộn
+"""
+import threading
+
+import numpy as np
+
+from benchmark import FULL_CHAIN_PARAMS, synthetic_image
+from processing import Pipeline
+from streaming import FrameStream
+
+
+def test_concurrent_runs_keep_timings_per_run():
+    compiled = Pipeline.from_recipe(FULL_CHAIN_PARAMS).compile()
+    names = [stage.name for stage in compiled.stages]
+    image = synthetic_image(0.05)
+    expected = compiled.run(image)
+    seen, errors = [], []
+
+    def worker():
+        for _ in range(20):
+            result = compiled.run(image)
+            if not np.array_equal(result, expected):
+                errors.append('result')
+            seen.append(list(compiled.last_timings))
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    # Mỗi ảnh chụp là tiền tố của đúng một lần chạy (đang chạy dở hoặc đã xong)
+    for timings in seen:
+        assert [name for name, _ in timings] == names[:len(timings)]
+    assert [name for name, _ in compiled.last_timings] == names
+    assert len(compiled.explain().splitlines()) >= len(names)
+
+
+def test_frame_stream_shared_pipeline():
+    compiled = Pipeline.from_recipe(FULL_CHAIN_PARAMS).compile()
+    frames = [synthetic_image(0.05, seed=i) for i in range(12)]
+    expected = [compiled.run(frame) for frame in frames]
+    results = []
+    stats = FrameStream(compiled.run, 4).run(iter(frames), results.append)
+    assert stats['frames'] == len(frames)
+    assert all(np.array_equal(a, b) for a, b in zip(results, expected))
+    assert [name for name, _ in compiled.last_timings] == [stage.name for stage in compiled.stages]
@@ -0,0 +1,47 @@
+"""
+Kiểm tra photolab.validate_recipe và tham số /render của server: khóa lạ, kiểu và khoảng
+giá trị theo PARAM_RANGES (khoảng của slider trên giao diện)
+"""
+import pytest
+
+from photolab import validate_recipe
+from processing import DEFAULT_RECIPE, PARAM_RANGES
+from server import parse_render_query
+
+
+def test_defaults_and_slider_limits_are_valid():
+    assert validate_recipe({}) == DEFAULT_RECIPE
+    for key, (low, high) in PARAM_RANGES.items():
+        assert validate_recipe({key: low})[key] == low
+        assert validate_recipe({key: high})[key] == high
+
+
+@pytest.mark.parametrize('recipe', [
+    {'blur': 100000},
+    {'blur': 31},
+    {'skin_smooth': -1},
+    {'sharpen': -5},
+    {'brightness': 101},
+    {'warmth': -51},
+    {'bokeh': 1.5},
+    {'contrast': True},
+    {'sharpen': '10'},
+    {'grayscale': 1},
+    {'smooth_method': 'median'},
+    {'unknown': 0},
+])
+def test_invalid_recipe(recipe):
+    with pytest.raises(ValueError):
+        validate_recipe(recipe)
+
+
+@pytest.mark.parametrize('query', ['blur=100000', 'skin_smooth=-20', 'sharpen=-1', 'blur=abc'])
+def test_render_query_out_of_range(query):
+    with pytest.raises(ValueError):
+        parse_render_query(query)
+
+
+def test_render_query_ok():
+    recipe, image_format, _ = parse_render_query('blur=30&sharpen=20&grayscale=1&format=png')
+    assert (recipe['blur'], recipe['sharpen'], recipe['grayscale']) == (30, 20, True)
+    assert image_format == 'png'
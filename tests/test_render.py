@@ -0,0 +1,46 @@
+"""
+Kiểm tra RenderScheduler: lỗi trong hàm render được báo qua on_error và luồng nền chạy tiếp
+"""
+import threading
+
+from render import RenderScheduler
+
+TIMEOUT = 10
+
+
+class _ImmediateRoot:
+    """Thay cho cửa sổ Tk: after() chạy callback ngay (trên luồng render)"""
+
+    def after(self, delay, func, *args):
+        func(*args)
+
+
+def test_error_is_reported_and_worker_keeps_running():
+    done, errors = [], []
+    delivered = threading.Event()
+
+    def render(value, cancel_check=None):
+        if value < 0:
+            raise ValueError("giá trị âm")
+        return value * 2
+
+    def on_done(result):
+        done.append(result)
+        delivered.set()
+
+    def on_error(error):
+        errors.append(error)
+        delivered.set()
+
+    scheduler = RenderScheduler(_ImmediateRoot(), render, on_done, on_error)
+    try:
+        scheduler.submit(-1)
+        assert delivered.wait(TIMEOUT)
+        delivered.clear()
+        scheduler.submit(21)
+        assert delivered.wait(TIMEOUT)
+    finally:
+        scheduler.close()
+    assert [str(e) for e in errors] == ["giá trị âm"]
+    assert done == [42]
+    assert scheduler.errors == 1
@@ -0,0 +1,106 @@
+"""
+Kiểm tra RenderService/RenderServer: lỗi pool tiến trình con không làm treo request,
+pool hỏng được tạo lại, handler trả 504 khi quá thời gian chờ
+"""
+import http.client
+import json
+import os
+import signal
+import threading
+from concurrent.futures import Future
+
+import pytest
+
+from benchmark import synthetic_image
+from processing import DEFAULT_RECIPE, ImageProcessor
+from server import RenderServer, RenderService
+
+RESULT_TIMEOUT = 60
+
+
+@pytest.fixture(scope='module')
+def image_bytes():
+    return ImageProcessor.encode_image(synthetic_image(0.05), 'jpg', quality=90)
+
+
+@pytest.fixture
+def service():
+    service = RenderService(workers=1)
+    yield service
+    service.close()
+
+
+def _render(service, data):
+    return service.submit(data, dict(DEFAULT_RECIPE, brightness=10)).result(timeout=RESULT_TIMEOUT)
+
+
+def test_render_ok(service, image_bytes):
+    encoded, error, _ = _render(service, image_bytes)
+    assert error is None
+    assert ImageProcessor.decode_image(encoded) is not None
+    assert service.stats()['pending'] == 0
+
+
+def test_submit_failure_fails_batch_and_keeps_dispatching(service, image_bytes, monkeypatch):
+    def broken_submit(jobs):
+        raise RuntimeError("pool closed")
+
+    monkeypatch.setattr(service, '_submit_batch', broken_submit)
+    encoded, error, _ = _render(service, image_bytes)
+    assert encoded is None and 'pool closed' in error
+    assert service.stats()['pending'] == 0
+    monkeypatch.undo()
+    # Luồng điều phối vẫn chạy và slot tiến trình con đã được trả lại
+    assert _render(service, image_bytes)[1] is None
+
+
+def test_broken_pool_is_recreated(service, image_bytes):
+    assert _render(service, image_bytes)[1] is None
+    for pid in list(service._pool._processes):
+        os.kill(pid, signal.SIGKILL)
+    # Request gửi trong lúc/sau khi pool hỏng đều có kết quả (lỗi hoặc ảnh), không treo
+    results = [_render(service, image_bytes) for _ in range(3)]
+    assert results[-1][1] is None
+    stats = service.stats()
+    assert stats['restarts'] == 1
+    assert stats['pending'] == 0
+
+
+class _StuckService:
+    """Dịch vụ giả không bao giờ trả kết quả"""
+
+    def submit(self, data, recipe, image_format='jpg', encode_options=None):
+        return Future()
+
+
+def test_handler_timeout_returns_504(image_bytes):
+    server = RenderServer(('127.0.0.1', 0), _StuckService(), render_timeout=0.2)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        connection = http.client.HTTPConnection(*server.server_address[:2], timeout=RESULT_TIMEOUT)
+        connection.request('POST', '/render?brightness=10', body=image_bytes)
+        response = connection.getresponse()
+        assert response.status == 504
+        assert 'error' in json.loads(response.read())
+        connection.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.mark.parametrize('length', ['abc', '-5', '1e3'])
+def test_bad_content_length_returns_400(length):
+    server = RenderServer(('127.0.0.1', 0), _StuckService())
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        connection = http.client.HTTPConnection(*server.server_address[:2], timeout=RESULT_TIMEOUT)
+        connection.putrequest('POST', '/render')
+        connection.putheader('Content-Length', length)
+        connection.endheaders()
+        response = connection.getresponse()
+        assert response.status == 400
+        assert 'Content-Length' in json.loads(response.read())['error']
+        connection.close()
+    finally:
+        server.shutdown()
+        server.server_close()
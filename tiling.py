@@ -0,0 +1,103 @@
+"""
+tiling.py - Xử lý song song chuỗi filter theo dải ngang trên nhiều nhân CPU
+Mỗi bước được chia thành các dải ngang có vùng đệm (halo) bằng vùng ảnh hưởng của bước đó,
+chạy trên thread pool (OpenCV và NumPy nhả GIL) rồi ghép lại - kết quả trùng khớp từng bit
+với cách xử lý cả ảnh
+"""
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from profiling import PROFILER
+
+
+# Ảnh nhỏ hơn ngưỡng này (pixel) được xử lý nguyên ảnh: chi phí chia dải lớn hơn lợi ích
+MIN_TILED_PIXELS = 1_000_000
+# Chiều cao tối thiểu của một dải (không tính halo)
+MIN_STRIP_ROWS = 64
+
+
+def default_workers():
+    """Số luồng mặc định = số nhân CPU"""
+    return os.cpu_count() or 1
+
+
+def plan_strips(height, count, align=1):
+    """
+    Chia [0, height) thành tối đa count dải liên tiếp, ranh giới là bội số của align
+
+    Trả về:
+        list các tuple (y0, y1)
+    """
+    rows = max(MIN_STRIP_ROWS, -(-height // count))
+    rows = -(-rows // align) * align
+    return [(y0, min(y0 + rows, height)) for y0 in range(0, height, rows)]
+
+
+class TiledExecutor:
+    """
+    Chạy các bước của chuỗi filter theo dải ngang trên thread pool
+
+    Mỗi dải đầu ra [y0, y1) được tính từ vùng cắt [y0 - halo, y1 + halo) của ảnh đầu vào,
+    với gốc vùng cắt làm tròn xuống bội số của align (các bước thu nhỏ ảnh cần lưới khớp
+    với ảnh đầy đủ). Tại biên ảnh, vùng cắt trùng biên ảnh nên cách xử lý biên giống hệt.
+    """
+
+    def __init__(self, workers=None):
+        """
+        Tham số:
+            workers: số luồng (None = số nhân CPU); 1 = không chia dải
+        """
+        self.workers = workers or default_workers()
+        self._pool = ThreadPoolExecutor(max_workers=self.workers,
+                                        thread_name_prefix="PhotoLabTile") if self.workers > 1 else None
+
+    def close(self):
+        """Giải phóng thread pool"""
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+    def run_stage(self, image, stage, out=None):
+        """
+        Chạy một bước (CompiledStage của processing.CompiledPipeline) trên ảnh
+        Bước không có footprint (cần toàn ảnh, ví dụ lật ảnh) được chạy nguyên ảnh
+
+        Tham số:
+            out: mảng đích cùng shape với kết quả, khác image (None = cấp phát mới)
+
+        Trả về:
+            numpy array kết quả
+        """
+        func = stage.func
+        h, w = image.shape[:2]
+        if self._pool is None or stage.footprint is None or h * w < MIN_TILED_PIXELS:
+            return func(image, out=out)
+        halo, align = stage.footprint
+
+        # Chia thêm dải để cân bằng tải khi các dải có thời gian chạy khác nhau
+        strips = plan_strips(h, self.workers * 2, align)
+        if len(strips) == 1:
+            return func(image, out=out)
+
+        def run_strip(y0, y1):
+            crop_y0 = max(0, (y0 - halo) // align * align)
+            crop_y1 = min(h, y1 + halo)
+            if PROFILER.enabled:
+                start = time.perf_counter()
+                result = func(image[crop_y0:crop_y1], region=(crop_y0, 0, h, w))
+                PROFILER.record(f"{stage.name}/strip", start, time.perf_counter(), 'strip',
+                                {'rows': [y0, y1]})
+            else:
+                result = func(image[crop_y0:crop_y1], region=(crop_y0, 0, h, w))
+            return y0, y1, result[y0 - crop_y0:y1 - crop_y0]
+
+        futures = [self._pool.submit(run_strip, y0, y1) for y0, y1 in strips]
+        for future in futures:
+            y0, y1, strip = future.result()
+            if out is None:
+                out = np.empty((h,) + strip.shape[1:], dtype=strip.dtype)
+            out[y0:y1] = strip
+        return out
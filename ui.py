@@ -7,9 +7,24 @@ from tkinter import ttk
 from PIL import Image, ImageTk
 import sys
 import os
+import threading
+import time
 
-from processing import ImageProcessor
-from utils import load_image_dialog, save_image_dialog, resize_image_to_fit
+import numpy as np
+
+from processing import (ImageProcessor, Pipeline, SKIN_SMOOTHING_METHODS, DEFAULT_ENCODE_OPTIONS,
+                        PARAM_RANGES)
+from render import RenderScheduler
+from cache import StageCache
+from history import EditHistory
+from histogram import HistogramMeter, CLIP_WARN_FRACTION
+from tiling import TiledExecutor
+from profiling import PROFILER
+from metrics import LatencyTracker
+from viewport import Viewport, TileRenderer, render_viewport, next_zoom_level
+from utils import (load_image_dialog, save_image_dialog, show_save_result, export_options_dialog,
+                   show_full_image_error, save_recipe_dialog, save_trace_dialog, read_image_size, create_preview_proxy,
+                   DisplayPyramid)
 
 
 def get_resource_path(relative_path):
@@ -20,6 +35,33 @@ def get_resource_path(relative_path):
     return os.path.join(os.path.dirname(__file__), relative_path)
 
 
+# Tên hiển thị của các chế độ làm mịn da (theo thứ tự SKIN_SMOOTHING_METHODS)
+SKIN_SMOOTHING_LABELS = {
+    'bilateral': "Chính xác (Bilateral)",
+    'guided': "Nhanh (Guided Filter)",
+    'fast_bilateral': "Nhanh (Bilateral thu nhỏ)",
+}
+
+
+# Chỉ tạo lại proxy / render lại sau khi ngừng kéo cửa sổ chừng này (ms)
+RESIZE_DEBOUNCE_MS = 150
+
+# Một thao tác (kéo slider, bấm nút) được ghi thành một bước lịch sử sau khi ngừng chừng này (ms)
+HISTORY_COMMIT_MS = 400
+
+# Chu kỳ kiểm tra ảnh đầy đủ đã đọc xong khi lưu/render độ phân giải gốc trong lúc còn đọc (ms)
+FULL_IMAGE_POLL_MS = 50
+
+# Kích thước khung vẽ histogram (pixel) và màu từng đường
+HISTOGRAM_SIZE = (240, 90)
+HISTOGRAM_COLORS = {
+    'luma': '#52525b',
+    'r': '#ef4444',
+    'g': '#22c55e',
+    'b': '#3b82f6',
+}
+
+
 # === BẢNG MÀU THEME 2025 - Dark Modern ===
 COLORS = {
     'bg_dark': '#0d0d0d',           # Nền chính (gần đen)
@@ -61,12 +103,100 @@ class PhotoLabApp:
         # === BIẾN TRẠNG THÁI ẢNH ===
         self.display_image = None      # Ảnh đang hiển thị trên màn hình
         self.original_image = None     # Ảnh gốc ban đầu (không bao giờ thay đổi)
-        self.base_image = None         # Ảnh nền để áp dụng filter (thay đổi khi lật)
+        self.base_image = None         # Ảnh nền để áp dụng filter (luôn giữ hướng gốc)
         self.is_grayscale = False      # Cờ đánh dấu chế độ trắng đen
+        # Hướng ảnh là trạng thái "lười": không lật base_image, chỉ lật khung hình hiển thị
+        # (view NumPy) và lật một lần ở cuối chuỗi filter khi lưu → cache từng bước vẫn dùng được
+        self.flipped_h = False         # Ảnh kết quả được lật ngang so với ảnh gốc
+        self.flipped_v = False         # Ảnh kết quả được lật dọc so với ảnh gốc
+        
+        # === MỞ ẢNH NHANH ===
+        # JPEG lớn được đọc thu nhỏ (1/2-1/8) để hiển thị và chỉnh sửa ngay, ảnh đầy đủ được
+        # đọc trên luồng nền rồi thay vào khi xong
+        self.base_scale = 1.0          # Tỷ lệ base_image / ảnh gốc (< 1 khi đang dùng ảnh thu nhỏ)
+        self.load_token = 0            # Tăng mỗi lần mở ảnh; kết quả đọc nền khác token là cũ
+        self.full_load_pending = False # Đang đọc ảnh đầy đủ của ảnh hiện tại trên luồng nền
+        self.full_load_failed = None   # Đường dẫn ảnh không đọc được ở độ phân giải đầy đủ
+        self.full_wait_token = None    # load_token của lần chờ ảnh đầy đủ đang diễn ra (lưu/render)
+        self.open_latency = LatencyTracker()       # Thời gian từ lúc chọn file đến điểm ảnh đầu tiên
+        self.full_decode_latency = LatencyTracker()  # Thời gian đến khi có ảnh đầy đủ
+        
+        # === ẢNH PROXY XEM TRƯỚC ===
+        # Khi kéo slider, chuỗi filter chạy trên proxy thu nhỏ vừa khung hiển thị
+        # thay vì ảnh gốc; chỉ render độ phân giải đầy đủ khi lưu hoặc khi được yêu cầu
+        self.preview_image = None      # Ảnh proxy thu nhỏ từ base_image
+        self.preview_scale = 1.0       # Tỷ lệ proxy / ảnh gốc
+        self.preview_size = None       # Kích thước khung (max_w, max_h) lúc tạo proxy
+        
+        # === CACHE TỪNG BƯỚC FILTER ===
+        # source_version tăng mỗi khi base_image/proxy thay đổi để khóa cache không bị nhầm
+        self.stage_cache = StageCache()
+        self.source_version = 0
+        
+        # Chia dải song song trên nhiều nhân cho ảnh lớn (render độ phân giải gốc / lưu ảnh)
+        self.tiled_executor = TiledExecutor()
+        
+        # === HIỂN THỊ ===
+        # Kéo cửa sổ: mỗi sự kiện <Configure> chỉ thu nhỏ lại ảnh đang hiển thị từ pyramid
+        # (gộp các sự kiện dồn dập thành một lần vẽ); tạo lại proxy + render lại được hoãn
+        # đến khi ngừng kéo RESIZE_DEBOUNCE_MS
+        self.display_pyramid = DisplayPyramid()   # Mip pyramid của display_image
+        self.base_pyramid = DisplayPyramid()      # Mip pyramid của base_image (tạo proxy)
+        self.photo_image = None        # ImageTk.PhotoImage đang hiển thị, dùng lại bằng paste()
+        self.container_size = None     # Kích thước image_container theo sự kiện <Configure>
+        self.resize_after_id = None    # Lệnh hoãn xử lý đổi kích thước (root.after)
+        self.redraw_pending = False    # Đã hẹn vẽ lại (after_idle) cho loạt sự kiện hiện tại
+        self.resize_started = None     # (thời điểm, số khung đã vẽ) khi bắt đầu kéo cửa sổ
+        self.frames_shown = 0          # Tổng số khung đã vẽ (đo số khung/giây khi kéo)
+        self.display_latency = LatencyTracker()   # Thời gian vẽ một khung (_show_image)
+        
+        # === THU PHÓNG / KÉO ẢNH ===
+        # Khi phóng to, khung hình được ghép từ các ô render ở độ phân giải cần thiết
+        # (xem viewport.py); ở chế độ vừa khung dùng ảnh proxy như cũ
+        self.viewport = Viewport()
+        self.tile_renderer = TileRenderer()
+        self.tile_renderer.on_tile_ready = self._post_tile_ready
+        self.pan_anchor = None         # Vị trí chuột lần cuối khi đang kéo ảnh
+        # Ảnh xem trước toàn cảnh gần nhất (thông số, ảnh): ô chưa render khi kéo ảnh được
+        # tạm lấy từ đây phóng to nên khung hình không phải chờ render ô
+        self.preview_params = None     # Thông số của yêu cầu xem trước gửi gần nhất
+        self.preview_result = None
+        
+        # === LỊCH SỬ CHỈNH SỬA ===
+        # Mỗi bước chỉ lưu thông số thay đổi; kết quả render xem trước của trạng thái tốn kém được
+        # giữ làm checkpoint (xem history.py) → hoàn tác hiển thị ngay hoặc render lại từ
+        # checkpoint gần nhất thay vì từ đầu
+        self.history = EditHistory()
+        self.history_after_id = None   # Lệnh hoãn ghi bước lịch sử (root.after)
+        self.rendered_plan = None      # (ảnh, thông số, khóa nguồn, kế hoạch) của lần render cuối
+        self.last_render = None        # (thông số, khóa nguồn, khóa từng bước) của ảnh xem trước
+        self.undo_pending = None       # (thời điểm, thông số) của lần hoàn tác đang chờ render
+        self.undo_latency = LatencyTracker()   # Thời gian từ lúc hoàn tác đến khi hiện ảnh
+        
+        # === HISTOGRAM ===
+        # Tính trên luồng nền riêng (latest-wins như render) từ mẫu thu nhỏ của ảnh xem trước,
+        # trong ngân sách thời gian cố định (xem histogram.py); luồng Tk chỉ cập nhật tọa độ
+        self.histogram = HistogramMeter()
+        self.histogram_source = None   # Ảnh của lần tính histogram gần nhất (bỏ qua gửi trùng)
+        self.histogram_draw_latency = LatencyTracker()   # Thời gian vẽ trên luồng Tk
+        
+        # === LƯU ẢNH ===
+        # Render độ phân giải gốc và mã hóa chạy trên luồng nền, giao diện vẫn phản hồi
+        self.encode_options = dict(DEFAULT_ENCODE_OPTIONS)  # Tùy chọn encoder (⚙ Tùy chọn xuất)
+        self.saving = False            # Đang có luồng lưu ảnh chạy (chặn lưu chồng)
         
         # Khởi tạo giao diện
         self._setup_styles()
         self._create_ui()
+        
+        # Luồng render nền: slider chỉ gửi thông số, không render trên luồng Tk
+        self.render_scheduler = RenderScheduler(self.root, self._render, self._on_render_done,
+                                                self._on_render_error)
+        # Luồng render khung nhìn khi phóng to (latest-wins: kéo nhanh chỉ render khung cuối)
+        self.viewport_scheduler = RenderScheduler(self.root, self._render_viewport,
+                                                  self._on_viewport_done, self._on_render_error)
+        self.histogram_scheduler = RenderScheduler(self.root, self._compute_histogram,
+                                                   self._on_histogram_done, self._on_render_error)
 
     def _setup_styles(self):
         """Cấu hình style cho các widget ttk"""
@@ -118,15 +248,19 @@ class PhotoLabApp:
         )
         self.btn_open.pack(fill=tk.X, padx=16, pady=(20, 10))
         
+        # === HISTOGRAM ===
+        self._create_section_header("📈  Histogram")
+        self._create_histogram_panel()
+        
         # === ADJUSTMENTS ===
         self._create_section_header("🎨  Chỉnh sửa màu sắc")
-        self.scale_brightness = self._create_slider("Độ sáng", -100, 100, 0)
-        self.scale_contrast = self._create_slider("Tương phản", -100, 100, 0)
+        self.scale_brightness = self._create_slider("Độ sáng", *PARAM_RANGES['brightness'], 0)
+        self.scale_contrast = self._create_slider("Tương phản", *PARAM_RANGES['contrast'], 0)
 
         # === LANDSCAPE ENHANCE ===
         self._create_section_header("🏞️  Phong cảnh")
-        self.scale_vibrance = self._create_slider("Vibrance phong cảnh", -100, 100, 0)
-        self.scale_saturation = self._create_slider("Saturation", -100, 100, 0)
+        self.scale_vibrance = self._create_slider("Vibrance phong cảnh", *PARAM_RANGES['vibrance'], 0)
+        self.scale_saturation = self._create_slider("Saturation", *PARAM_RANGES['saturation'], 0)
 
         # === FILTERS ===
         self._create_section_header("✨  Bộ lọc")
@@ -135,16 +269,18 @@ class PhotoLabApp:
             self._on_grayscale, COLORS['bg_card']
         )
         btn_grayscale.pack(fill=tk.X, padx=16, pady=4)
-        self.scale_sharpen = self._create_slider("Làm nét", 0, 20, 0)
+        self.scale_sharpen = self._create_slider("Làm nét", *PARAM_RANGES['sharpen'], 0)
 
-        self.scale_blur = self._create_slider("Làm mờ", 0, 30, 0)
+        self.scale_blur = self._create_slider("Làm mờ", *PARAM_RANGES['blur'], 0)
 
         # === BEAUTY / LÀM ĐẸP ===
         self._create_section_header("💄  Làm đẹp")
-        self.scale_skin_smooth = self._create_slider("Làm mịn da", 0, 100, 0)
-        self.scale_bokeh = self._create_slider("Xóa phông", 0, 100, 0)
+        self.scale_skin_smooth = self._create_slider("Làm mịn da", *PARAM_RANGES['skin_smooth'], 0)
+        self.smooth_method_var = self._create_option_menu(
+            "Chế độ làm mịn", SKIN_SMOOTHING_METHODS, SKIN_SMOOTHING_LABELS, 'bilateral')
+        self.scale_bokeh = self._create_slider("Xóa phông", *PARAM_RANGES['bokeh'], 0)
 
-        self.scale_warmth = self._create_slider("Độ ấm màu da", -50, 50, 0)
+        self.scale_warmth = self._create_slider("Độ ấm màu da", *PARAM_RANGES['warmth'], 0)
 
         # === TRANSFORM ===
         self._create_section_header("🔄  Biến đổi")
@@ -161,6 +297,39 @@ class PhotoLabApp:
         )
         btn_flip_v.pack(side=tk.RIGHT, expand=True, fill=tk.X, padx=(4, 0))
 
+        # === ZOOM ===
+        self._create_section_header("🔍  Thu phóng")
+        zoom_frame = tk.Frame(self.control_frame, bg=COLORS['bg_panel'])
+        zoom_frame.pack(fill=tk.X, padx=16, pady=4)
+        btn_fit = self._create_button(
+            zoom_frame, "⤢ Vừa khung",
+            lambda: self._set_zoom(None), COLORS['bg_card'], small=True
+        )
+        btn_fit.pack(side=tk.LEFT, expand=True, fill=tk.X, padx=(0, 4))
+        btn_zoom_100 = self._create_button(
+            zoom_frame, "1:1  100%",
+            lambda: self._set_zoom(1.0), COLORS['bg_card'], small=True
+        )
+        btn_zoom_100.pack(side=tk.RIGHT, expand=True, fill=tk.X, padx=(4, 0))
+
+        # === HISTORY ===
+        self._create_section_header("🕘  Lịch sử")
+        history_frame = tk.Frame(self.control_frame, bg=COLORS['bg_panel'])
+        history_frame.pack(fill=tk.X, padx=16, pady=4)
+        btn_undo = self._create_button(
+            history_frame, "↶ Hoàn tác",
+            self._on_undo, COLORS['bg_card'], small=True
+        )
+        btn_undo.pack(side=tk.LEFT, expand=True, fill=tk.X, padx=(0, 4))
+        btn_redo = self._create_button(
+            history_frame, "↷ Làm lại",
+            self._on_redo, COLORS['bg_card'], small=True
+        )
+        btn_redo.pack(side=tk.RIGHT, expand=True, fill=tk.X, padx=(4, 0))
+        self.root.bind("<Control-z>", self._on_undo)
+        self.root.bind("<Control-y>", self._on_redo)
+        self.root.bind("<Control-Z>", self._on_redo)  # Ctrl+Shift+Z
+
         # === ACTIONS ===
         self._create_section_header("💾  Lưu trữ")
         btn_save = self._create_button(
@@ -168,11 +337,41 @@ class PhotoLabApp:
             self._on_save_image, COLORS['accent_success']
         )
         btn_save.pack(fill=tk.X, padx=16, pady=4)
+        btn_export_options = self._create_button(
+            self.control_frame, "⚙  Tùy chọn xuất",
+            self._on_export_options, COLORS['bg_card']
+        )
+        btn_export_options.pack(fill=tk.X, padx=16, pady=4)
+        btn_full_res = self._create_button(
+            self.control_frame, "🔍  Xem độ phân giải gốc",
+            self._on_render_full_resolution, COLORS['bg_card']
+        )
+        btn_full_res.pack(fill=tk.X, padx=16, pady=4)
+        btn_recipe = self._create_button(
+            self.control_frame, "📝  Lưu công thức",
+            self._on_save_recipe, COLORS['bg_card']
+        )
+        btn_recipe.pack(fill=tk.X, padx=16, pady=4)
         btn_reset = self._create_button(
             self.control_frame, "🔄  Reset về gốc",
             self._on_reset_image, COLORS['accent_danger']
         )
         btn_reset.pack(fill=tk.X, padx=16, pady=4)
+
+        # === PROFILING ===
+        self._create_section_header("📊  Hiệu năng")
+        profile_frame = tk.Frame(self.control_frame, bg=COLORS['bg_panel'])
+        profile_frame.pack(fill=tk.X, padx=16, pady=4)
+        btn_profile = self._create_button(
+            profile_frame, "📊 Profiling",
+            self._on_toggle_profiling, COLORS['bg_card'], small=True
+        )
+        btn_profile.pack(side=tk.LEFT, expand=True, fill=tk.X, padx=(0, 4))
+        btn_trace = self._create_button(
+            profile_frame, "⏱ Xuất trace",
+            self._on_export_trace, COLORS['bg_card'], small=True
+        )
+        btn_trace.pack(side=tk.RIGHT, expand=True, fill=tk.X, padx=(4, 0))
         # Spacer
         tk.Frame(self.control_frame, bg=COLORS['bg_panel'], height=30).pack(fill=tk.X)
 
@@ -228,7 +427,18 @@ class PhotoLabApp:
                                    bg=COLORS['bg_card'],
                                    highlightbackground=COLORS['border'],
                                    highlightthickness=1)
-        self.image_container.pack(expand=True, fill=tk.BOTH, padx=20, pady=20)
+        self.image_container.pack(expand=True, fill=tk.BOTH, padx=20, pady=(20, 4))
+        
+        # Thanh trạng thái: hiển thị độ trễ render (input-to-pixels)
+        self.lbl_status = tk.Label(image_frame, text="",
+                                   font=("Segoe UI", 9),
+                                   bg=COLORS['bg_dark'],
+                                   fg=COLORS['text_muted'],
+                                   anchor="e")
+        self.lbl_status.pack(fill=tk.X, padx=20, pady=(0, 8))
+        
+        # Thanh tiến trình lưu ảnh: chỉ hiện khi đang lưu (các bước filter + mã hóa)
+        self.save_progress = ttk.Progressbar(image_frame, orient=tk.HORIZONTAL, mode='determinate')
         
         # Bind sự kiện resize cửa sổ
         self.image_container.bind('<Configure>', self._on_window_resize)
@@ -241,6 +451,51 @@ class PhotoLabApp:
                                   fg=COLORS['text_muted'],
                                   justify="center")
         self.lbl_image.pack(expand=True)
+        
+        # Thu phóng: cuộn chuột (Windows/macOS: MouseWheel, Linux: Button-4/5) tại con trỏ,
+        # kéo chuột trái để di chuyển, nhấp đúp để chuyển vừa khung ↔ 100%
+        for widget in (self.image_container, self.lbl_image):
+            widget.bind("<MouseWheel>", self._on_zoom_wheel)
+            widget.bind("<Button-4>", self._on_zoom_wheel)
+            widget.bind("<Button-5>", self._on_zoom_wheel)
+            widget.bind("<ButtonPress-1>", self._on_pan_start)
+            widget.bind("<B1-Motion>", self._on_pan_move)
+            widget.bind("<ButtonRelease-1>", self._on_pan_end)
+            widget.bind("<Double-Button-1>", self._on_toggle_zoom)
+        
+        # Lớp phủ profiling: thời gian từng bước, chỉ hiện khi bật profiling
+        self.lbl_profile = tk.Label(self.image_container, text="",
+                                    font=("Consolas", 9),
+                                    bg=COLORS['bg_dark'],
+                                    fg=COLORS['text_muted'],
+                                    justify="left")
+
+    def _create_histogram_panel(self):
+        """Khung vẽ histogram (độ sáng tô nền, R/G/B dạng đường) + nhãn vùng bị cắt và chi phí"""
+        width, height = HISTOGRAM_SIZE
+        self.histogram_canvas = tk.Canvas(self.control_frame, width=width, height=height,
+                                          bg=COLORS['bg_card'], highlightthickness=0)
+        self.histogram_canvas.pack(padx=16, pady=4)
+        flat = [0, height] * 256
+        self.histogram_items = {
+            'luma': self.histogram_canvas.create_polygon(flat + [width, height, 0, height],
+                                                         fill=HISTOGRAM_COLORS['luma'], outline=''),
+        }
+        for name in ('r', 'g', 'b'):
+            self.histogram_items[name] = self.histogram_canvas.create_line(
+                flat, fill=HISTOGRAM_COLORS[name], width=1)
+        self.lbl_clipping = tk.Label(self.control_frame, text="",
+                                     font=("Segoe UI", 9),
+                                     bg=COLORS['bg_panel'],
+                                     fg=COLORS['text_secondary'],
+                                     anchor="w")
+        self.lbl_clipping.pack(fill=tk.X, padx=16)
+        self.lbl_histogram_cost = tk.Label(self.control_frame, text="",
+                                           font=("Segoe UI", 8),
+                                           bg=COLORS['bg_panel'],
+                                           fg=COLORS['text_muted'],
+                                           anchor="w", justify="left", wraplength=240)
+        self.lbl_histogram_cost.pack(fill=tk.X, padx=16)
 
     def _create_header(self):
         """Tạo header với logo"""
@@ -337,6 +592,46 @@ class PhotoLabApp:
         
         return scale
 
+    def _create_option_menu(self, label_text, values, labels, default_val):
+        """
+        Tạo menu chọn (dropdown) với label, theo style của slider
+        
+        Trả về:
+            tk.StringVar chứa giá trị (không phải tên hiển thị) đang được chọn
+        """
+        container = tk.Frame(self.control_frame, bg=COLORS['bg_panel'])
+        container.pack(fill=tk.X, padx=16, pady=8)
+        
+        tk.Label(container, text=label_text,
+                font=("Segoe UI", 10),
+                bg=COLORS['bg_panel'],
+                fg=COLORS['text_secondary']).pack(anchor="w")
+        
+        value_var = tk.StringVar(value=default_val)
+        label_var = tk.StringVar(value=labels[default_val])
+        # Đổi giá trị từ code (vd: hoàn tác) → cập nhật tên hiển thị
+        value_var.trace_add('write', lambda *args: label_var.set(labels[value_var.get()]))
+        
+        def on_select(label):
+            value_var.set(next(v for v in values if labels[v] == label))
+            self._apply_all_filters()
+        
+        menu = tk.OptionMenu(container, label_var, *[labels[v] for v in values],
+                             command=on_select)
+        menu.configure(font=("Segoe UI", 10),
+                       bg=COLORS['bg_card'],
+                       fg=COLORS['text_primary'],
+                       activebackground=COLORS['bg_hover'],
+                       activeforeground=COLORS['text_primary'],
+                       highlightthickness=0,
+                       relief='flat',
+                       anchor="w")
+        menu['menu'].configure(bg=COLORS['bg_card'], fg=COLORS['text_primary'],
+                               activebackground=COLORS['accent'])
+        menu.pack(fill=tk.X, pady=(6, 0))
+        
+        return value_var
+
     # === XỬ LÝ SỰ KIỆN ===
     
     def _on_slider_change(self, value, value_label):
@@ -357,30 +652,267 @@ class PhotoLabApp:
         return "break"  # Ngăn sự kiện mặc định
 
     def _on_open_image(self):
-        """Mở dialog chọn ảnh và load ảnh vào ứng dụng"""
+        """
+        Mở dialog chọn ảnh và load ảnh vào ứng dụng
+        JPEG lớn hơn khung hiển thị được đọc thu nhỏ để hiện ngay, ảnh đầy đủ đọc trên luồng nền
+        """
         file_path = load_image_dialog()
-        if file_path:
-            img_array = ImageProcessor.load_image(file_path)
-            if img_array is not None:
-                self.original_image = img_array.copy()
-                self.base_image = img_array.copy()
-                self.display_image = img_array.copy()
-                self.is_grayscale = False
-                self._show_image(img_array)
-                self._reset_sliders()
+        if not file_path:
+            return
+        start = time.perf_counter()
+        factor = 1
+        if file_path.lower().endswith(('.jpg', '.jpeg')):
+            size = read_image_size(file_path)
+            if size is not None:
+                factor = ImageProcessor.reduced_decode_factor(size, self._get_display_size())
+        img_array = ImageProcessor.load_image(file_path, reduce=factor)
+        if img_array is None:
+            return
+        
+        self.load_token += 1
+        self.full_load_pending = factor > 1
+        self.full_load_failed = None
+        self.base_scale = 1.0 / factor
+        self.original_image = img_array.copy()
+        self.base_image = img_array.copy()
+        self.display_image = img_array.copy()
+        self.is_grayscale = False
+        self.flipped_h = self.flipped_v = False
+        self.render_scheduler.cancel()
+        self.viewport_scheduler.cancel()
+        self.viewport.reset()
+        self.stage_cache.clear()
+        self.tile_renderer.clear()
+        self._update_preview_proxy(force=True)
+        self._show_image(img_array)
+        self._update_histogram(img_array)
+        self._reset_sliders()
+        self._cancel_history_commit()
+        self.history.reset(self._get_recipe())
+        self.undo_pending = None
+        self.open_latency.record(time.perf_counter() - start)
+        self.lbl_status.config(text=self.open_latency.format_ms('Mở ảnh (điểm ảnh đầu tiên)'))
+        
+        if factor > 1:
+            threading.Thread(
+                target=self._load_full_image, args=(self.load_token, file_path, start),
+                name="PhotoLabDecode", daemon=True).start()
+
+    def _load_full_image(self, token, file_path, start):
+        """Chạy trên luồng nền: đọc ảnh ở độ phân giải đầy đủ rồi báo về luồng Tk (None nếu lỗi)"""
+        try:
+            image = ImageProcessor.load_image(file_path)
+        except Exception:  # Hết bộ nhớ, file bị xóa/hỏng giữa chừng...
+            image = None
+        try:
+            # Kết quả đi kèm token: ảnh cũ đọc xong muộn không đè lên kết quả của ảnh đang mở
+            self.root.after(0, self._swap_full_image, token, file_path, image,
+                            time.perf_counter() - start)
+        except RuntimeError:
+            pass  # Cửa sổ Tk đã đóng
+
+    def _swap_full_image(self, token, file_path, image, elapsed):
+        """
+        Chạy trên luồng Tk: thay ảnh thu nhỏ bằng ảnh đầy đủ vừa đọc xong
+        Giữ nguyên hướng ảnh và thông số slider, rồi render lại bản xem trước
+        Đọc lỗi thì vẫn chỉnh trên ảnh thu nhỏ nhưng không cho lưu/render độ phân giải gốc
+        """
+        if token != self.load_token:
+            return  # Kết quả của ảnh đã đóng
+        self.full_load_pending = False
+        if image is None:
+            self.full_load_failed = file_path
+            self.lbl_status.config(
+                text="Không đọc được ảnh ở độ phân giải đầy đủ - chỉ xem trước, không lưu được")
+            return
+        self.full_decode_latency.record(elapsed)
+        self.original_image = image
+        self.base_image = image
+        self.base_scale = 1.0
+        self.stage_cache.clear()
+        self.tile_renderer.clear()
+        self._update_preview_proxy(force=True)
+        self._apply_all_filters()
+        self.lbl_status.config(
+            text=f"{self.open_latency.format_ms('Mở ảnh (điểm ảnh đầu tiên)')}"
+                 f"  ·  Ảnh gốc sau {elapsed * 1000:.0f} ms")
+
+    def _wait_full_image(self, on_ready, on_abort=None):
+        """
+        Chờ ảnh đầy đủ (dùng trước khi lưu/render độ phân giải gốc) mà không chặn luồng Tk:
+        luồng đọc còn chạy thì kiểm tra lại bằng root.after
+
+        Tham số:
+            on_ready: callback() khi base_image là ảnh đầy đủ (base_scale == 1)
+            on_abort: callback() khi không có ảnh đầy đủ (đã báo lỗi) hoặc đã mở ảnh khác
+        """
+        token = self.load_token
+        self.full_wait_token = token
+
+        def check():
+            if token != self.load_token or self.full_wait_token != token:
+                if on_abort is not None:
+                    on_abort()
+                return
+            if self.full_load_pending:
+                self.root.after(FULL_IMAGE_POLL_MS, check)
+                return
+            self.full_wait_token = None
+            if self.base_scale != 1.0:
+                show_full_image_error(self.full_load_failed or "")
+                if on_abort is not None:
+                    on_abort()
+                return
+            on_ready()
+
+        if self.full_load_pending:
+            self.lbl_status.config(text="Đang chờ đọc xong ảnh gốc…")
+        check()
 
     def _on_save_image(self):
-        """Mở dialog lưu ảnh đã chỉnh sửa ra file"""
-        save_image_dialog(self.display_image)
+        """
+        Mở dialog lưu ảnh đã chỉnh sửa ra file
+        Ảnh hiển thị chỉ là bản xem trước từ proxy nên phải render lại ở độ phân giải gốc;
+        việc render và mã hóa chạy trên luồng nền, tiến trình hiện trên thanh trạng thái
+        """
+        if self.saving:
+            return
+        file_path = save_image_dialog(self.base_image is not None)
+        if not file_path:
+            return
+        # Chặn lưu chồng ngay từ lúc chờ ảnh đầy đủ
+        self.saving = True
+        self._wait_full_image(lambda: self._start_save(file_path), self._cancel_save)
+
+    def _cancel_save(self):
+        """Bỏ lần lưu đang chờ ảnh đầy đủ (đọc lỗi hoặc đã mở ảnh khác)"""
+        self.saving = False
+
+    def _start_save(self, file_path):
+        """Ảnh đầy đủ đã sẵn sàng: bắt đầu render và lưu trên luồng nền"""
+        # Chụp lại ảnh nguồn, thông số và tùy chọn trên luồng Tk (worker không đọc widget)
+        compiled = Pipeline.from_recipe(self._get_recipe()).compile(self.base_scale)
+        self.save_progress.config(maximum=len(compiled.stages) + 1, value=0)
+        self.save_progress.pack(fill=tk.X, padx=20, pady=(0, 8), before=self.lbl_status)
+        self.lbl_status.config(text="Đang lưu ảnh…")
+        threading.Thread(
+            target=self._save_worker,
+            args=(compiled, self.base_image, ('full', self.source_version), file_path,
+                  dict(self.encode_options)),
+            name="PhotoLabSave", daemon=True).start()
+
+    def _save_worker(self, compiled, image, source_key, file_path, options):
+        """
+        Chạy trên luồng nền: render độ phân giải gốc rồi mã hóa và ghi file
+        Tiến trình (số bước đã xong) và kết quả được gửi về luồng Tk bằng root.after
+        """
+        def post(callback, *args):
+            try:
+                self.root.after(0, callback, *args)
+            except RuntimeError:
+                pass  # Cửa sổ Tk đã đóng
+        
+        def on_stage():
+            # Gọi trước mỗi bước: last_timings gồm các bước đã xong (kể cả bước lấy từ cache)
+            post(self._on_save_progress, len(compiled.last_timings), "Đang render")
+        
+        error = None
+        render_time = encode_time = 0.0
+        nbytes = file_size = 0
+        try:
+            start = time.perf_counter()
+            result = compiled.run(image, cache=self.stage_cache, source_key=source_key,
+                                  executor=self.tiled_executor, cancel_check=on_stage)
+            render_time = time.perf_counter() - start
+            nbytes = result.nbytes
+            post(self._on_save_progress, len(compiled.stages), "Đang mã hóa")
+            
+            start = time.perf_counter()
+            ok = ImageProcessor.save_image(file_path, result, **options)
+            end = time.perf_counter()
+            encode_time = end - start
+            if PROFILER.enabled:
+                PROFILER.record('encode', start, end, 'io', {'path': file_path, 'in_bytes': nbytes})
+            if ok:
+                file_size = os.path.getsize(file_path)
+            else:
+                error = "định dạng không được hỗ trợ hoặc không ghi được file"
+        except Exception as e:  # Lỗi encoder/ghi file: báo lên giao diện thay vì mất trong luồng nền
+            error = str(e)
+        post(self._on_save_done, file_path, error, render_time, encode_time, nbytes, file_size)
+
+    def _on_save_progress(self, done, stage_text):
+        """Chạy trên luồng Tk: cập nhật thanh tiến trình lưu ảnh"""
+        if not self.saving:
+            return
+        total = int(self.save_progress.cget('maximum'))
+        self.save_progress.config(value=done)
+        self.lbl_status.config(text=f"{stage_text}… ({done}/{total})")
+
+    def _on_save_done(self, file_path, error, render_time, encode_time, nbytes, file_size):
+        """Chạy trên luồng Tk: ẩn thanh tiến trình, báo thời gian render/mã hóa và kết quả"""
+        self.saving = False
+        self.save_progress.pack_forget()
+        if error is None:
+            # MB/s tính theo dữ liệu ảnh chưa nén đưa vào encoder
+            rate = nbytes / encode_time / 2**20 if encode_time > 0 else 0.0
+            self.lbl_status.config(
+                text=f"Đã lưu {os.path.basename(file_path)} ({file_size / 2**20:.1f} MB)"
+                     f"  ·  Render {render_time * 1000:.0f} ms"
+                     f"  ·  Mã hóa {encode_time * 1000:.0f} ms ({rate:.0f} MB/s)")
+        else:
+            self.lbl_status.config(text="Lưu ảnh thất bại")
+        show_save_result(file_path, error)
+
+    def _on_export_options(self):
+        """Chỉnh tùy chọn encoder (chất lượng, progressive, mức nén...) dùng cho lần lưu sau"""
+        options = export_options_dialog(self.root, self.encode_options)
+        if options is not None:
+            self.encode_options = options
+
+    def _on_save_recipe(self):
+        """Lưu thông số chỉnh sửa hiện tại thành công thức JSON (dùng cho photolab batch)"""
+        save_recipe_dialog(self._get_recipe())
+
+    def _on_toggle_profiling(self):
+        """Bật/tắt đo thời gian từng bước và lớp phủ tóm tắt trên khung ảnh"""
+        if PROFILER.enabled:
+            PROFILER.disable()
+            self.lbl_profile.place_forget()
+        else:
+            PROFILER.clear()
+            PROFILER.enable()
+            self.lbl_profile.config(text=PROFILER.format_summary())
+            self.lbl_profile.place(x=8, y=8, anchor="nw")
+
+    def _on_export_trace(self):
+        """Xuất các sự kiện profiling đã ghi ra file Chrome trace / Perfetto"""
+        save_trace_dialog(PROFILER)
+
+    def _on_render_full_resolution(self):
+        """Render toàn bộ filter trên ảnh gốc (thay vì proxy) để kiểm tra kết quả cuối"""
+        if self.base_image is None:
+            return
+        self._wait_full_image(self._render_full_resolution)
+
+    def _render_full_resolution(self):
+        """Ảnh đầy đủ đã sẵn sàng: render toàn bộ filter ở độ phân giải gốc"""
+        self._set_zoom(None, render=False)
+        self._apply_all_filters(full_res=True)
 
     def _on_reset_image(self):
         """Khôi phục ảnh về trạng thái gốc ban đầu"""
         if self.original_image is not None:
-            self.base_image = self.original_image.copy()
+            # base_image luôn giữ hướng gốc → proxy và cache từng bước vẫn dùng được
             self.is_grayscale = False
+            self.flipped_h = self.flipped_v = False
+            self.render_scheduler.cancel()
+            self._set_zoom(None, render=False)
             self._reset_sliders()
             self.display_image = self.original_image.copy()
             self._show_image(self.display_image)
+            self._update_histogram(self.display_image)
+            self._schedule_history_commit()  # Reset cũng hoàn tác được
 
     def _on_grayscale(self):
         """Bật/tắt chế độ ảnh trắng đen"""
@@ -390,18 +922,306 @@ class PhotoLabApp:
         self._apply_all_filters()
 
     def _on_flip_horizontal(self):
-        """Lật ảnh theo chiều ngang (trái ↔ phải)"""
+        """Lật ảnh theo chiều ngang (trái ↔ phải) - chỉ đổi hướng hiển thị, không render lại"""
         if self.base_image is None:
             return
-        self.base_image = ImageProcessor.flip_horizontal(self.base_image)
-        self._apply_all_filters()
+        self.flipped_h = not self.flipped_h
+        self._refresh_orientation()
 
     def _on_flip_vertical(self):
-        """Lật ảnh theo chiều dọc (trên ↔ dưới)"""
+        """Lật ảnh theo chiều dọc (trên ↔ dưới) - chỉ đổi hướng hiển thị, không render lại"""
+        if self.base_image is None:
+            return
+        self.flipped_v = not self.flipped_v
+        self._refresh_orientation()
+
+    def _refresh_orientation(self):
+        """Hiển thị lại theo hướng mới: vừa khung chỉ lật khung hình, khi phóng to thì vùng
+        nhìn đổi sang phía đối diện của ảnh nên ghép lại khung từ các ô (đã có trong cache)"""
+        if self.viewport.zoom is None:
+            self._show_image(self.display_image)
+        else:
+            self._request_viewport_frame()
+        self._schedule_history_commit()
+
+    # === LỊCH SỬ CHỈNH SỬA ===
+
+    def _schedule_history_commit(self):
+        """Hẹn ghi trạng thái hiện tại thành một bước lịch sử khi ngừng thao tác"""
+        self._cancel_history_commit()
+        self.history_after_id = self.root.after(HISTORY_COMMIT_MS, self._commit_history)
+
+    def _cancel_history_commit(self):
+        if self.history_after_id is not None:
+            self.root.after_cancel(self.history_after_id)
+            self.history_after_id = None
+
+    def _commit_history(self):
+        """Ghi trạng thái hiện tại thành một bước lịch sử (nếu khác bước trước) và checkpoint nó"""
+        self.history_after_id = None
+        if self.base_image is not None:
+            self.history.push(self._get_recipe())
+            self._checkpoint_history()
+
+    def _checkpoint_history(self):
+        """Giữ checkpoint cho bước lịch sử hiện tại từ lần render xem trước cuối (nếu khớp)"""
+        if self.last_render is None:
+            return
+        params, source_key, keys = self.last_render
+        state = self.history.current()
+        if (source_key == ('preview', self.source_version)
+                and all(state.get(name) == value for name, value in params.items())):
+            self.history.checkpoint(keys, self.stage_cache.peek)
+
+    def _apply_state(self, state):
+        """Đưa slider, chế độ làm mịn, cờ trắng đen và hướng ảnh về trạng thái state"""
+        self.scale_brightness.set(state['brightness'])
+        self.scale_contrast.set(state['contrast'])
+        self.scale_vibrance.set(state['vibrance'])
+        self.scale_saturation.set(state['saturation'])
+        self.scale_warmth.set(state['warmth'])
+        self.scale_skin_smooth.set(state['skin_smooth'])
+        self.smooth_method_var.set(state['smooth_method'])
+        self.scale_sharpen.set(state['sharpen'])
+        self.scale_blur.set(state['blur'])
+        self.scale_bokeh.set(state['bokeh'])
+        self.is_grayscale = state['grayscale']
+        self.flipped_h = state['flip_horizontal']
+        self.flipped_v = state['flip_vertical']
+
+    def _on_undo(self, event=None):
+        """Hoàn tác một bước (Ctrl+Z)"""
+        self._step_history(self.history.undo, "Hoàn tác")
+        return "break"
+
+    def _on_redo(self, event=None):
+        """Làm lại một bước đã hoàn tác (Ctrl+Y / Ctrl+Shift+Z)"""
+        self._step_history(self.history.redo, "Làm lại")
+        return "break"
+
+    def _step_history(self, step, label):
+        """
+        Chuyển sang trạng thái lịch sử khác và hiển thị nó
+        Có checkpoint của trạng thái → hiện ngay; không thì nạp kết quả sâu nhất trong chuỗi
+        filter đã có trong checkpoint vào cache từng bước rồi render lại từ bước sau nó
+        
+        Tham số:
+            step: self.history.undo hoặc self.history.redo
+            label: tên thao tác cho thanh trạng thái
+        """
         if self.base_image is None:
             return
-        self.base_image = ImageProcessor.flip_vertical(self.base_image)
+        if self.history_after_id is not None:
+            # Thao tác vừa làm chưa được ghi → ghi ngay để hoàn tác về trước nó
+            self._cancel_history_commit()
+            self._commit_history()
+        start = time.perf_counter()
+        state = step()
+        if state is None:
+            return
+        self._apply_state(state)
+        params = self._get_filter_params()
+        if self.preview_image is None:
+            self._apply_all_filters()
+            return
+        source_key = ('preview', self.source_version)
+        keys = Pipeline.from_recipe(params).compile(self.preview_scale).stage_keys(source_key)
+        index, array = self.history.restore(keys)
+        if keys and index == len(keys) - 1:
+            # Có sẵn kết quả: hiện ngay; render do slider đổi giá trị sẽ trúng cache
+            self.stage_cache.put(keys[-1], array)
+            self.render_scheduler.cancel()
+            self.preview_params = params
+            self.preview_result = (params, array)
+            self.last_render = (params, source_key, keys)
+            self._update_histogram(array)
+            if self.viewport.zoom is None:
+                self.display_image = array
+                self._show_image(array)
+            else:
+                self._request_viewport_frame()
+            elapsed = time.perf_counter() - start
+            self.undo_latency.record(elapsed)
+            self.lbl_status.config(
+                text=f"{label}: {elapsed * 1000:.0f} ms (checkpoint)"
+                     f"  ·  {self._history_status()}")
+            return
+        if index >= 0:
+            self.stage_cache.put(keys[index], array)
+        self.undo_pending = (start, params)
         self._apply_all_filters()
+        self.lbl_status.config(
+            text=f"{label}: render lại từ bước {index + 2}/{len(keys)}"
+                 f"  ·  {self._history_status()}")
+
+    def _history_status(self):
+        """Chuỗi tóm tắt vị trí và bộ nhớ của lịch sử cho thanh trạng thái"""
+        s = self.history.stats()
+        return (f"Lịch sử: bước {s['position']}/{s['steps']}, {s['checkpoints']} checkpoint "
+                f"{s['bytes'] / 2 ** 20:.0f}/{s['max_bytes'] / 2 ** 20:.0f} MB")
+
+    # === HISTOGRAM ===
+
+    def _update_histogram(self, image):
+        """Gửi ảnh xem trước vừa hiển thị sang luồng histogram (bản mới nhất thắng)"""
+        if image is None or image is self.histogram_source:
+            return
+        self.histogram_source = image
+        self.histogram_scheduler.submit(image)
+
+    def _compute_histogram(self, image, cancel_check=None):
+        """Chạy trên luồng histogram: tính histogram trong ngân sách (xem HistogramMeter)"""
+        return self.histogram.compute(image)
+
+    def _on_histogram_done(self, hist):
+        """Nhận histogram (luồng Tk): cập nhật tọa độ các đường vẽ và nhãn vùng bị cắt"""
+        start = time.perf_counter()
+        width, height = HISTOGRAM_SIZE
+        bins = hist['bins']
+        # Chuẩn hóa theo đỉnh cao nhất trừ hai mức 0/255 (vùng bị cắt thường là cột rất cao)
+        peak = max(float(values[1:255].max()) for values in bins.values()) or 1.0
+        xs = np.linspace(0, width, 256)
+        for name, item in self.histogram_items.items():
+            ys = height - np.minimum(bins[name] * (height / peak), height)
+            coords = np.column_stack((xs, ys)).ravel().tolist()
+            if name == 'luma':
+                coords += [width, height, 0, height]
+            self.histogram_canvas.coords(item, coords)
+        shadows = max(hist['shadows'][name] for name in ('r', 'g', 'b'))
+        highlights = max(hist['highlights'][name] for name in ('r', 'g', 'b'))
+        clipped = max(shadows, highlights) >= CLIP_WARN_FRACTION
+        self.lbl_clipping.config(
+            text=f"Cắt tối: {shadows * 100:.1f}%  ·  Cắt sáng: {highlights * 100:.1f}%",
+            fg=COLORS['accent_danger'] if clipped else COLORS['text_secondary'])
+        self.histogram_draw_latency.record(time.perf_counter() - start)
+        draw = self.histogram_draw_latency.summary()
+        self.lbl_histogram_cost.config(
+            text=f"{self.histogram.format_ms()}\n"
+                 f"Vẽ (luồng giao diện): {draw['last'] * 1000:.1f} ms (p95 {draw['p95'] * 1000:.1f})")
+
+    # === THU PHÓNG / KÉO ẢNH ===
+
+    def _image_size(self):
+        """Kích thước ảnh gốc (rộng, cao) - base_image có thể là ảnh đọc thu nhỏ"""
+        h, w = self.base_image.shape[:2]
+        return w / self.base_scale, h / self.base_scale
+
+    def _fit_zoom(self):
+        """Mức thu phóng của chế độ vừa khung (ảnh nhỏ hơn khung thì giữ 100%)"""
+        w, h = self._image_size()
+        view_w, view_h = self._get_display_size()
+        return min(view_w / w, view_h / h, 1.0)
+
+    def _set_zoom(self, zoom, anchor=None, render=True):
+        """
+        Đổi mức thu phóng
+        
+        Tham số:
+            zoom: mức mới (điểm ảnh màn hình / điểm ảnh gốc), None = vừa khung
+            anchor: vị trí con trỏ trên ảnh đang hiển thị, giữ nguyên điểm ảnh dưới con trỏ
+            render: False khi nơi gọi sẽ tự render lại
+        """
+        if self.base_image is None:
+            return
+        if zoom is None:
+            self.viewport.reset()
+            self.viewport_scheduler.cancel()
+            if render:
+                self._apply_all_filters()
+            return
+        self.viewport.zoom_at(zoom, anchor, self._image_size(), self._get_display_size(),
+                              fit_zoom=self._fit_zoom())
+        if render:
+            self._request_viewport_frame()
+
+    def _on_zoom_wheel(self, event):
+        """Cuộn chuột trên ảnh: phóng to/thu nhỏ tại vị trí con trỏ"""
+        if self.base_image is not None:
+            direction = 1 if event.num == 4 or getattr(event, 'delta', 0) > 0 else -1
+            zoom = next_zoom_level(self.viewport.zoom, self._fit_zoom(), direction)
+            anchor = (event.x, event.y) if event.widget is self.lbl_image else None
+            if zoom != self.viewport.zoom:
+                self._set_zoom(zoom, anchor)
+        return "break"  # Không cuộn panel điều khiển bên trái
+
+    def _on_toggle_zoom(self, event):
+        """Nhấp đúp: vừa khung ↔ 100% tại vị trí con trỏ"""
+        anchor = (event.x, event.y) if event.widget is self.lbl_image else None
+        self._set_zoom(1.0 if self.viewport.zoom is None else None, anchor)
+
+    def _on_pan_start(self, event):
+        """Bắt đầu kéo ảnh (chỉ khi đang phóng to)"""
+        self.pan_anchor = (event.x_root, event.y_root) if self.viewport.zoom is not None else None
+
+    def _on_pan_move(self, event):
+        """Kéo ảnh: dời khung nhìn, chỉ các ô mới lộ ra phải render"""
+        if self.pan_anchor is None or self.base_image is None:
+            return
+        dx, dy = event.x_root - self.pan_anchor[0], event.y_root - self.pan_anchor[1]
+        self.pan_anchor = (event.x_root, event.y_root)
+        self.viewport.pan(dx, dy, self._image_size(), self._get_display_size())
+        self._request_viewport_frame()
+
+    def _on_pan_end(self, event):
+        """Kết thúc kéo ảnh"""
+        self.pan_anchor = None
+
+    def _request_viewport_frame(self):
+        """Gửi yêu cầu render khung nhìn hiện tại sang luồng render khung nhìn"""
+        view_size = self._get_display_size()
+        rect = self.viewport.rect(self._image_size(), view_size)
+        # Khóa ảnh nguồn của ô: đổi khi mở ảnh khác hoặc thay ảnh thu nhỏ bằng ảnh đầy đủ
+        source_key = ('base', self.load_token, self.base_scale)
+        params = self._get_filter_params()
+        fallback = None
+        if self.preview_result is not None and self.preview_result[0] == params:
+            fallback = self.preview_result[1]
+        self.viewport_scheduler.submit(self.base_image, source_key, self.base_scale,
+                                       params, self.viewport.zoom, rect,
+                                       self.flipped_h, self.flipped_v, view_size, fallback)
+
+    def _post_tile_ready(self):
+        """Chạy trên luồng render ô: một ô render nền đã xong → ghép lại khung (luồng Tk)"""
+        try:
+            self.root.after(0, self._on_tile_ready)
+        except RuntimeError:
+            pass  # Cửa sổ Tk đã đóng
+
+    def _on_tile_ready(self):
+        """Thay ảnh tạm bằng ô vừa render (các yêu cầu dồn dập được gộp lại, bản mới nhất thắng)"""
+        if self.viewport.zoom is not None and self.base_image is not None:
+            self._request_viewport_frame()
+
+    def _render_viewport(self, image, source_key, base_scale, params, zoom, rect,
+                         flip_h, flip_v, view_size, fallback, cancel_check=None):
+        """
+        Chạy trên luồng nền: ghép khung nhìn từ các ô (xem viewport.render_viewport)
+        
+        Trả về:
+            numpy array khung hình (hướng gốc, lật khi hiển thị) không lớn hơn khung hiển thị
+        """
+        frame = render_viewport(self.tile_renderer, image, source_key, base_scale,
+                                lambda scale: Pipeline.from_recipe(params).compile(scale),
+                                zoom, rect, flip_h, flip_v, cancel_check, fallback)
+        # Làm tròn mép ô có thể dư 1 pixel: cắt bớt để hiển thị đúng 1:1, không resize lại
+        return frame[:view_size[1], :view_size[0]]
+
+    def _on_viewport_done(self, frame):
+        """Nhận khung nhìn đã render (luồng Tk): hiển thị và báo thời gian khung hình"""
+        if self.viewport.zoom is None:
+            return  # Đã về chế độ vừa khung trong lúc render
+        self.display_image = frame
+        self._show_image(frame)
+        renderer = self.tile_renderer
+        pending = renderer.pending()
+        self.lbl_status.config(
+            text=f"Zoom {self.viewport.zoom * 100:.0f}%"
+                 f"  ·  {self.viewport_scheduler.latency.format_ms('Khung hình')}"
+                 f"  ·  Ô: {renderer.tiles_cached} cache"
+                 + (f", đang render {pending}" if pending else ""))
+        if PROFILER.enabled:
+            self.lbl_profile.config(text=PROFILER.format_summary())
+            self.lbl_profile.lift()
 
     # === CÁC HÀM HỖ TRỢ ===
     
@@ -427,64 +1247,154 @@ class PhotoLabApp:
         self.scale_bokeh.set(0)
         self.scale_warmth.set(5)
 
-    def _apply_all_filters(self):
+    def _get_filter_params(self):
+        """Đọc giá trị hiện tại của tất cả slider và cờ trắng đen"""
+        return {
+            'brightness': self.scale_brightness.get(),
+            'contrast': self.scale_contrast.get(),
+            'vibrance': self.scale_vibrance.get(),
+            'saturation': self.scale_saturation.get(),
+            'warmth': self.scale_warmth.get(),
+            'skin_smooth': self.scale_skin_smooth.get(),
+            'smooth_method': self.smooth_method_var.get(),
+            'sharpen': self.scale_sharpen.get(),
+            'blur': self.scale_blur.get(),
+            'bokeh': self.scale_bokeh.get(),
+            'grayscale': self.is_grayscale,
+        }
+
+    def _get_recipe(self):
+        """Thông số filter + hướng ảnh (lật ở cuối chuỗi, xem Pipeline.compile) để lưu/xuất"""
+        return dict(self._get_filter_params(),
+                    flip_horizontal=self.flipped_h, flip_vertical=self.flipped_v)
+
+    def _apply_all_filters(self, full_res=False):
         """
-        Áp dụng tất cả các bộ lọc lên base_image theo thứ tự:
-        1. Độ sáng & Tương phản
-        2. Điều chỉnh tone màu da
-        3. Làm mịn da (Skin Smoothing)
-        4. Làm nét (Sharpen)
-        5. Làm mờ (Blur)
-        6. Xóa phông (Bokeh)
-        7. Trắng đen (Grayscale)
+        Gửi yêu cầu áp dụng tất cả các bộ lọc sang luồng render nền
+        Kết quả được hiển thị qua _on_render_done khi render xong
+        
+        Tham số:
+            full_res: True để render trên ảnh gốc, False để render trên proxy xem trước
         """
         if self.base_image is None:
             return
+        if full_res or self.preview_image is None:
+            source, scale, kind = self.base_image, self.base_scale, 'full'
+        else:
+            source, scale, kind = self.preview_image, self.preview_scale, 'preview'
         
-        result = self.base_image.copy()
-        
-        # 1. Áp dụng độ sáng và tương phản
-        b = self.scale_brightness.get()
-        c = self.scale_contrast.get()
-        result = ImageProcessor.apply_brightness_contrast(result, b, c)
-        # 1.5. Áp dụng vibrance & saturation cho phong cảnh
-        vibrance = self.scale_vibrance.get()
-        saturation = self.scale_saturation.get()
-        if vibrance != 0 or saturation != 0:
-            result = ImageProcessor.apply_vibrance_saturation(result, vibrance, saturation)
-        
-        # 2. Điều chỉnh tone màu da
-        warmth = self.scale_warmth.get()
-        if warmth != 0:
-            result = ImageProcessor.apply_skin_tone_correction(result, warmth)
-        
-        # 3. Áp dụng làm mịn da nếu giá trị > 0
-        skin_smooth = self.scale_skin_smooth.get()
-        if skin_smooth > 0:
-            result = ImageProcessor.apply_skin_smoothing(result, skin_smooth)
-        
-        # 4. Áp dụng làm nét nếu giá trị > 0
-        sharpen = self.scale_sharpen.get()
-        if sharpen > 0:
-            result = ImageProcessor.apply_sharpen(result, sharpen)
-        
-        # 5. Áp dụng làm mờ nếu giá trị > 0
-        blur = self.scale_blur.get()
-        if blur > 0:
-            kernel_size = blur * 2 + 1  # Đảm bảo kernel size là số lẻ
-            result = ImageProcessor.apply_blur(result, kernel_size)
+        # Chụp lại thông số ngay trên luồng Tk (worker không được đọc widget)
+        self.preview_params = self._get_filter_params()
+        self.render_scheduler.submit(source, self.preview_params, scale,
+                                     (kind, self.source_version))
+        if not full_res:
+            self._schedule_history_commit()
+        if self.viewport.zoom is not None and not full_res:
+            # Đang phóng to: ảnh xem trước chỉ làm ảnh tạm, khung nhìn render các ô của nó
+            self._request_viewport_frame()
+
+    def _on_render_done(self, result):
+        """Nhận ảnh đã render từ luồng nền (chạy trên luồng Tk) và hiển thị"""
+        self.preview_result = (self.preview_params, result)
+        self._note_render(result)
+        self._update_histogram(result)
+        if self.viewport.zoom is not None:
+            return  # Đã chuyển sang phóng to: khung hình do luồng khung nhìn hiển thị
+        self.display_image = result
+        self._show_image(result)
+        if self.undo_pending is not None and self.undo_pending[1] == self.preview_params:
+            self.undo_latency.record(time.perf_counter() - self.undo_pending[0])
+            self.undo_pending = None
+            self.lbl_status.config(
+                text=f"{self.undo_latency.format_ms('Hoàn tác')}  ·  {self._history_status()}")
+        else:
+            cache = self.stage_cache.stats()
+            self.lbl_status.config(
+                text=f"{self.render_scheduler.latency.format_ms('Độ trễ xem trước')}"
+                     f"  ·  Cache: {cache['hits']} hit / {cache['misses']} miss")
+        if PROFILER.enabled:
+            self.lbl_profile.config(text=PROFILER.format_summary())
+            self.lbl_profile.lift()
+
+    def _on_render_error(self, error):
+        """Lỗi ở luồng render nền (luồng Tk): báo trên thanh trạng thái, giữ nguyên ảnh đang hiển thị"""
+        self.lbl_status.config(text=f"Lỗi xử lý ảnh: {str(error) or type(error).__name__}")
+
+    def _note_render(self, result):
+        """
+        Ghi lại kế hoạch của lần render vừa hiển thị (thời gian từng bước, khóa cache) để
+        chọn checkpoint cho lịch sử; giữ checkpoint ngay nếu bước lịch sử hiện tại đã được ghi
+        """
+        rendered = self.rendered_plan
+        if rendered is None or rendered[0] is not result:
+            return  # Luồng nền đã nhận yêu cầu mới hơn
+        _, params, source_key, compiled = rendered
+        keys = compiled.stage_keys(source_key)
+        self.history.record_costs(keys, compiled.last_timings)
+        self.last_render = (params, source_key, keys)
+        if self.history_after_id is None:
+            self._checkpoint_history()
+
+    def _render(self, image, params, scale=1.0, source_key=None, cancel_check=None):
+        """
+        Áp dụng tất cả các bộ lọc lên ảnh (xem Pipeline.from_recipe)
+        Kết quả từng bước được lưu trong stage_cache: chỉ bước có tham số thay đổi
+        và các bước phía sau nó được tính lại
         
-        # 6. Áp dụng xóa phông nếu giá trị > 0
-        bokeh = self.scale_bokeh.get()
-        if bokeh > 0:
-            result = ImageProcessor.apply_bokeh_effect(result, bokeh)
+        Tham số:
+            image: ảnh nguồn (ảnh gốc hoặc proxy)
+            params: dict giá trị các slider (xem _get_filter_params)
+            scale: tỷ lệ ảnh nguồn so với ảnh gốc, dùng để thu nhỏ các kernel
+            source_key: khóa định danh ảnh nguồn cho cache (None = không dùng cache)
+            cancel_check: hàm gọi giữa các bước, ném RenderCancelled nếu kết quả đã cũ
+            
+        Trả về:
+            numpy array ảnh đã xử lý
+        """
+        compiled = Pipeline.from_recipe(params).compile(scale)
+        result = compiled.run(image, cache=self.stage_cache, source_key=source_key,
+                              executor=self.tiled_executor, cancel_check=cancel_check)
+        self.rendered_plan = (result, params, source_key, compiled)
+        return result
+
+    def _get_display_size(self):
+        """Lấy kích thước tối đa (max_w, max_h) để hiển thị ảnh trong khung"""
+        # Lấy kích thước container thực tế (trừ padding); sau sự kiện <Configure> đầu tiên
+        # dùng kích thước của sự kiện, không phải gọi update_idletasks mỗi lần
+        if self.container_size is None:
+            self.image_container.update_idletasks()
+            container_w = self.image_container.winfo_width() - 40
+            container_h = self.image_container.winfo_height() - 40
+        else:
+            container_w = self.container_size[0] - 40
+            container_h = self.container_size[1] - 40
         
-        # 7. Chuyển sang trắng đen nếu được bật
-        if self.is_grayscale:
-            result = ImageProcessor.to_grayscale(result)
+        # Đảm bảo kích thước tối thiểu
+        return max(400, container_w), max(300, container_h)
+
+    def _update_preview_proxy(self, force=False):
+        """
+        Tạo lại ảnh proxy xem trước từ base_image theo kích thước khung hiển thị
         
-        self.display_image = result
-        self._show_image(result)
+        Tham số:
+            force: True để luôn tạo lại (khi base_image thay đổi, vd: lật ảnh)
+            
+        Trả về:
+            True nếu proxy đã được tạo lại
+        """
+        if self.base_image is None:
+            return False
+        size = self._get_display_size()
+        if not force and size == self.preview_size and self.preview_image is not None:
+            return False
+        self.preview_size = size
+        self.source_version += 1
+        self.history.drop_checkpoints()  # Khóa theo ảnh proxy cũ
+        self.preview_image, self.preview_scale = create_preview_proxy(
+            self.base_image, max_width=size[0], max_height=size[1], pyramid=self.base_pyramid)
+        # Kernel tính theo pixel ảnh gốc: proxy của ảnh đọc thu nhỏ còn nhỏ hơn thêm base_scale
+        self.preview_scale *= self.base_scale
+        return True
 
     def _show_image(self, img_array):
         """
@@ -493,27 +1403,75 @@ class PhotoLabApp:
         """
         if img_array is None:
             return
+        start = time.perf_counter()
+        max_width, max_height = self._get_display_size()
         
-        # Lấy kích thước container thực tế (trừ padding)
-        self.image_container.update_idletasks()
-        container_w = self.image_container.winfo_width() - 40
-        container_h = self.image_container.winfo_height() - 40
+        # Thu nhỏ vừa khung từ mức gần nhất của pyramid (INTER_AREA)
+        self.display_pyramid.set_image(img_array)
+        img_array = self.display_pyramid.fit(max_width, max_height)
+        # Hướng ảnh áp dụng sau cùng trên khung hình nhỏ (view, không sao chép)
+        img_array = ImageProcessor.orient(img_array, self.flipped_h, self.flipped_v)
         
-        # Đảm bảo kích thước tối thiểu
-        max_width = max(400, container_w)
-        max_height = max(300, container_h)
-        
-        # Resize để vừa khung
-        img_array = resize_image_to_fit(img_array, max_width=max_width, max_height=max_height)
-        
-        # Chuyển sang format Tkinter
+        # Chuyển sang format Tkinter; cùng kích thước thì chép vào PhotoImage đang hiển thị
         img_pil = Image.fromarray(img_array)
-        img_tk = ImageTk.PhotoImage(img_pil)
-        
-        self.lbl_image.config(image=img_tk, text="", bg=COLORS['bg_card'])
-        self.lbl_image.image = img_tk
+        photo = self.photo_image
+        if photo is not None and (photo.width(), photo.height()) == img_pil.size:
+            photo.paste(img_pil)
+        else:
+            self.photo_image = ImageTk.PhotoImage(img_pil)
+            self.lbl_image.config(image=self.photo_image, text="", bg=COLORS['bg_card'])
+            self.lbl_image.image = self.photo_image
+        self.frames_shown += 1
+        self.display_latency.record(time.perf_counter() - start)
     
     def _on_window_resize(self, event=None):
-        """Xử lý khi cửa sổ thay đổi kích thước - cập nhật lại ảnh"""
-        if self.display_image is not None:
+        """
+        Xử lý sự kiện <Configure> của khung ảnh (bắn liên tục khi kéo cửa sổ)
+        Vẽ lại ngay ảnh đang hiển thị (gộp các sự kiện dồn dập thành một lần vẽ),
+        việc tốn kém - tạo lại proxy, render lại - chỉ chạy khi đã ngừng kéo
+        """
+        if event is not None:
+            size = (event.width, event.height)
+            if size == self.container_size:
+                return  # Chỉ di chuyển, không đổi kích thước
+            self.container_size = size
+        if self.resize_started is None:
+            self.resize_started = (time.perf_counter(), self.frames_shown)
+        if not self.redraw_pending and self.display_image is not None:
+            self.redraw_pending = True
+            self.root.after_idle(self._redraw_on_resize)
+        if self.resize_after_id is not None:
+            self.root.after_cancel(self.resize_after_id)
+        self.resize_after_id = self.root.after(RESIZE_DEBOUNCE_MS, self._on_resize_settled)
+
+    def _redraw_on_resize(self):
+        """Vẽ lại ảnh đang hiển thị theo kích thước khung mới (trong lúc kéo cửa sổ)"""
+        self.redraw_pending = False
+        if self.viewport.zoom is None and self.display_image is not None:
+            self._show_image(self.display_image)
+
+    def _on_resize_settled(self):
+        """Đã ngừng kéo cửa sổ: báo số khung/giây khi kéo, tạo lại proxy và render lại"""
+        self.resize_after_id = None
+        if self.resize_started is not None:
+            started, frames = self.resize_started
+            self.resize_started = None
+            # Không tính khoảng chờ debounce cuối cùng
+            elapsed = time.perf_counter() - started - RESIZE_DEBOUNCE_MS / 1000
+            frames = self.frames_shown - frames
+            if frames > 1 and elapsed > 0:
+                self.lbl_status.config(
+                    text=f"Kéo cửa sổ: {frames / elapsed:.0f} khung/s  ·  "
+                         f"{self.display_latency.format_ms('Vẽ khung')}")
+        if self.base_image is None:
+            return
+        if self.viewport.zoom is not None:
+            # Đang phóng to: khung nhìn rộng/hẹp hơn → ghép lại khung từ các ô
+            self.viewport.clamp(self._image_size(), self._get_display_size())
+            self._request_viewport_frame()
+            return
+        # Khung đổi kích thước → tạo lại proxy cho khớp và render lại bản xem trước
+        if self._update_preview_proxy():
+            self._apply_all_filters()
+        elif self.display_image is not None:
             self._show_image(self.display_image)
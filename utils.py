@@ -1,10 +1,17 @@
 """
 utils.py - Các hàm tiện ích cho PhotoLab
-Bao gồm: mở/lưu file ảnh, resize ảnh
+Bao gồm: mở/lưu file ảnh, tùy chọn xuất ảnh, lưu công thức chỉnh ảnh, resize ảnh,
+tạo ảnh proxy xem trước
 """
+import json
+import tkinter as tk
+
 import cv2
+from PIL import Image
 from tkinter import filedialog, messagebox
 
+from processing import TIFF_COMPRESSION_CODES
+
 
 # Danh sách định dạng ảnh được hỗ trợ
 IMAGE_FILETYPES = [
@@ -15,6 +22,29 @@ IMAGE_FILETYPES = [
     ("Tất cả file", "*.*")
 ]
 
+# Định dạng ảnh khi lưu (tùy chọn encoder của từng định dạng: xem export_options_dialog)
+SAVE_FILETYPES = [
+    ("JPEG", "*.jpg"),
+    ("PNG", "*.png"),
+    ("WebP", "*.webp"),
+    ("TIFF", "*.tif"),
+    ("BMP", "*.bmp")
+]
+
+
+def read_image_size(file_path):
+    """
+    Đọc kích thước ảnh từ header file mà không giải mã dữ liệu ảnh
+    
+    Trả về:
+        (rộng, cao), hoặc None nếu không đọc được
+    """
+    try:
+        with Image.open(file_path) as img:
+            return img.size
+    except OSError:
+        return None
+
 
 def load_image_dialog():
     """
@@ -30,39 +60,154 @@ def load_image_dialog():
     return file_path if file_path else None
 
 
-def save_image_dialog(image):
+def save_image_dialog(has_image=True):
     """
-    Mở dialog để lưu ảnh ra file
+    Mở dialog chọn nơi lưu ảnh
+    Việc render độ phân giải gốc và mã hóa chạy trên luồng nền (xem PhotoLabApp._on_save_image)
     
     Tham số:
-        image: numpy array định dạng RGB
+        has_image: False nếu chưa mở ảnh (chỉ hiện cảnh báo)
         
     Trả về:
-        True nếu lưu thành công, False nếu hủy hoặc lỗi
+        Đường dẫn file nếu chọn, None nếu hủy hoặc không có ảnh
     """
-    if image is None:
+    if not has_image:
         messagebox.showwarning("Cảnh báo", "Không có ảnh để lưu!")
-        return False
+        return None
     
     file_path = filedialog.asksaveasfilename(
         title="Lưu ảnh",
         defaultextension=".jpg",
-        filetypes=[
-            ("JPEG", "*.jpg"),
-            ("PNG", "*.png"),
-            ("BMP", "*.bmp")
-        ]
+        filetypes=SAVE_FILETYPES
+    )
+    return file_path if file_path else None
+
+
+def show_save_result(file_path, error=None):
+    """Thông báo kết quả lưu ảnh (gọi trên luồng Tk sau khi luồng lưu ảnh xong)"""
+    if error:
+        messagebox.showerror("Lỗi", f"Không lưu được ảnh!\n{file_path}\n{error}")
+    else:
+        messagebox.showinfo("Thành công", "Đã lưu ảnh!")
+
+
+def show_full_image_error(file_path):
+    """Báo không đọc được ảnh đầy đủ: không lưu/render bản thu nhỏ thay cho ảnh gốc"""
+    messagebox.showerror("Lỗi", f"Không đọc được ảnh ở độ phân giải đầy đủ!\n{file_path}\n"
+                                "Ảnh đang chỉnh chỉ là bản thu nhỏ - hãy mở lại ảnh để lưu.")
+
+
+def export_options_dialog(parent, options):
+    """
+    Mở hộp thoại chỉnh tùy chọn encoder khi lưu ảnh (chờ đến khi đóng)
+    
+    Tham số:
+        parent: cửa sổ Tk cha
+        options: dict tùy chọn hiện tại (xem processing.DEFAULT_ENCODE_OPTIONS)
+        
+    Trả về:
+        dict tùy chọn mới nếu nhấn "Lưu", None nếu hủy
+    """
+    dialog = tk.Toplevel(parent)
+    dialog.title("Tùy chọn xuất ảnh")
+    dialog.resizable(False, False)
+    dialog.transient(parent)
+    
+    quality = tk.IntVar(value=options['quality'])
+    progressive = tk.BooleanVar(value=options['progressive'])
+    optimize = tk.BooleanVar(value=options['optimize'])
+    png_compression = tk.IntVar(value=options['png_compression'])
+    webp_lossless = tk.BooleanVar(value=options['webp_lossless'])
+    tiff_compression = tk.StringVar(value=options['tiff_compression'])
+    
+    def section(text):
+        tk.Label(dialog, text=text, font=("Segoe UI", 10, "bold")).pack(
+            anchor="w", padx=12, pady=(10, 2))
+    
+    section("JPEG / WebP")
+    tk.Scale(dialog, label="Chất lượng", variable=quality, from_=1, to=100,
+             orient=tk.HORIZONTAL, length=260).pack(padx=12, anchor="w")
+    tk.Checkbutton(dialog, text="JPEG progressive", variable=progressive).pack(padx=12, anchor="w")
+    tk.Checkbutton(dialog, text="JPEG tối ưu Huffman (file nhỏ hơn, lưu chậm hơn)",
+                   variable=optimize).pack(padx=12, anchor="w")
+    tk.Checkbutton(dialog, text="WebP không mất dữ liệu (lưu rất chậm)",
+                   variable=webp_lossless).pack(padx=12, anchor="w")
+    
+    section("PNG")
+    tk.Scale(dialog, label="Mức nén (0 = nhanh nhất, 9 = file nhỏ nhất)",
+             variable=png_compression, from_=0, to=9,
+             orient=tk.HORIZONTAL, length=260).pack(padx=12, anchor="w")
+    
+    section("TIFF")
+    tk.OptionMenu(dialog, tiff_compression, *TIFF_COMPRESSION_CODES).pack(padx=12, anchor="w")
+    
+    result = {}
+    
+    def on_ok():
+        result.update(options, quality=quality.get(), progressive=progressive.get(),
+                      optimize=optimize.get(), png_compression=png_compression.get(),
+                      webp_lossless=webp_lossless.get(), tiff_compression=tiff_compression.get())
+        dialog.destroy()
+    
+    buttons = tk.Frame(dialog)
+    buttons.pack(fill=tk.X, padx=12, pady=12)
+    tk.Button(buttons, text="Hủy", command=dialog.destroy).pack(side=tk.RIGHT)
+    tk.Button(buttons, text="Lưu", command=on_ok).pack(side=tk.RIGHT, padx=(0, 8))
+    
+    dialog.grab_set()
+    parent.wait_window(dialog)
+    return result or None
+
+
+def save_recipe_dialog(recipe):
+    """
+    Mở dialog để lưu công thức chỉnh ảnh (thông số slider + lật ảnh) ra file JSON
+    Dùng với lệnh `python -m photolab batch` để áp dụng cho nhiều ảnh
+    
+    Tham số:
+        recipe: dict công thức (xem processing.DEFAULT_RECIPE)
+        
+    Trả về:
+        True nếu lưu thành công, False nếu hủy
+    """
+    file_path = filedialog.asksaveasfilename(
+        title="Lưu công thức",
+        defaultextension=".json",
+        filetypes=[("Công thức PhotoLab", "*.json")]
     )
     
     if file_path:
-        # OpenCV yêu cầu định dạng BGR khi lưu
-        if len(image.shape) == 2:  # Ảnh grayscale
-            save_img = image
-        else:
-            save_img = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+        with open(file_path, 'w', encoding='utf-8') as f:
+            json.dump(recipe, f, ensure_ascii=False, indent=2)
+        messagebox.showinfo("Thành công", "Đã lưu công thức!")
+        return True
+    
+    return False
+
+
+def save_trace_dialog(profiler):
+    """
+    Mở dialog để xuất các sự kiện profiling ra file Chrome trace / Perfetto JSON
+    
+    Tham số:
+        profiler: profiling.Profiler chứa các sự kiện đã ghi
         
-        cv2.imwrite(file_path, save_img)
-        messagebox.showinfo("Thành công", "Đã lưu ảnh!")
+    Trả về:
+        True nếu lưu thành công, False nếu hủy hoặc chưa có sự kiện
+    """
+    if not profiler.events():
+        messagebox.showwarning("Cảnh báo", "Chưa có dữ liệu profiling! Hãy bật Profiling trước.")
+        return False
+    
+    file_path = filedialog.asksaveasfilename(
+        title="Xuất trace",
+        defaultextension=".json",
+        filetypes=[("Chrome trace / Perfetto", "*.json")]
+    )
+    
+    if file_path:
+        count = profiler.export_chrome_trace(file_path)
+        messagebox.showinfo("Thành công", f"Đã xuất {count} sự kiện!\nMở bằng ui.perfetto.dev")
         return True
     
     return False
@@ -97,3 +242,97 @@ def resize_image_to_fit(image, max_width=800, max_height=600):
         return cv2.resize(image, (new_w, new_h)) # Với nội suy mặc định (bilinear)
     
     return image
+
+
+def fit_size(width, height, max_width, max_height):
+    """
+    Kích thước ảnh sau khi thu nhỏ vừa khung, giữ nguyên tỷ lệ (không phóng to)
+    
+    Trả về:
+        (rộng, cao) mới
+    """
+    ratio = min(max_width / width, max_height / height, 1.0)
+    if ratio < 1:
+        return max(1, int(width * ratio)), max(1, int(height * ratio))
+    return width, height
+
+
+class DisplayPyramid:
+    """
+    Mip pyramid của ảnh đang hiển thị: mỗi mức nhỏ đi một nửa (INTER_AREA), tính khi cần
+    Thu nhỏ về kích thước bất kỳ bắt đầu (bilinear) từ mức nhỏ nhất vẫn còn lớn hơn kích thước đó nên
+    kéo cửa sổ không phải thu nhỏ lại từ ảnh độ phân giải đầy đủ mỗi lần
+    """
+    
+    def __init__(self):
+        self.image = None      # Ảnh gốc của pyramid (mức 0)
+        self.levels = []       # levels[k] = ảnh thu nhỏ 2^k lần
+    
+    def set_image(self, image):
+        """Đổi ảnh nguồn (bỏ các mức cũ nếu là ảnh khác)"""
+        if image is not self.image:
+            self.image = image
+            self.levels = [] if image is None else [image]
+    
+    def resize(self, width, height, interpolation=cv2.INTER_LINEAR):
+        """
+        Ảnh nguồn thu nhỏ về đúng (width, height)
+        
+        Tham số:
+            interpolation: nội suy của bước cuối (từ mức pyramid gần nhất về đúng kích thước);
+                           mức đã chọn lớn hơn đích chưa tới 2 lần nên bilinear đủ mịn và
+                           nhanh hơn INTER_AREA với tỷ lệ lẻ khoảng 5 lần
+        
+        Trả về:
+            numpy array (chính ảnh nguồn hoặc một mức nếu đã đúng kích thước)
+        """
+        k = 0
+        level = self.levels[0]
+        while level.shape[1] // 2 >= width and level.shape[0] // 2 >= height:
+            k += 1
+            if k == len(self.levels):
+                half = (level.shape[1] // 2, level.shape[0] // 2)
+                self.levels.append(cv2.resize(level, half, interpolation=cv2.INTER_AREA))
+            level = self.levels[k]
+        if level.shape[1] == width and level.shape[0] == height:
+            return level
+        return cv2.resize(level, (width, height), interpolation=interpolation)
+    
+    def fit(self, max_width, max_height):
+        """Ảnh nguồn thu nhỏ vừa khung (như resize_image_to_fit nhưng bắt đầu từ mức pyramid)"""
+        if self.image is None:
+            return None
+        h, w = self.image.shape[:2]
+        return self.resize(*fit_size(w, h, max_width, max_height))
+
+
+def create_preview_proxy(image, max_width=800, max_height=600, pyramid=None):
+    """
+    Tạo ảnh proxy thu nhỏ vừa khung hiển thị để xem trước khi kéo slider
+    Dùng nội suy INTER_AREA cho chất lượng thu nhỏ tốt (tránh răng cưa)
+    
+    Tham số:
+        image: numpy array ảnh gốc (độ phân giải đầy đủ)
+        max_width: chiều rộng tối đa của khung hiển thị
+        max_height: chiều cao tối đa của khung hiển thị
+        pyramid: DisplayPyramid của image (None = thu nhỏ trực tiếp từ image); dùng khi
+                 proxy được tạo lại nhiều lần (đổi kích thước cửa sổ)
+        
+    Trả về:
+        (proxy, scale): ảnh proxy và tỷ lệ proxy / ảnh gốc (1.0 nếu ảnh đã đủ nhỏ)
+    """
+    if image is None:
+        return None, 1.0
+    
+    h, w = image.shape[:2]
+    new_w, new_h = fit_size(w, h, max_width, max_height)
+    
+    if (new_w, new_h) != (w, h):
+        if pyramid is not None:
+            pyramid.set_image(image)
+            proxy = pyramid.resize(new_w, new_h, interpolation=cv2.INTER_AREA)
+        else:
+            proxy = cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_AREA)
+        return proxy, new_w / w
+    
+    return image, 1.0
@@ -0,0 +1,399 @@
+"""
+viewport.py - Thu phóng và kéo ảnh (zoom/pan) cho khung hiển thị PhotoLab
+Khi phóng to, chỉ các ô (tile) giao với khung nhìn được render ở mức thu phóng hiện tại:
+mỗi ô được tính từ vùng cắt có halo bằng tổng vùng ảnh hưởng của các bước filter nên kết quả
+trùng khớp từng bit với render cả ảnh rồi cắt ra. Ô đã render được lưu trong cache theo
+(ảnh nguồn, mức thu phóng, thông số từng bước) - kéo ảnh chỉ render các ô mới lộ ra
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from cache import StageCache
+from processing import BUFFER_POOL
+from profiling import PROFILER
+from tiling import default_workers
+
+
+# Kích thước một ô (pixel ở mức đang render)
+TILE_SIZE = 512
+# Giới hạn bộ nhớ cache ô đã render (ô RGB 512x512 = 768 KB)
+DEFAULT_TILE_CACHE_BYTES = 256 * 1024 * 1024
+# Hai mép vùng cắt theo chiều ngang làm tròn ra bội số này: một số hàm OpenCV (cvtColor HSV)
+# xử lý từng khối SIMD tính từ đầu hàng, phần lẻ cuối hàng làm tròn khác đi ±1 - cắt lệch
+# khối thì kết quả lệch so với render cả ảnh, và phần lệch ở mép phải có thể rộng hơn halo
+# (chia dải ngang không gặp vì luôn lấy cả hàng)
+COLUMN_ALIGN = 64
+# Mục tiêu thời gian một khung hình khi kéo ảnh ở 100% (đo bằng `benchmark.py viewport`)
+PAN_FRAME_TARGET_MS = 50
+# Các mức thu phóng (điểm ảnh màn hình / điểm ảnh ảnh gốc); dưới mức vừa khung dùng chế độ "vừa khung"
+ZOOM_LEVELS = (0.125, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0)
+
+
+def next_zoom_level(zoom, fit_zoom, direction):
+    """
+    Mức thu phóng kế tiếp khi cuộn chuột / bấm nút
+
+    Tham số:
+        zoom: mức hiện tại (None = vừa khung)
+        fit_zoom: mức tương ứng với chế độ vừa khung
+        direction: +1 phóng to, -1 thu nhỏ
+
+    Trả về:
+        mức mới, hoặc None nếu trở về chế độ vừa khung
+    """
+    current = fit_zoom if zoom is None else zoom
+    if direction > 0:
+        larger = [level for level in ZOOM_LEVELS if level > current * 1.001]
+        return larger[0] if larger else current
+    smaller = [level for level in ZOOM_LEVELS if fit_zoom * 1.001 < level < current * 0.999]
+    return smaller[-1] if smaller else None
+
+
+class Viewport:
+    """
+    Trạng thái khung nhìn: mức thu phóng và tâm khung nhìn
+    Tọa độ tính theo ảnh gốc ở hướng hiển thị (đã lật), tâm lưu theo tỷ lệ 0-1 của ảnh
+    nên không đổi khi thay ảnh đọc thu nhỏ bằng ảnh đầy đủ
+    """
+
+    def __init__(self):
+        self.zoom = None            # None = vừa khung, số = điểm ảnh màn hình / điểm ảnh ảnh gốc
+        self.center = (0.5, 0.5)    # Tâm khung nhìn (x, y) theo tỷ lệ kích thước ảnh
+
+    def reset(self):
+        """Về chế độ vừa khung, tâm ở giữa ảnh"""
+        self.zoom = None
+        self.center = (0.5, 0.5)
+
+    def rect(self, image_size, view_size):
+        """
+        Vùng ảnh gốc nằm trong khung nhìn
+
+        Tham số:
+            image_size: (rộng, cao) ảnh gốc
+            view_size: (rộng, cao) khung hiển thị (pixel màn hình)
+
+        Trả về:
+            (x0, y0, x1, y1) theo pixel ảnh gốc (số thực), nằm gọn trong ảnh
+        """
+        w, h = image_size
+        half_w = min(w, view_size[0] / self.zoom) / 2
+        half_h = min(h, view_size[1] / self.zoom) / 2
+        cx = min(max(self.center[0] * w, half_w), w - half_w)
+        cy = min(max(self.center[1] * h, half_h), h - half_h)
+        return cx - half_w, cy - half_h, cx + half_w, cy + half_h
+
+    def clamp(self, image_size, view_size):
+        """Kéo tâm về trong ảnh (để không kéo quá mép ảnh)"""
+        x0, y0, x1, y1 = self.rect(image_size, view_size)
+        self.center = ((x0 + x1) / 2 / image_size[0], (y0 + y1) / 2 / image_size[1])
+
+    def pan(self, dx, dy, image_size, view_size):
+        """Kéo ảnh theo dx, dy pixel màn hình (kéo sang phải → thấy phần bên trái ảnh)"""
+        self.center = (self.center[0] - dx / self.zoom / image_size[0],
+                       self.center[1] - dy / self.zoom / image_size[1])
+        self.clamp(image_size, view_size)
+
+    def zoom_at(self, zoom, anchor, image_size, view_size, fit_zoom=None):
+        """
+        Đổi mức thu phóng, giữ nguyên điểm ảnh nằm dưới con trỏ
+
+        Tham số:
+            zoom: mức mới (None = vừa khung)
+            anchor: (x, y) vị trí con trỏ so với góc trên trái ảnh đang hiển thị
+                    (None = giữa khung)
+            fit_zoom: mức của chế độ vừa khung (để giữ điểm dưới con trỏ khi phóng to từ đó)
+        """
+        if zoom is None:
+            self.reset()
+            return
+        if anchor is not None and (self.zoom is not None or fit_zoom):
+            if self.zoom is None:
+                # Vừa khung: toàn ảnh hiển thị với mức fit_zoom, góc trên trái là gốc ảnh
+                x0, y0, current = 0.0, 0.0, fit_zoom
+            else:
+                x0, y0, _, _ = self.rect(image_size, view_size)
+                current = self.zoom
+            # Điểm ảnh dưới con trỏ, sau khi đổi mức phải vẫn ở đúng vị trí đó trên màn hình
+            px, py = x0 + anchor[0] / current, y0 + anchor[1] / current
+            half_w, half_h = view_size[0] / 2, view_size[1] / 2
+            self.center = ((px - (anchor[0] - half_w) / zoom) / image_size[0],
+                           (py - (anchor[1] - half_h) / zoom) / image_size[1])
+        self.zoom = zoom
+        self.clamp(image_size, view_size)
+
+
+def chain_footprint(stages):
+    """
+    Vùng ảnh hưởng của cả chuỗi bước (xem ImageProcessor.blur_footprint)
+
+    Trả về:
+        (halo, align): halo = tổng halo từng bước, align = align lớn nhất (các align đều là
+        lũy thừa của 2 nên là bội của nhau); None nếu có bước cần toàn ảnh
+    """
+    halo, align = 0, 1
+    for stage in stages:
+        if stage.footprint is None:
+            return None
+        halo += stage.footprint[0]
+        align = max(align, stage.footprint[1])
+    return halo, align
+
+
+class TileRenderer:
+    """
+    Render khung nhìn theo lưới ô, song song trên thread pool, có cache ô đã render
+    """
+
+    def __init__(self, tile_size=TILE_SIZE, max_bytes=DEFAULT_TILE_CACHE_BYTES, workers=None):
+        """
+        Tham số:
+            tile_size: cạnh một ô (pixel ở mức đang render)
+            max_bytes: giới hạn bộ nhớ cache ô
+            workers: số luồng render ô (None = số nhân CPU)
+        """
+        self.tile_size = tile_size
+        self.cache = StageCache(max_bytes)
+        self._levels = OrderedDict()    # (khóa ảnh nguồn, mức) -> ảnh nguồn đã thu nhỏ
+        self._pool = ThreadPoolExecutor(max_workers=workers or default_workers(),
+                                        thread_name_prefix="PhotoLabViewTile")
+        self.tiles_rendered = 0         # Số ô phải render ở khung hình gần nhất
+        self.tiles_cached = 0           # Số ô lấy từ cache ở khung hình gần nhất
+        self.on_tile_ready = None       # Callback (luồng render ô) khi một ô render nền xong
+        self._inflight = {}             # khóa ô -> Future của ô đang chờ/đang render
+        self._lock = threading.Lock()
+
+    def close(self):
+        """Giải phóng thread pool"""
+        self._pool.shutdown(wait=True, cancel_futures=True)
+
+    def clear(self):
+        """Xóa cache ô và ảnh nguồn thu nhỏ, bỏ các ô chưa render (khi đổi ảnh)"""
+        with self._lock:
+            for future in self._inflight.values():
+                future.cancel()
+            self._inflight.clear()
+        self.cache.clear()
+        self._levels.clear()
+
+    def level_image(self, image, source_key, level):
+        """
+        Ảnh nguồn ở mức render level (<= 1), thu nhỏ bằng INTER_AREA như ảnh proxy xem trước
+        Chỉ giữ hai mức gần nhất
+        """
+        if level >= 1.0:
+            return image
+        key = (source_key, level)
+        scaled = self._levels.get(key)
+        if scaled is None:
+            h, w = image.shape[:2]
+            size = (max(1, int(round(w * level))), max(1, int(round(h * level))))
+            scaled = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+            self._levels[key] = scaled
+            while len(self._levels) > 2:
+                self._levels.popitem(last=False)
+        else:
+            self._levels.move_to_end(key)
+        return scaled
+
+    def render_tile(self, source, stages, footprint, tx, ty):
+        """
+        Render một ô: cắt vùng ô + halo (gốc làm tròn xuống bội số của align), chạy lần lượt
+        các bước trên vùng cắt rồi bỏ phần halo
+
+        Trả về:
+            numpy array kết quả của ô
+        """
+        h, w = source.shape[:2]
+        size = self.tile_size
+        x0, y0 = tx * size, ty * size
+        x1, y1 = min(w, x0 + size), min(h, y0 + size)
+        halo, align = footprint
+        column_align = max(align, COLUMN_ALIGN)
+        crop_x0 = max(0, (x0 - halo) // column_align * column_align)
+        crop_y0 = max(0, (y0 - halo) // align * align)
+        crop_x1 = min(w, -(-(x1 + halo) // column_align) * column_align)
+        crop_y1 = min(h, y1 + halo)
+        result = source[crop_y0:crop_y1, crop_x0:crop_x1]
+        region = (crop_y0, crop_x0, h, w)
+        for stage in stages:
+            result = stage.func(result, region=region)
+        # Bộ đệm tạm của luồng render ô không giữ lại giữa các ô
+        BUFFER_POOL.trim()
+        return result[y0 - crop_y0:y1 - crop_y0, x0 - crop_x0:x1 - crop_x0]
+
+    def render_view(self, image, source_key, compiled, level, rect, cancel_check=None,
+                    fallback=None):
+        """
+        Render vùng rect của ảnh nguồn ở mức level từ các ô
+
+        Tham số:
+            image: ảnh nguồn (base_image) ở độ phân giải đầy đủ
+            source_key: khóa định danh ảnh nguồn (đổi khi đổi ảnh)
+            compiled: CompiledPipeline đã biên dịch với scale tương ứng mức level
+            level: tỷ lệ ảnh render / ảnh nguồn (<= 1)
+            rect: (x0, y0, x1, y1) pixel nguyên ở mức level
+            cancel_check: hàm gọi giữa các ô, ném RenderCancelled nếu khung hình đã cũ
+            fallback: ảnh toàn cảnh độ phân giải thấp đã render cùng thông số (None = chờ
+                      render đủ các ô). Nếu có, ô chưa có trong cache được tạm lấy từ ảnh này
+                      phóng to và render nền; on_tile_ready được gọi khi mỗi ô xong
+
+        Trả về:
+            numpy array vùng rect đã xử lý
+        """
+        source = self.level_image(image, source_key, level)
+        h, w = source.shape[:2]
+        x0, y0, x1, y1 = rect
+        stages_key = tuple((stage.name, stage.args) for stage in compiled.stages)
+        footprint = chain_footprint(compiled.stages)
+        if footprint is None:
+            # Có bước cần toàn ảnh: render cả ảnh ở mức này một lần, coi như một ô duy nhất
+            key = (source_key, level, stages_key, 'full')
+            full = self.cache.get(key)
+            self.tiles_rendered, self.tiles_cached = (0, 1) if full is not None else (1, 0)
+            if full is None:
+                full = compiled.run(source, cancel_check=cancel_check)
+                self.cache.put(key, full)
+            return full[y0:y1, x0:x1]
+
+        size = self.tile_size
+        tiles = [(tx, ty) for ty in range(y0 // size, -(-y1 // size))
+                 for tx in range(x0 // size, -(-x1 // size))]
+        results = {}
+        missing = []
+        for tx, ty in tiles:
+            tile = self.cache.get((source_key, level, stages_key, tx, ty))
+            if tile is None:
+                missing.append((tx, ty))
+            else:
+                results[tx, ty] = tile
+        self.tiles_rendered, self.tiles_cached = len(missing), len(results)
+
+        def run(key, tx, ty):
+            # Ô có thể được khung hình sau dùng lại → không hủy giữa chừng theo khung đã gửi nó
+            try:
+                start = time.perf_counter()
+                tile = self.render_tile(source, compiled.stages, footprint, tx, ty)
+                if PROFILER.enabled:
+                    PROFILER.record('viewport/tile', start, time.perf_counter(), 'tile',
+                                    {'tile': [tx, ty], 'level': level})
+                self.cache.put(key, tile)
+            finally:
+                with self._lock:
+                    self._inflight.pop(key, None)
+            if self.on_tile_ready is not None:
+                self.on_tile_ready()
+            return tile
+
+        futures = {}
+        with self._lock:
+            keys = {(source_key, level, stages_key, tx, ty): (tx, ty) for tx, ty in missing}
+            # Ô nền của khung hình cũ (đã kéo đi chỗ khác) mà chưa bắt đầu thì bỏ
+            for key in [key for key in self._inflight if key not in keys]:
+                if self._inflight[key].cancel():
+                    del self._inflight[key]
+            for key, (tx, ty) in keys.items():
+                future = self._inflight.get(key)
+                if future is None:
+                    future = self._inflight[key] = self._pool.submit(run, key, tx, ty)
+                futures[tx, ty] = future
+
+        if fallback is not None:
+            if not missing:
+                return self._compose(results, rect, None)
+            # Ảnh tạm: vùng tương ứng của ảnh toàn cảnh, phóng to lên kích thước khung
+            fy, fx = fallback.shape[0] / h, fallback.shape[1] / w
+            crop = fallback[int(y0 * fy):max(int(y0 * fy) + 1, int(math.ceil(y1 * fy))),
+                            int(x0 * fx):max(int(x0 * fx) + 1, int(math.ceil(x1 * fx)))]
+            placeholder = cv2.resize(crop, (x1 - x0, y1 - y0), interpolation=cv2.INTER_LINEAR)
+            return self._compose(results, rect, placeholder)
+
+        try:
+            for tile, future in futures.items():
+                if cancel_check is not None:
+                    cancel_check()
+                results[tile] = future.result()
+        finally:
+            # Khung hình bị hủy: bỏ các ô chưa bắt đầu, ô đang chạy vẫn được cache ở lần sau
+            with self._lock:
+                for key, tile in keys.items():
+                    if tile not in results and self._inflight.get(key) is futures[tile] \
+                            and futures[tile].cancel():
+                        del self._inflight[key]
+        return self._compose(results, rect, None)
+
+    def _compose(self, results, rect, frame):
+        """Ghép các ô vào khung hình vùng rect (frame = ảnh tạm để vẽ đè, None = tạo mới)"""
+        x0, y0, x1, y1 = rect
+        size = self.tile_size
+        for (tx, ty), tile in results.items():
+            if frame is None:
+                frame = np.empty((y1 - y0, x1 - x0) + tile.shape[2:], dtype=tile.dtype)
+            tile_x0, tile_y0 = tx * size, ty * size
+            # Phần giao giữa ô và vùng rect
+            ix0, iy0 = max(x0, tile_x0), max(y0, tile_y0)
+            ix1, iy1 = min(x1, tile_x0 + tile.shape[1]), min(y1, tile_y0 + tile.shape[0])
+            frame[iy0 - y0:iy1 - y0, ix0 - x0:ix1 - x0] = \
+                tile[iy0 - tile_y0:iy1 - tile_y0, ix0 - tile_x0:ix1 - tile_x0]
+        return frame
+
+    def pending(self):
+        """Số ô đang chờ/đang render nền"""
+        with self._lock:
+            return len(self._inflight)
+
+
+def render_viewport(renderer, image, source_key, base_scale, compile_func, zoom, rect,
+                    flip_h=False, flip_v=False, cancel_check=None, fallback=None):
+    """
+    Render khung nhìn: chọn mức render, đổi tọa độ hiển thị sang tọa độ ảnh nguồn, ghép ô
+    và phóng to (nearest) khi mức thu phóng lớn hơn độ phân giải ảnh nguồn
+
+    Tham số:
+        renderer: TileRenderer
+        image: ảnh nguồn (base_image, hướng gốc)
+        base_scale: tỷ lệ ảnh nguồn / ảnh gốc (< 1 khi đang dùng ảnh đọc thu nhỏ)
+        compile_func: hàm scale -> CompiledPipeline (thông số filter, không gồm lật ảnh)
+        zoom: mức thu phóng (điểm ảnh màn hình / điểm ảnh ảnh gốc)
+        rect: (x0, y0, x1, y1) vùng nhìn theo pixel ảnh gốc ở hướng hiển thị (Viewport.rect)
+        flip_h, flip_v: hướng hiển thị (khung hình trả về vẫn ở hướng gốc, lật khi hiển thị)
+        fallback: ảnh xem trước toàn cảnh (hướng gốc) đã render cùng thông số - ô chưa có
+                  được tạm lấy từ đây và render nền (xem TileRenderer.render_view)
+
+    Trả về:
+        numpy array khung hình ở hướng gốc, kích thước ~ vùng nhìn x zoom
+    """
+    # Số pixel ảnh nguồn trên mỗi pixel màn hình: > 1 thì render ở ảnh thu nhỏ,
+    # <= 1 thì render ở ảnh nguồn rồi phóng to khi hiển thị
+    pixels_per_screen = zoom / base_scale
+    level = min(1.0, pixels_per_screen)
+    h, w = image.shape[:2]
+    full_w, full_h = w / base_scale, h / base_scale
+    x0, y0, x1, y1 = rect
+    # Tọa độ hiển thị (đã lật) → tọa độ ảnh nguồn (hướng gốc)
+    if flip_h:
+        x0, x1 = full_w - x1, full_w - x0
+    if flip_v:
+        y0, y1 = full_h - y1, full_h - y0
+    factor = base_scale * level
+    level_w = max(1, int(round(w * level)))
+    level_h = max(1, int(round(h * level)))
+    lx0 = min(level_w - 1, max(0, int(math.floor(x0 * factor))))
+    ly0 = min(level_h - 1, max(0, int(math.floor(y0 * factor))))
+    lx1 = max(lx0 + 1, min(level_w, int(math.ceil(x1 * factor))))
+    ly1 = max(ly0 + 1, min(level_h, int(math.ceil(y1 * factor))))
+
+    compiled = compile_func(base_scale * level)
+    frame = renderer.render_view(image, source_key, compiled, level, (lx0, ly0, lx1, ly1),
+                                 cancel_check, fallback)
+    upscale = pixels_per_screen / level
+    if upscale > 1.0:
+        size = (int(round(frame.shape[1] * upscale)), int(round(frame.shape[0] * upscale)))
+        frame = cv2.resize(frame, size, interpolation=cv2.INTER_NEAREST)
+    return frame